@@ -3,21 +3,26 @@ from typing_extensions import TypedDict
 from langchain_core.documents import Document
 from langgraph.graph import StateGraph, END
 
-from backend.nodes.loader import load_document
-from backend.nodes.splitter import split_text
-from backend.nodes.vector_store import store_vectors
+from backend.nodes.ingestion_pipeline import ingest_document
 from backend.nodes.retrieval import retrieve_chunks
 from backend.nodes.generation import generate_test_cases
 from backend.nodes.validation import check_hallucinations
 from backend.nodes.formatter import format_output
 from backend.nodes.feature_extractor import extract_features, should_extract_features
 from backend.nodes.batch_processor import process_all_features
+from backend.nodes.ingestion_cache import lookup_ingestion, record_ingestion, route_after_ingestion_lookup
 
 class GraphState(TypedDict):
     """
     Represents the state of the LangGraph workflow.
     """
     file_path: str
+    url: Optional[str]
+    url_content: Optional[bytes]  # Raw URL body fetched during the cache lookup
+    test_case_limit: Optional[int]
+    content_hash: Optional[str]  # Upload hash returned by /upload
+    doc_hash: Optional[str]  # Content hash of the input document
+    ingestion_cached: Optional[bool]  # True when chunks were restored from the ingestion cache
     documents: List[Document]
     chunks: List[Document]
     feature_name: str
@@ -33,9 +38,10 @@ def build_graph():
     workflow = StateGraph(GraphState)
     
     # Add nodes
-    workflow.add_node("file_loader", load_document)
-    workflow.add_node("text_splitter", split_text)
-    workflow.add_node("vector_store", store_vectors)
+    workflow.add_node("ingestion_cache", lookup_ingestion)
+    # Load, split and embed overlapped, with memory bounded for large inputs
+    workflow.add_node("document_ingestion", ingest_document)
+    workflow.add_node("ingestion_recorder", record_ingestion)
     workflow.add_node("feature_extractor", extract_features)  # New node
     workflow.add_node("batch_processor", process_all_features)  # New node
     workflow.add_node("feature_query", retrieve_chunks)
@@ -44,13 +50,24 @@ def build_graph():
     workflow.add_node("formatter_node", format_output)
     
     # Add edges
-    workflow.set_entry_point("file_loader")
-    workflow.add_edge("file_loader", "text_splitter")
-    workflow.add_edge("text_splitter", "vector_store")
+    workflow.set_entry_point("ingestion_cache")
+    
+    # Skip load/split/embed when the document was already ingested
+    workflow.add_conditional_edges(
+        "ingestion_cache",
+        route_after_ingestion_lookup,
+        {
+            "ingest": "document_ingestion",
+            "extract": "feature_extractor",
+            "single": "feature_query"
+        }
+    )
+    
+    workflow.add_edge("document_ingestion", "ingestion_recorder")
     
     # Conditional routing after vector store
     workflow.add_conditional_edges(
-        "vector_store",
+        "ingestion_recorder",
         should_extract_features,
         {
             "extract": "feature_extractor",  # Go to feature extraction for "all features"
@@ -0,0 +1,244 @@
+"""
+Generation Jobs
+Runs non-streaming generations on a bounded thread pool, so a graph run never
+blocks the event loop. Jobs beyond the worker and queue capacity are rejected
+instead of piling up, and finished jobs are kept for a while for polling.
+Job records are mirrored to a SQLite table shared by the worker processes, so
+any worker can answer a status or result poll.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+from backend.nodes.shared_store import SHARED_STATE_DIR, connect, worker_alive, worker_id
+
+# Generations running at the same time
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Generations allowed to wait for a worker; more are rejected with 429
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "8"))
+# Seconds a finished job's result stays available
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "3600"))
+# Finished jobs kept at most, oldest dropped first
+JOB_MAX_RETAINED = int(os.getenv("JOB_MAX_RETAINED", "1000"))
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(SHARED_STATE_DIR, "jobs.sqlite"))
+
+class JobQueueFullError(Exception):
+    """
+    Raised when JOB_WORKERS + JOB_QUEUE_SIZE jobs are already pending.
+    """
+
+class JobExecutorClosedError(Exception):
+    """
+    Raised when a job is submitted while the executor is shutting down.
+    """
+
+class Job:
+    """
+    A generation submitted to the executor.
+    """
+
+    def __init__(self, job_id: str, description: str):
+        self.id = job_id
+        self.description = description
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result = None
+        self.error: Optional[str] = None
+        self.future: Optional[Future] = None
+        self.owner = worker_id()
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "description": self.description,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+_COLUMNS = ("id", "description", "status", "created_at", "started_at", "finished_at", "error", "result", "owner")
+
+class _JobTable:
+    """
+    Job records shared by the worker processes.
+    """
+
+    def __init__(self, path: str):
+        self._conn = connect(path)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, description TEXT, status TEXT, "
+            "created_at REAL, started_at REAL, finished_at REAL, error TEXT, result TEXT, owner TEXT)"
+        )
+
+    def save(self, job: Job) -> None:
+        result = json.dumps(job.result, default=str) if job.status == "completed" else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.description, job.status, job.created_at, job.started_at, job.finished_at, job.error, result, job.owner)
+            )
+
+    def load(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        record = dict(zip(_COLUMNS, row))
+        job = Job(record["id"], record["description"])
+        for field in ("status", "created_at", "started_at", "finished_at", "error", "owner"):
+            setattr(job, field, record[field])
+        if record["result"] is not None:
+            job.result = json.loads(record["result"])
+        if job.finished_at is None and not worker_alive(job.owner):
+            job.status, job.error = "failed", "The worker running this job exited"
+        return job
+
+    def prune(self, before: float) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (before,))
+
+class JobExecutor:
+    """
+    Bounded thread pool with a job registry. The capacity is per worker
+    process, so throughput grows with the number of workers.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, queue_size: int = JOB_QUEUE_SIZE, db_path: str = JOB_DB_PATH):
+        self.capacity = max(1, workers) + max(0, queue_size)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="generation-job")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._closed = False
+        self._rejected = 0
+        self._table = _JobTable(db_path)
+
+    def submit(self, fn: Callable, *args, description: str = "") -> Job:
+        """
+        Queues fn(*args) as a job.
+
+        Raises:
+            JobQueueFullError: If the executor is at capacity
+            JobExecutorClosedError: If the executor is shutting down
+        """
+        with self._lock:
+            if self._closed:
+                raise JobExecutorClosedError("Job executor is shutting down")
+            if self._pending >= self.capacity:
+                self._rejected += 1
+                raise JobQueueFullError(f"{self._pending} jobs already pending")
+            self._pending += 1
+            job = Job(uuid.uuid4().hex, description)
+            self._jobs[job.id] = job
+            self._prune()
+        self._save(job)
+
+        try:
+            job.future = self._pool.submit(self._run, job, fn, args)
+        except RuntimeError:
+            with self._lock:
+                self._pending -= 1
+                self._jobs.pop(job.id, None)
+            raise JobExecutorClosedError("Job executor is shutting down")
+        return job
+
+    def _run(self, job: Job, fn: Callable, args: tuple):
+        job.status = "running"
+        job.started_at = time.time()
+        self._save(job)
+        try:
+            job.result = fn(*args)
+            job.status = "completed"
+            return job.result
+        except Exception as e:
+            print(f"Job {job.id} failed: {e}")
+            job.error = str(e)
+            job.status = "failed"
+            raise
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._pending -= 1
+            self._save(job)
+
+    def _save(self, job: Job) -> None:
+        try:
+            self._table.save(job)
+        except Exception as e:
+            # Other workers just cannot see this job
+            print(f"Error saving job {job.id}: {e}")
+
+    def _prune(self) -> None:
+        # Caller holds the lock; only finished jobs are dropped
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.finished_at is not None]
+        expired = [job for job in finished if now - job.finished_at > JOB_RESULT_TTL]
+        excess = max(0, len(finished) - len(expired) - JOB_MAX_RETAINED)
+        remaining = [job for job in finished if job not in expired]
+        for job in expired + remaining[:excess]:
+            self._jobs.pop(job.id, None)
+        if expired:
+            self._table.prune(now - JOB_RESULT_TTL)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """
+        Returns a job of this worker, or the shared record of a job submitted
+        to another worker.
+        """
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        job = self._table.load(job_id)
+        if job is not None and job.finished_at is not None and time.time() - job.finished_at > JOB_RESULT_TTL:
+            return None
+        return job
+
+    def stats(self) -> Dict:
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+            return {
+                "capacity": self.capacity,
+                "pending": self._pending,
+                "queued": statuses.count("queued"),
+                "running": statuses.count("running"),
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._closed = True
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+_job_executor: Optional[JobExecutor] = None
+_job_executor_lock = threading.Lock()
+
+def get_job_executor() -> JobExecutor:
+    """
+    Returns the job executor of this process, creating it and its shared
+    table on first use rather than at import.
+    """
+    global _job_executor
+    with _job_executor_lock:
+        if _job_executor is None:
+            _job_executor = JobExecutor()
+        return _job_executor
+
+def shutdown_job_executor() -> None:
+    """
+    Stops the job executor if it was ever created.
+    """
+    with _job_executor_lock:
+        executor = _job_executor
+    if executor is not None:
+        executor.shutdown()
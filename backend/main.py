@@ -1,16 +1,27 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
-import shutil
 import os
-import uuid
+import asyncio
 from backend.graph import app_graph
-from backend.streaming import stream_test_case_generation
+from backend.streaming import generation_key, stream_test_case_generation
+from backend.uploads import save_upload
+from backend.stream_jobs import StreamJob, get_stream_job, join_stream_job, parse_last_event_id, start_stream_job, stream_job_stats
+from backend.jobs import Job, JobExecutorClosedError, JobQueueFullError, get_job_executor, shutdown_job_executor
+from backend.nodes.collection_manager import list_collections, drop_collection, enforce_retention
+from backend.nodes.embedding_cache import get_cache_stats as get_embedding_cache_stats
+from backend.nodes.llm_cache import get_cache_stats as get_llm_cache_stats
+from backend.nodes.vector_backends import numpy_index_stats
+from backend.nodes.cancellation import get_cancellation_stats
+from backend.nodes.context_packer import get_context_stats
 
 app = FastAPI(title="Requirement Test Case Generator", version="1.0.0")
 
+# Seconds clients are told to wait after a 429
+JOB_RETRY_AFTER = int(os.getenv("JOB_RETRY_AFTER", "5"))
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -25,6 +36,15 @@ class GenerateRequest(BaseModel):
     feature_name: str
     test_case_limit: Optional[int] = None
     url: Optional[str] = None
+    content_hash: Optional[str] = None  # Returned by /upload; lets ingestion skip re-hashing the file
+
+@app.on_event("startup")
+def start_jobs():
+    get_job_executor()
+
+@app.on_event("shutdown")
+def shutdown_jobs():
+    shutdown_job_executor()
 
 @app.get("/")
 async def root():
@@ -34,59 +54,209 @@ async def root():
 async def status():
     return {"status": "ok"}
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Returns cache counters for monitoring.
+    """
+    return {
+        "embedding_cache": await asyncio.to_thread(get_embedding_cache_stats),
+        "llm_cache": get_llm_cache_stats(),
+        "numpy_indexes": numpy_index_stats(),
+        "jobs": get_job_executor().stats(),
+        "streams": stream_job_stats(),
+        "cancellation": get_cancellation_stats(),
+        "context": get_context_stats()
+    }
+
 @app.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
+    """
+    Streams the upload to disk off the event loop. Files are stored under
+    their content hash, so uploading the same file again reuses it.
+    """
     try:
-        upload_dir = "uploads"
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join(upload_dir, unique_filename)
-        
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        return {"file_path": file_path, "filename": file.filename}
+        return await save_upload(file)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _graph_inputs(request: GenerateRequest) -> dict:
+    return {
+        "file_path": request.file_path,
+        "feature_name": request.feature_name,
+        "test_case_limit": request.test_case_limit,
+        "url": request.url,
+        "content_hash": request.content_hash,
+        # Initialize other state variables if needed, though TypedDict handles missing keys gracefully if not required
+        "documents": [],
+        "chunks": [],
+        "retrieved_chunks": [],
+        "generated_test_cases": [],
+        "hallucination_errors": [],
+        "final_output": {}
+    }
+
+def _run_graph(inputs: dict) -> dict:
+    # Runs on a job worker thread
+    return app_graph.invoke(inputs)["final_output"]
+
+def _submit_generation(request: GenerateRequest) -> Job:
+    try:
+        return get_job_executor().submit(_run_graph, _graph_inputs(request), description=request.feature_name)
+    except JobQueueFullError as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Too many generations in progress ({e}), retry later",
+            headers={"Retry-After": str(JOB_RETRY_AFTER)}
+        )
+    except JobExecutorClosedError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
 @app.post("/generate")
 async def generate_test_cases(request: GenerateRequest):
+    """
+    Runs a generation on the job executor and waits for its result without
+    blocking the event loop. Answers 429 when the executor is full.
+    """
+    job = _submit_generation(request)
     try:
-        inputs = {
-            "file_path": request.file_path,
-            "feature_name": request.feature_name,
-            # Initialize other state variables if needed, though TypedDict handles missing keys gracefully if not required
-            "documents": [],
-            "chunks": [],
-            "retrieved_chunks": [],
-            "generated_test_cases": [],
-            "hallucination_errors": [],
-            "final_output": {}
-        }
-        
-        result = app_graph.invoke(inputs)
-        return result["final_output"]
+        return await asyncio.wrap_future(job.future)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/jobs", status_code=202)
+async def submit_job(request: GenerateRequest):
+    """
+    Queues a generation and returns its job id right away; poll
+    /jobs/{job_id} and fetch /jobs/{job_id}/result when it has completed.
+    """
+    return _submit_generation(request).to_dict()
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Returns the status of a generation job.
+    """
+    job = await asyncio.to_thread(get_job_executor().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """
+    Returns the output of a completed job; 409 while it is still pending.
+    """
+    job = await asyncio.to_thread(get_job_executor().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status != "completed":
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {job.status}")
+    return job.result
+
+_SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+}
+
+def _follow_response(job: StreamJob, after: int = 0) -> StreamingResponse:
+    return StreamingResponse(
+        job.follow(after),
+        media_type="text/event-stream",
+        headers={**_SSE_HEADERS, "X-Job-Id": job.id}
+    )
+
 @app.post("/generate-stream")
-async def generate_test_cases_stream(request: GenerateRequest):
+async def generate_test_cases_stream(request: GenerateRequest, last_event_id: Optional[str] = Header(None)):
     """
     Streaming endpoint for progressive test case generation.
     Uses Server-Sent Events (SSE) to send test cases as they're generated.
+    The run continues if the client disconnects; sending the same request
+    again with a Last-Event-ID header reattaches to it instead of restarting.
+    A request identical to a running one joins that run and first receives
+    the events it has already emitted.
     """
-    return StreamingResponse(
+    resume = parse_last_event_id(last_event_id)
+    if resume:
+        job = await get_stream_job(resume[0])
+        if job is not None:
+            print(f"---REATTACHING TO JOB {job.id} AFTER EVENT {resume[1]}---")
+            return _follow_response(job, resume[1])
+
+    key = await asyncio.to_thread(
+        generation_key,
+        request.file_path,
+        request.feature_name,
+        request.test_case_limit,
+        request.url,
+        request.content_hash
+    )
+    job = await join_stream_job(key)
+    if job is not None:
+        print(f"---JOINING RUNNING JOB {job.id}---")
+        return _follow_response(job)
+
+    job = await start_stream_job(
         stream_test_case_generation(
             request.file_path, 
             request.feature_name, 
             request.test_case_limit,
-            request.url
+            request.url,
+            request.content_hash
         ),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-        }
+        key=key
     )
+    return _follow_response(job)
+
+@app.get("/generate-stream/{job_id}")
+async def resume_test_cases_stream(job_id: str, after: int = 0, last_event_id: Optional[str] = Header(None)):
+    """
+    Replays a streaming run's events after Last-Event-ID (or ?after=<seq>)
+    and follows it while it is still running.
+    """
+    job = await get_stream_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    resume = parse_last_event_id(last_event_id)
+    if resume and resume[0] == job_id:
+        after = resume[1]
+    return _follow_response(job, after)
+
+@app.post("/generate-stream/{job_id}/cancel")
+async def cancel_test_cases_stream(job_id: str):
+    """
+    Stops a streaming run: pending features and validations are dropped and
+    open model streams are closed. Sent by the frontend's Stop button. A run
+    shared by coalesced requests keeps going until all of them have stopped.
+    """
+    job = await get_stream_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    cancelled, remaining = await job.release("client_stop")
+    return {"job_id": job_id, "cancelled": cancelled, "subscribers": remaining}
+
+@app.get("/collections")
+async def get_collections():
+    """
+    Lists the per-document vector collections, most recently used first.
+    """
+    return {"collections": list_collections()}
+
+@app.delete("/collections/{name}")
+async def delete_collection(name: str):
+    """
+    Drops a document collection together with its cached ingestion.
+    """
+    if not await asyncio.to_thread(drop_collection, name):
+        raise HTTPException(status_code=404, detail=f"Collection {name} not found")
+    return {"dropped": name}
+
+@app.post("/collections/gc")
+async def collect_garbage():
+    """
+    Applies the TTL/LRU/size retention policy immediately.
+    """
+    evicted = await asyncio.to_thread(enforce_retention)
+    return {"evicted": evicted}
@@ -1,16 +1,104 @@
 """
 Batch Processor for Multiple Features
-Processes multiple features sequentially to generate test cases for each
+Processes multiple features concurrently (bounded by FEATURE_CONCURRENCY) to
+generate test cases for each, aggregating results in extraction order
 """
+import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
-from backend.nodes.retrieval import retrieve_chunks
+from backend.nodes.retrieval import retrieve_chunks, retrieve_chunks_bulk
 from backend.nodes.generation import generate_test_cases
 from backend.nodes.validation import check_hallucinations
+from backend.nodes.cancellation import GenerationCancelled, with_current_context
+
+# Number of features processed at the same time (retrieve -> generate -> validate)
+FEATURE_CONCURRENCY = max(1, int(os.getenv("FEATURE_CONCURRENCY", "3")))
+
+def process_feature(state, feature, idx, total, retrieved_chunks=None):
+    """
+    Runs retrieval, generation and validation for a single feature.
+    Retrieval is skipped when the chunks were already fetched in bulk.
+    
+    Returns:
+        Dict with the feature name, description, test cases, hallucination
+        errors and, if processing failed, an "error" message
+    """
+    feature_name = feature.get("name", f"Feature {idx}")
+    feature_desc = feature.get("description", "")
+    
+    print(f"\n--- Processing Feature {idx}/{total}: {feature_name} ---")
+    
+    try:
+        # Create a temporary state for this feature
+        feature_state = {
+            **state,
+            "feature_name": feature_name,
+            "retrieved_chunks": [],
+            "generated_test_cases": [],
+            "hallucination_errors": []
+        }
+        
+        # Step 1: Retrieve relevant chunks for this feature
+        if retrieved_chunks is not None:
+            feature_state["retrieved_chunks"] = retrieved_chunks
+        else:
+            retrieval_result = retrieve_chunks(feature_state)
+            feature_state.update(retrieval_result)
+        
+        # Step 2: Generate test cases for this feature
+        generation_result = generate_test_cases(feature_state)
+        feature_state.update(generation_result)
+        
+        # Step 3: Check for hallucinations
+        validation_result = check_hallucinations(feature_state)
+        feature_state.update(validation_result)
+        
+        # Add feature metadata to each test case
+        feature_test_cases = feature_state.get("generated_test_cases", [])
+        for tc in feature_test_cases:
+            tc["feature"] = feature_name
+            tc["feature_description"] = feature_desc
+        
+        print(f"Generated {len(feature_test_cases)} test cases for {feature_name}")
+        
+        return {
+            "name": feature_name,
+            "description": feature_desc,
+            "test_cases": feature_test_cases,
+            "hallucination_errors": feature_state.get("hallucination_errors", [])
+        }
+        
+    except GenerationCancelled:
+        raise
+    except Exception as e:
+        print(f"Error processing feature '{feature_name}': {e}")
+        return {
+            "name": feature_name,
+            "description": feature_desc,
+            "test_cases": [],
+            "hallucination_errors": [],
+            "error": f"Error processing feature '{feature_name}': {str(e)}"
+        }
+
+def prefetch_retrievals(state, features):
+    """
+    Retrieves chunks for all features with one bulk query.
+    Falls back to per-feature retrieval (None entries) if the bulk query fails.
+    """
+    names = [feature.get("name", f"Feature {idx}") for idx, feature in enumerate(features, 1)]
+    try:
+        return retrieve_chunks_bulk(state, names)
+    except GenerationCancelled:
+        raise
+    except Exception as e:
+        print(f"Bulk retrieval failed, retrieving per feature: {e}")
+        return [None] * len(features)
 
 def process_all_features(state):
     """
-    Processes all extracted features sequentially.
-    Generates test cases for each feature and aggregates results.
+    Processes all extracted features with a bounded worker pool.
+    Generates test cases for each feature and aggregates results in the
+    order the features were extracted, regardless of completion order.
     """
     print("---PROCESSING ALL FEATURES---")
     
@@ -39,58 +127,33 @@ def process_all_features(state):
     all_hallucination_errors = []
     processed_features = []
     
-    print(f"Processing {len(extracted_features)} features...")
+    total = len(extracted_features)
+    print(f"Processing {total} features with concurrency {FEATURE_CONCURRENCY}...")
+    
+    prefetched = prefetch_retrievals(state, extracted_features)
     
-    for idx, feature in enumerate(extracted_features, 1):
-        feature_name = feature.get("name", f"Feature {idx}")
-        feature_desc = feature.get("description", "")
+    with ThreadPoolExecutor(max_workers=FEATURE_CONCURRENCY) as pool:
+        # map() yields results in submission order, keeping the aggregate deterministic
+        results = list(pool.map(
+            with_current_context(lambda item: process_feature(state, item[1], item[0], total, prefetched[item[0] - 1])),
+            enumerate(extracted_features, 1)
+        ))
+    
+    for result in results:
+        if result.get("error"):
+            all_hallucination_errors.append(result["error"])
+            continue
         
-        print(f"\n--- Processing Feature {idx}/{len(extracted_features)}: {feature_name} ---")
+        # Aggregate results
+        all_test_cases.extend(result["test_cases"])
+        all_hallucination_errors.extend(result["hallucination_errors"])
         
-        try:
-            # Create a temporary state for this feature
-            feature_state = {
-                **state,
-                "feature_name": feature_name,
-                "retrieved_chunks": [],
-                "generated_test_cases": [],
-                "hallucination_errors": []
-            }
-            
-            # Step 1: Retrieve relevant chunks for this feature
-            retrieval_result = retrieve_chunks(feature_state)
-            feature_state.update(retrieval_result)
-            
-            # Step 2: Generate test cases for this feature
-            generation_result = generate_test_cases(feature_state)
-            feature_state.update(generation_result)
-            
-            # Step 3: Check for hallucinations
-            validation_result = check_hallucinations(feature_state)
-            feature_state.update(validation_result)
-            
-            # Add feature metadata to each test case
-            feature_test_cases = feature_state.get("generated_test_cases", [])
-            for tc in feature_test_cases:
-                tc["feature"] = feature_name
-                tc["feature_description"] = feature_desc
-            
-            # Aggregate results
-            all_test_cases.extend(feature_test_cases)
-            all_hallucination_errors.extend(feature_state.get("hallucination_errors", []))
-            
-            processed_features.append({
-                "name": feature_name,
-                "description": feature_desc,
-                "test_case_count": len(feature_test_cases),
-                "hallucination_count": len(feature_state.get("hallucination_errors", []))
-            })
-            
-            print(f"Generated {len(feature_test_cases)} test cases for {feature_name}")
-            
-        except Exception as e:
-            print(f"Error processing feature '{feature_name}': {e}")
-            all_hallucination_errors.append(f"Error processing feature '{feature_name}': {str(e)}")
+        processed_features.append({
+            "name": result["name"],
+            "description": result["description"],
+            "test_case_count": len(result["test_cases"]),
+            "hallucination_count": len(result["hallucination_errors"])
+        })
     
     print(f"\n--- Batch Processing Complete ---")
     print(f"Total features processed: {len(processed_features)}")
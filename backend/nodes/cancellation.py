@@ -0,0 +1,207 @@
+"""
+Cancellation
+Cancel tokens for generation runs. The token of the current run travels in a
+context variable, so worker threads started for the run can see it and skip
+LLM and embedding calls once the client has stopped or gone away. Calls
+already in flight run as tasks on a background event loop and are cancelled
+with the run, which closes their HTTP requests.
+"""
+import asyncio
+import contextlib
+import contextvars
+import queue
+import threading
+from collections import Counter
+from concurrent.futures import CancelledError
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional
+
+class GenerationCancelled(Exception):
+    """
+    Raised in place of an LLM or embedding call for a cancelled run.
+    """
+
+class CancelToken:
+    """
+    Set once when a run is cancelled; checked by workers before expensive calls.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+        self.reason: Optional[str] = None
+
+    def cancel(self, reason: str) -> bool:
+        """
+        Cancels the run and calls the registered callbacks. Returns False if
+        it was already cancelled.
+        """
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback()
+        return True
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        """
+        Registers callback to be called on cancellation; it is called at once
+        if the run is already cancelled.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+_current_token: contextvars.ContextVar = contextvars.ContextVar("cancel_token", default=None)
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_END = object()
+
+def set_current_token(token: CancelToken) -> None:
+    """
+    Makes token the cancel token of the calling task or thread and of the
+    tasks and threads it starts afterwards.
+    """
+    _current_token.set(token)
+
+def is_cancelled() -> bool:
+    token = _current_token.get()
+    return token is not None and token.cancelled
+
+def check_cancelled(kind: str) -> None:
+    """
+    Raises GenerationCancelled if the current run was cancelled, counting the
+    skipped call under kind (e.g. "llm_calls.validation").
+    """
+    if is_cancelled():
+        record_skipped(kind)
+        raise GenerationCancelled(f"Generation cancelled: {_current_token.get().reason}")
+
+def record_skipped(kind: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _stats[kind] += amount
+
+def with_current_context(fn: Callable) -> Callable:
+    """
+    Wraps fn for a thread pool so each call runs in a copy of the submitting
+    thread's context and sees its cancel token.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the background event loop that runs abortable model calls.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="model-calls", daemon=True).start()
+            _loop = loop
+        return _loop
+
+def call_abortable(kind: str, make_call: Callable[[], Awaitable]):
+    """
+    Runs an async LLM or embedding call on the background loop and waits for
+    its result. Cancelling the current run cancels the call's task, which
+    closes its HTTP request instead of letting it run to completion.
+
+    Args:
+        kind: Counter for aborted calls (e.g. "llm_calls_aborted.validation")
+        make_call: Returns the coroutine of the call
+
+    Raises:
+        GenerationCancelled: If the run was cancelled during the call
+    """
+    token = _current_token.get()
+    future = asyncio.run_coroutine_threadsafe(make_call(), _get_loop())
+    if token is None:
+        return future.result()
+
+    token.add_callback(future.cancel)
+    try:
+        return future.result()
+    except CancelledError:
+        record_skipped(kind)
+        raise GenerationCancelled(f"Generation cancelled: {token.reason}")
+    finally:
+        token.remove_callback(future.cancel)
+
+def stream_abortable(kind: str, make_stream: Callable[[], AsyncIterator]) -> Iterator:
+    """
+    Iterates an async LLM stream on the background loop, yielding its items
+    in the calling thread. Cancelling the current run, or closing this
+    generator, cancels the stream and closes its HTTP request, even while the
+    model has not produced its first token yet.
+
+    Raises:
+        GenerationCancelled: If the run was cancelled during the stream
+    """
+    items = queue.Queue()
+
+    async def pump():
+        try:
+            # Closing the stream releases its HTTP response right away
+            async with contextlib.aclosing(make_stream()) as stream:
+                async for item in stream:
+                    items.put((item, None))
+        except BaseException as e:
+            items.put((_END, e))
+            raise
+        items.put((_END, None))
+
+    def abort():
+        future.cancel()
+        # The task may be cancelled before it starts and never report back
+        items.put((_END, CancelledError()))
+
+    token = _current_token.get()
+    future = asyncio.run_coroutine_threadsafe(pump(), _get_loop())
+    if token is not None:
+        token.add_callback(abort)
+    try:
+        while True:
+            item, error = items.get()
+            if item is _END:
+                if isinstance(error, (CancelledError, asyncio.CancelledError)):
+                    record_skipped(kind)
+                    raise GenerationCancelled(f"Generation cancelled: {token.reason if token else 'stream closed'}")
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        if token is not None:
+            token.remove_callback(abort)
+        # Closes the model's HTTP stream if the consumer stopped early
+        future.cancel()
+
+def get_cancellation_stats() -> Dict:
+    """
+    Returns the number of cancelled runs (by reason) and of the calls, features
+    and validations they skipped.
+    """
+    with _stats_lock:
+        return dict(sorted(_stats.items()))
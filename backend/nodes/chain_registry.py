@@ -0,0 +1,40 @@
+"""
+Chain Registry
+Holds the prompt templates of every LLM stage and hands out compiled chains
+built once per prompt and LLM client, instead of rebuilding
+PromptTemplate | llm | JsonOutputParser() on every call.
+"""
+import threading
+from langchain_core.prompts import PromptTemplate
+from langchain_core.output_parsers import JsonOutputParser
+from backend.nodes.llm_cache import CachedChain
+from backend.nodes.llm_provider import get_llm
+
+_prompts = {}
+_chains = {}
+_lock = threading.Lock()
+
+def register_prompt(name, stage, template, input_variables):
+    """
+    Registers a prompt template under a name.
+    
+    Args:
+        name: Registry name used by get_chain
+        stage: Response cache stage ("generation", "validation" or "extraction")
+        template: Prompt template text
+        input_variables: Variables the template expects
+    """
+    with _lock:
+        _prompts[name] = (stage, PromptTemplate(template=template, input_variables=input_variables))
+
+def get_chain(name, temperature=0, format_json=True):
+    """
+    Returns the compiled chain for a registered prompt and the current LLM client.
+    """
+    llm = get_llm(temperature=temperature, format_json=format_json)
+    key = (name, id(llm))
+    with _lock:
+        if key not in _chains:
+            stage, prompt = _prompts[name]
+            _chains[key] = CachedChain(stage, prompt, llm, JsonOutputParser())
+        return _chains[key]
@@ -0,0 +1,150 @@
+"""
+Chunk Spool
+Disk-backed chunk lists for very large documents. Chunks are kept as JSON lines
+in a file and only their byte offsets stay in memory, so holding (and passing
+around) the chunks of a multi-hundred-MB document costs a few bytes per chunk.
+"""
+import json
+import os
+import tempfile
+import threading
+from array import array
+from collections.abc import Sequence
+from typing import Iterable, Iterator, List, Optional
+
+from langchain_core.documents import Document
+
+# Chunks held in memory before a ChunkStore spills to disk
+INGEST_SPOOL_CHUNKS = int(os.getenv("INGEST_SPOOL_CHUNKS", "5000"))
+# Directory for spool files of in-flight ingestions
+SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR") or tempfile.gettempdir()
+
+def chunk_to_line(chunk: Document) -> bytes:
+    """
+    Serializes a chunk to one JSON line.
+    """
+    record = {"page_content": chunk.page_content, "metadata": chunk.metadata}
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+def line_to_chunk(line: bytes) -> Document:
+    """
+    Parses a JSON line written by chunk_to_line.
+    """
+    record = json.loads(line)
+    return Document(page_content=record["page_content"], metadata=record.get("metadata", {}))
+
+class ChunkFile(Sequence):
+    """
+    Read-only sequence of the chunks stored as JSON lines in a file.
+    Chunks are parsed on access; only line offsets are kept in memory.
+    """
+
+    def __init__(self, path: str, offsets: array, owned: bool = False):
+        self.path = path
+        self._offsets = offsets
+        self._owned = owned
+        self._file = open(path, "rb")
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path: str, skip_lines: int = 0) -> "ChunkFile":
+        """
+        Indexes an existing JSON-lines chunk file, skipping header lines.
+        """
+        offsets = array("q")
+        with open(path, "rb") as f:
+            for _ in range(skip_lines):
+                f.readline()
+            position = f.tell()
+            for line in f:
+                if line.strip():
+                    offsets.append(position)
+                position += len(line)
+        return cls(path, offsets)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def _read(self, index: int) -> Document:
+        with self._lock:
+            self._file.seek(self._offsets[index])
+            return line_to_chunk(self._file.readline())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._read(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chunk index out of range")
+        return self._read(index)
+
+    def __iter__(self) -> Iterator[Document]:
+        for i in range(len(self)):
+            yield self._read(i)
+
+    def __del__(self):
+        try:
+            self._file.close()
+            if self._owned:
+                os.remove(self.path)
+        except Exception:
+            pass
+
+class ChunkStore:
+    """
+    Append-only chunk list that keeps up to INGEST_SPOOL_CHUNKS chunks in
+    memory and spills everything to a spool file beyond that.
+    """
+
+    def __init__(self, spill_after: int = INGEST_SPOOL_CHUNKS):
+        self.spill_after = spill_after
+        self._memory: List[Document] = []
+        self._writer = None
+        self._offsets: Optional[array] = None
+        self._path = None
+        self._position = 0
+        self._reader: Optional[ChunkFile] = None
+
+    def extend(self, chunks: Iterable[Document]) -> None:
+        if self._reader is not None:
+            raise RuntimeError("ChunkStore is closed for writing")
+        for chunk in chunks:
+            if self._writer is None:
+                self._memory.append(chunk)
+                if len(self._memory) > self.spill_after:
+                    self._spill()
+            else:
+                self._write(chunk)
+
+    def _spill(self) -> None:
+        fd, self._path = tempfile.mkstemp(prefix="chunks_", suffix=".jsonl", dir=SPOOL_DIR)
+        self._writer = os.fdopen(fd, "wb")
+        self._offsets = array("q")
+        print(f"Spooling chunks to {self._path}")
+        for chunk in self._memory:
+            self._write(chunk)
+        self._memory = []
+
+    def _write(self, chunk: Document) -> None:
+        line = chunk_to_line(chunk)
+        self._offsets.append(self._position)
+        self._writer.write(line)
+        self._position += len(line)
+
+    def seal(self) -> Sequence:
+        """
+        Finishes writing and returns the chunks as a read-only sequence:
+        the in-memory list, or a ChunkFile that removes the spool when freed.
+        """
+        if self._writer is None:
+            return self._memory if self._reader is None else self._reader
+        self._writer.close()
+        self._writer = None
+        self._reader = ChunkFile(self._path, self._offsets, owned=True)
+        return self._reader
+
+    def __len__(self) -> int:
+        if self._reader is not None:
+            return len(self._reader)
+        return len(self._offsets) if self._writer is not None else len(self._memory)
@@ -0,0 +1,260 @@
+"""
+Collection Manager
+Keeps one Chroma collection per ingested document and bounds the on-disk index
+with TTL, LRU and size-cap eviction. Each document's collection lives in its
+own persist directory written by one worker at a time, and the registry is a
+SQLite table, so several uvicorn workers can share ./chroma_db.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+import chromadb
+from chromadb.errors import NotFoundError
+from typing import Dict, List, Optional
+from backend.nodes.shared_store import FileLock, connect
+
+PERSIST_DIR = "./chroma_db"
+REGISTRY_DB_PATH = os.path.join(PERSIST_DIR, "registry.sqlite")
+# Registry format used before the SQLite table; imported once
+LEGACY_REGISTRY_PATH = os.path.join(PERSIST_DIR, "collections.json")
+
+# Retention policy
+COLLECTION_TTL_HOURS = float(os.getenv("COLLECTION_TTL_HOURS", "168"))
+MAX_COLLECTIONS = int(os.getenv("MAX_COLLECTIONS", "50"))
+MAX_INDEX_MB = float(os.getenv("CHROMA_MAX_DISK_MB", "2048"))
+
+_FIELDS = ("doc_hash", "source", "chunk_count", "approx_bytes", "created_at", "last_used", "path")
+
+def collection_name_for(doc_hash: str) -> str:
+    """
+    Returns the Chroma collection name used for a document hash.
+    """
+    return f"doc_{doc_hash[:32]}"
+
+def collection_lock(name: str) -> FileLock:
+    """
+    Returns the cross-process lock serializing writes to one collection.
+    """
+    return FileLock(f"collection-{name}")
+
+_clients = {}
+_client_lock = threading.Lock()
+
+def get_client(path: str = PERSIST_DIR):
+    """
+    Returns the persistent Chroma client for a directory: the shared root
+    (legacy collections) or a document's own directory. Creating clients
+    concurrently from worker threads is not safe, so clients are created
+    under a lock and shared.
+    """
+    with _client_lock:
+        client = _clients.get(path)
+        if client is None:
+            client = chromadb.PersistentClient(path=path)
+            _clients[path] = client
+        return client
+
+def close_client(path: str) -> None:
+    """
+    Closes the client of a document directory, releasing its SQLite handles.
+    """
+    with _client_lock:
+        client = _clients.pop(path, None)
+    close = getattr(client, "close", None)
+    if close:
+        try:
+            close()
+        except Exception as e:
+            print(f"Error closing Chroma client for {path}: {e}")
+
+def new_collection_path(name: str) -> str:
+    """
+    Returns a fresh persist directory for a collection. Every write gets its
+    own directory, so a rewrite never touches files other workers have open.
+    """
+    return os.path.join(PERSIST_DIR, f"{name}-{uuid.uuid4().hex[:8]}")
+
+_db = None
+_db_lock = threading.Lock()
+
+def _registry():
+    # Caller holds _db_lock
+    global _db
+    if _db is None:
+        conn = connect(REGISTRY_DB_PATH)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS collections ("
+            "name TEXT PRIMARY KEY, doc_hash TEXT, source TEXT, chunk_count INTEGER, "
+            "approx_bytes INTEGER, created_at REAL, last_used REAL, path TEXT)"
+        )
+        _import_legacy_registry(conn)
+        _db = conn
+    return _db
+
+def _import_legacy_registry(conn) -> None:
+    if not os.path.exists(LEGACY_REGISTRY_PATH):
+        return
+    try:
+        with open(LEGACY_REGISTRY_PATH, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
+        for name, entry in legacy.items():
+            conn.execute(
+                "INSERT OR IGNORE INTO collections VALUES (?, ?, ?, ?, ?, ?, ?, NULL)",
+                (name, *(entry.get(field) for field in _FIELDS[:-1]))
+            )
+        os.replace(LEGACY_REGISTRY_PATH, f"{LEGACY_REGISTRY_PATH}.imported")
+        print(f"Imported {len(legacy)} collections from {LEGACY_REGISTRY_PATH}")
+    except Exception as e:
+        print(f"Ignoring unreadable collection registry: {e}")
+
+def _row_to_entry(row) -> Dict:
+    return dict(zip(("name",) + _FIELDS, row))
+
+def get_collection_entry(name: str) -> Optional[Dict]:
+    """
+    Returns the registry entry of a collection, or None.
+    """
+    with _db_lock:
+        row = _registry().execute(
+            f"SELECT name, {', '.join(_FIELDS)} FROM collections WHERE name = ?", (name,)
+        ).fetchone()
+    return _row_to_entry(row) if row else None
+
+def register_collection(name: str, doc_hash: str, source: str, chunk_count: int, approx_bytes: int, path: Optional[str] = None) -> None:
+    """
+    Records a freshly written collection in the registry, replacing any
+    previous entry of the same name.
+    """
+    now = time.time()
+    with _db_lock:
+        _registry().execute(
+            "INSERT OR REPLACE INTO collections VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (name, doc_hash, source, chunk_count, approx_bytes, now, now, path)
+        )
+
+def touch_collection(name: str) -> None:
+    """
+    Marks a collection as recently used for LRU eviction.
+    """
+    with _db_lock:
+        _registry().execute("UPDATE collections SET last_used = ? WHERE name = ?", (time.time(), name))
+
+def has_collection(doc_hash: str) -> bool:
+    """
+    Checks whether a populated collection exists for the document hash.
+    """
+    entry = get_collection_entry(collection_name_for(doc_hash))
+    return bool(entry and (entry.get("chunk_count") or 0) > 0)
+
+def list_collections() -> List[Dict]:
+    """
+    Returns registry entries, most recently used first.
+    """
+    with _db_lock:
+        rows = _registry().execute(
+            f"SELECT name, {', '.join(_FIELDS)} FROM collections ORDER BY last_used DESC"
+        ).fetchall()
+    return [_row_to_entry(row) for row in rows]
+
+def remove_collection_files(path: Optional[str], name: str) -> None:
+    """
+    Deletes a collection's persist directory, or the collection itself from the
+    shared root directory for collections written before partitioning.
+    """
+    if path:
+        close_client(path)
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    try:
+        get_client().delete_collection(name)
+    except (NotFoundError, ValueError):
+        pass
+    except Exception as e:
+        print(f"Collection {name} not deleted from Chroma: {e}")
+
+def drop_collection(name: str) -> bool:
+    """
+    Drops a collection, its registry entry and the cached ingestion manifest.
+    Returns False if the collection is unknown.
+    """
+    from backend.nodes.ingestion_cache import invalidate
+    from backend.nodes.vector_store import release_index
+
+    with collection_lock(name):
+        entry = get_collection_entry(name)
+        if entry is None:
+            return False
+        with _db_lock:
+            _registry().execute("DELETE FROM collections WHERE name = ?", (name,))
+        release_index(name)
+        remove_collection_files(entry.get("path"), name)
+    if entry.get("doc_hash"):
+        invalidate(entry["doc_hash"])
+    print(f"Dropped collection {name}.")
+    return True
+
+def enforce_retention(protect: Optional[str] = None) -> List[str]:
+    """
+    Evicts collections that exceed the TTL, then least recently used ones until
+    both the collection count and the approximate index size are within limits.
+    The protected collection (usually the one just written) is never evicted.
+    
+    Returns:
+        Names of the evicted collections
+    """
+    now = time.time()
+    ttl_seconds = COLLECTION_TTL_HOURS * 3600
+    max_bytes = MAX_INDEX_MB * 1024 * 1024
+
+    entries = list(reversed(list_collections()))  # Least recently used first
+    to_evict = []
+
+    for entry in entries:
+        if entry["name"] != protect and now - (entry.get("last_used") or 0) > ttl_seconds:
+            to_evict.append(entry["name"])
+
+    remaining = [e for e in entries if e["name"] not in to_evict]
+    total_bytes = sum(e.get("approx_bytes") or 0 for e in remaining)
+
+    for entry in list(remaining):
+        if len(remaining) <= MAX_COLLECTIONS and total_bytes <= max_bytes:
+            break
+        if entry["name"] == protect:
+            continue
+        to_evict.append(entry["name"])
+        remaining.remove(entry)
+        total_bytes -= entry.get("approx_bytes") or 0
+
+    for name in to_evict:
+        drop_collection(name)
+
+    if to_evict:
+        print(f"Evicted {len(to_evict)} collections: {to_evict}")
+    _remove_orphaned_dirs()
+    return to_evict
+
+def _remove_orphaned_dirs() -> None:
+    # Directories left by failed writes, or recreated by a worker still
+    # reading a collection after it was rewritten or evicted
+    try:
+        names = os.listdir(PERSIST_DIR)
+    except OSError:
+        return
+    for dirname in names:
+        name, _, suffix = dirname.rpartition("-")
+        path = os.path.join(PERSIST_DIR, dirname)
+        if not name.startswith("doc_") or len(suffix) != 8 or not os.path.isdir(path):
+            continue
+        lock = collection_lock(name)
+        # A held lock means the directory may be one being written
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            entry = get_collection_entry(name)
+            if entry is None or os.path.normpath(entry.get("path") or "") != os.path.normpath(path):
+                remove_collection_files(path, name)
+        finally:
+            lock.release()
@@ -0,0 +1,222 @@
+"""
+Context Packer
+Builds the requirement text sent to the LLM from retrieved chunks. Chunks that
+overlap (neighbours sharing the splitter's overlap) are merged, duplicates and
+near-duplicates are dropped, and the rest is kept in relevance order up to a
+token budget for the current model, so prompts stay inside the context window
+and carry no repeated text.
+"""
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+from langchain_core.documents import Document
+from backend.nodes.llm_provider import OLLAMA_NUM_CTX, get_model_name, get_provider_name
+from backend.nodes.splitter import CHUNK_OVERLAP
+
+# Fixed token budget for the packed context; overrides the per-model budget
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0"))
+# Upper bound of the per-model budget, so large context windows do not inflate prompts
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "4000"))
+# Tokens of the context window kept free for the prompt template and the reply
+CONTEXT_RESERVE_TOKENS = int(os.getenv("CONTEXT_RESERVE_TOKENS", "1024"))
+# Word shingle similarity above which a chunk counts as a near-duplicate
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.9"))
+# Characters per token used to estimate prompt size
+CHARS_PER_TOKEN = 4
+
+# Context windows of the hosted models, in tokens
+MODEL_CONTEXT_WINDOWS = {
+    "llama-3.3-70b-versatile": 131072,
+}
+
+# Shortest shared text taken as splitter overlap rather than coincidence
+_MIN_OVERLAP = 20
+# Remaining budget below which a piece is dropped instead of truncated
+_MIN_PIECE_TOKENS = 50
+_SEPARATOR = "\n\n"
+
+_stats: Dict[str, Dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+def estimate_tokens(text: str) -> int:
+    """
+    Approximates the token count of a text without a model tokenizer.
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def get_context_budget(provider: Optional[str] = None) -> int:
+    """
+    Returns the token budget for the packed context of the current model:
+    CONTEXT_TOKEN_BUDGET if set, otherwise the model's context window less
+    CONTEXT_RESERVE_TOKENS, capped at CONTEXT_MAX_TOKENS.
+    """
+    if CONTEXT_TOKEN_BUDGET > 0:
+        return CONTEXT_TOKEN_BUDGET
+    provider = provider or get_provider_name()
+    if provider == "ollama":
+        window = OLLAMA_NUM_CTX
+    else:
+        window = MODEL_CONTEXT_WINDOWS.get(get_model_name(provider), CONTEXT_MAX_TOKENS + CONTEXT_RESERVE_TOKENS)
+    return max(_MIN_PIECE_TOKENS, min(CONTEXT_MAX_TOKENS, window - CONTEXT_RESERVE_TOKENS))
+
+def _same_source(a: Document, b: Document) -> bool:
+    source_a, source_b = a.metadata.get("source"), b.metadata.get("source")
+    return source_a is None or source_b is None or source_a == source_b
+
+def _overlap(head: str, tail: str) -> int:
+    # Length of the longest end of head that starts tail
+    for size in range(min(len(head), len(tail), CHUNK_OVERLAP), _MIN_OVERLAP - 1, -1):
+        if head.endswith(tail[:size]):
+            return size
+    return 0
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+def _shingles(text: str) -> set:
+    words = re.findall(r"\w+", text)
+    return {tuple(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+
+def _similarity(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+class _Piece:
+    """
+    A run of document text built from one or more chunks, ranked by its most
+    relevant chunk.
+    """
+
+    def __init__(self, rank: int, chunk: Document):
+        self.rank = rank
+        self.text = chunk.page_content.strip()
+        self.chunk = chunk
+
+def _find_overlap(pieces: List[_Piece]):
+    for i, first in enumerate(pieces):
+        for second in pieces[i + 1:]:
+            if not _same_source(first.chunk, second.chunk):
+                continue
+            # Either chunk may come first in the document
+            for head, tail in ((first, second), (second, first)):
+                size = _overlap(head.text, tail.text)
+                if size:
+                    return first, second, head.text + tail.text[size:]
+    return None
+
+def _merge_overlapping(pieces: List[_Piece]) -> int:
+    merged = 0
+    while True:
+        found = _find_overlap(pieces)
+        if found is None:
+            return merged
+        first, second, text = found
+        first.text = text
+        first.rank = min(first.rank, second.rank)
+        pieces.remove(second)
+        merged += 1
+
+def _drop_duplicates(pieces: List[_Piece]) -> List[_Piece]:
+    kept = []
+    for piece in sorted(pieces, key=lambda p: -len(p.text)):
+        normalized = _normalize(piece.text)
+        shingles = _shingles(normalized)
+        duplicate = next(
+            (
+                other for other, other_normalized, other_shingles in kept
+                if normalized in other_normalized or _similarity(shingles, other_shingles) >= CONTEXT_DEDUP_THRESHOLD
+            ),
+            None
+        )
+        if duplicate is None:
+            kept.append((piece, normalized, shingles))
+        else:
+            duplicate.rank = min(duplicate.rank, piece.rank)
+    return [piece for piece, _, _ in kept]
+
+def _truncate(text: str, max_chars: int) -> str:
+    # Cut at the last paragraph, sentence or word boundary that fits
+    cut = text[:max_chars]
+    for boundary in ("\n\n", ". ", "\n", " "):
+        position = cut.rfind(boundary)
+        if position > max_chars // 2:
+            return cut[:position + (1 if boundary == ". " else 0)].rstrip()
+    return cut.rstrip()
+
+def pack_context(chunks: List[Document], stage: str, budget: Optional[int] = None) -> str:
+    """
+    Packs retrieved chunks into the context text of a prompt.
+
+    Args:
+        chunks: Retrieved chunks, most relevant first
+        stage: Prompt the context is for (e.g. "generation"), used for stats
+        budget: Token budget; defaults to get_context_budget()
+
+    Returns:
+        The merged, deduplicated chunks in relevance order, joined by blank
+        lines and trimmed to the budget
+    """
+    budget = budget if budget is not None else get_context_budget()
+    naive_tokens = estimate_tokens(_SEPARATOR.join(chunk.page_content for chunk in chunks))
+
+    pieces = [_Piece(rank, chunk) for rank, chunk in enumerate(chunks) if chunk.page_content.strip()]
+    merged = _merge_overlapping(pieces)
+    before_dedup = len(pieces)
+    pieces = sorted(_drop_duplicates(pieces), key=lambda p: p.rank)
+    duplicates = before_dedup - len(pieces)
+
+    parts = []
+    used = 0
+    trimmed = 0
+    for index, piece in enumerate(pieces):
+        separator = estimate_tokens(_SEPARATOR) if parts else 0
+        tokens = estimate_tokens(piece.text)
+        if used + separator + tokens <= budget:
+            parts.append(piece.text)
+            used += separator + tokens
+            continue
+        # The first piece over budget is cut to fit; less relevant ones are left out
+        remaining = budget - used - separator
+        if remaining >= _MIN_PIECE_TOKENS:
+            parts.append(_truncate(piece.text, remaining * CHARS_PER_TOKEN))
+        trimmed = len(pieces) - index
+        break
+
+    context = _SEPARATOR.join(parts)
+    _record(stage, len(chunks), merged, duplicates, trimmed, naive_tokens, estimate_tokens(context))
+    return context
+
+def _record(stage: str, chunks: int, merged: int, duplicates: int, trimmed: int, naive_tokens: int, packed_tokens: int) -> None:
+    with _stats_lock:
+        counters = _stats.setdefault(stage, {
+            "contexts": 0,
+            "chunks": 0,
+            "merged": 0,
+            "duplicates_dropped": 0,
+            "pieces_trimmed": 0,
+            "tokens_before": 0,
+            "tokens_after": 0,
+        })
+        counters["contexts"] += 1
+        counters["chunks"] += chunks
+        counters["merged"] += merged
+        counters["duplicates_dropped"] += duplicates
+        counters["pieces_trimmed"] += trimmed
+        counters["tokens_before"] += naive_tokens
+        counters["tokens_after"] += packed_tokens
+
+def get_context_stats() -> Dict:
+    """
+    Returns per-stage packing counters: chunks merged and dropped, pieces cut
+    by the budget and estimated prompt tokens before and after packing.
+    """
+    with _stats_lock:
+        stages = {}
+        for stage, counters in _stats.items():
+            saved = counters["tokens_before"] - counters["tokens_after"]
+            stages[stage] = {
+                **counters,
+                "tokens_saved": saved,
+                "saved_ratio": round(saved / counters["tokens_before"], 4) if counters["tokens_before"] else 0.0,
+            }
+    return {"budget": get_context_budget(), "stages": stages}
@@ -0,0 +1,121 @@
+"""
+Embedding Pipeline
+Embeds chunk texts in real batches with a bounded number of batches in flight.
+Batch size adapts to observed latency and errors (grow while fast, halve on
+slow replies or failures), and each batch keeps the retry semantics of the
+original one-by-one loop.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List
+from backend.nodes.cancellation import GenerationCancelled, with_current_context
+
+INITIAL_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "16"))
+MIN_BATCH_SIZE = int(os.getenv("EMBED_MIN_BATCH_SIZE", "1"))
+MAX_BATCH_SIZE = int(os.getenv("EMBED_MAX_BATCH_SIZE", "128"))
+MAX_IN_FLIGHT = int(os.getenv("EMBED_MAX_IN_FLIGHT", "4"))
+TARGET_BATCH_SECONDS = float(os.getenv("EMBED_TARGET_BATCH_SECONDS", "2.0"))
+MAX_RETRIES = 3
+
+class AdaptiveBatchSizer:
+    """
+    Additive-increase / multiplicative-decrease batch sizing.
+    """
+
+    def __init__(self, initial=INITIAL_BATCH_SIZE, minimum=MIN_BATCH_SIZE,
+                 maximum=MAX_BATCH_SIZE, target_seconds=TARGET_BATCH_SECONDS):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.size = min(max(initial, self.minimum), self.maximum)
+        self.target_seconds = target_seconds
+        self._lock = threading.Lock()
+
+    def next_size(self) -> int:
+        with self._lock:
+            return self.size
+
+    def record_success(self, batch_size: int, seconds: float) -> None:
+        with self._lock:
+            if seconds > 2 * self.target_seconds:
+                self.size = max(self.minimum, self.size // 2)
+            elif seconds < self.target_seconds and batch_size >= self.size:
+                # Only grow when the batch that was fast was a full-size one
+                self.size = min(self.maximum, self.size + max(1, self.size // 4))
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.size = max(self.minimum, self.size // 2)
+
+def _embed_batch(embeddings, texts, batch_number, sizer):
+    """
+    Embeds one batch, retrying with the same backoff as the original loop.
+    """
+    for attempt in range(MAX_RETRIES):
+        started = time.perf_counter()
+        try:
+            vectors = embeddings.embed_documents(texts)
+            sizer.record_success(len(texts), time.perf_counter() - started)
+            return vectors
+        except GenerationCancelled:
+            # Not a failure of the embedding service; do not retry
+            raise
+        except Exception as e:
+            sizer.record_failure()
+            print(f"Error processing batch {batch_number} (Attempt {attempt+1}/{MAX_RETRIES}): {e}")
+            if attempt < MAX_RETRIES - 1:
+                wait_time = 2 * (attempt + 1)
+                print(f"Waiting {wait_time}s before retrying...")
+                time.sleep(wait_time)
+            else:
+                raise Exception(f"Failed to process batch {batch_number} after {MAX_RETRIES} attempts: {e}")
+
+def embed_in_batches(texts: List[str], embeddings, max_in_flight: int = MAX_IN_FLIGHT,
+                     sizer: AdaptiveBatchSizer = None) -> List[List[float]]:
+    """
+    Embeds texts with adaptive batching and bounded concurrency.
+    
+    Args:
+        texts: Texts to embed
+        embeddings: LangChain embeddings instance
+        max_in_flight: Maximum number of batches sent concurrently
+        sizer: Optional batch sizer, shared across calls to keep what it learned
+    
+    Returns:
+        One vector per text, in input order
+    
+    Raises:
+        Exception: If a batch still fails after all retries
+    """
+    sizer = sizer or AdaptiveBatchSizer()
+    vectors: List[List[float]] = [None] * len(texts)
+    position = 0
+    completed = 0
+    batch_number = 0
+    pending = {}
+    embed_batch = with_current_context(_embed_batch)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as pool:
+        try:
+            while position < len(texts) or pending:
+                # Keep the pipeline full up to the in-flight limit
+                while position < len(texts) and len(pending) < max_in_flight:
+                    batch = texts[position:position + sizer.next_size()]
+                    batch_number += 1
+                    future = pool.submit(embed_batch, embeddings, batch, batch_number, sizer)
+                    pending[future] = (position, len(batch))
+                    position += len(batch)
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start, count = pending.pop(future)
+                    vectors[start:start + count] = future.result()
+                    completed += count
+                    print(f"Embedded {completed}/{len(texts)} chunks (batch size now {sizer.next_size()})")
+        except Exception:
+            for future in pending:
+                future.cancel()
+            raise
+
+    return vectors
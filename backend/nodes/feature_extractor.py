@@ -1,35 +1,38 @@
 """
 Feature Extractor Node
-Extracts all features from requirements document when user requests "all features"
+Extracts all features from requirements document when user requests "all features".
+Extraction is map-reduce: windows covering every chunk are analysed in parallel
+and the candidate features are merged, deduplicated and ranked. The number of
+windows is capped, so large documents are condensed rather than cut short.
 """
-from backend.nodes.llm_provider import get_llm, get_provider_name
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
+import hashlib
+import math
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from backend.nodes.llm_provider import get_provider_name
+from backend.nodes.chain_registry import register_prompt, get_chain
+from backend.nodes.embedding_cache import get_embeddings
+from backend.nodes.lexical_index import RETRIEVAL_MODE
+from backend.nodes.cancellation import GenerationCancelled, with_current_context
+from backend.nodes.context_packer import CHARS_PER_TOKEN, get_context_budget, pack_context
+from langchain_core.documents import Document
 from typing import List, Dict
 
-def extract_features(state):
-    """
-    Extracts all features from the requirements document.
-    Only called when feature_name is "all features" or similar.
-    """
-    print("---EXTRACTING FEATURES---")
-    provider = get_provider_name()
-    print(f"Using LLM Provider for feature extraction: {provider}")
-    
-    chunks = state.get("chunks", [])
-    
-    # Combine chunks to get full context (limit to avoid token issues)
-    # Take first 10 chunks to avoid overwhelming the LLM
-    max_chunks = 10
-    context_chunks = chunks[:max_chunks]
-    context = "\n\n".join([doc.page_content for doc in context_chunks])
-    
-    if len(chunks) > max_chunks:
-        print(f"Warning: Document has {len(chunks)} chunks, using first {max_chunks} for feature extraction")
-    
-    llm = get_llm(temperature=0, format_json=True)
-    
-    prompt_template = """
+# Chunks per extraction window (the original single-call limit)
+EXTRACTION_WINDOW_CHUNKS = int(os.getenv("EXTRACTION_WINDOW_CHUNKS", "10"))
+# Cap on extraction LLM calls per document
+EXTRACTION_MAX_WINDOWS = max(1, int(os.getenv("EXTRACTION_MAX_WINDOWS", "8")))
+EXTRACTION_CONCURRENCY = max(1, int(os.getenv("EXTRACTION_CONCURRENCY", "4")))
+# Cosine similarity above which two feature names are treated as the same feature
+FEATURE_SIMILARITY_THRESHOLD = float(os.getenv("FEATURE_SIMILARITY_THRESHOLD", "0.9"))
+MAX_FEATURES = int(os.getenv("MAX_FEATURES", "10"))
+
+_SEPARATOR = "\n\n"
+_GENERIC_WORDS = {"feature", "features", "functionality", "functionalities", "capability"}
+
+EXTRACTION_PROMPT = """
     Analyze the following requirements document and extract all distinct features/functionalities.
     For each feature, provide:
     - name: A concise name for the feature
@@ -49,31 +52,175 @@ def extract_features(state):
         ]
     }}
     """
+
+register_prompt("extraction", "extraction", EXTRACTION_PROMPT, ["context"])
+
+def plan_extraction_windows(chunks) -> List[List[int]]:
+    """
+    Groups the indices of the distinct chunks into contiguous windows.
+    Windows hold EXTRACTION_WINDOW_CHUNKS chunks; a document that needs more
+    than EXTRACTION_MAX_WINDOWS of them is split into exactly that many larger
+    windows instead, which are condensed to the context budget when analysed.
+    """
+    seen = set()
+    kept = []
+    for index, chunk in enumerate(chunks):
+        text = " ".join(chunk.page_content.lower().split())
+        if not text:
+            continue
+        # Repeated boilerplate (headers, footers, notices) is analysed once
+        digest = hashlib.sha1(text.encode("utf-8")).digest()
+        if digest not in seen:
+            seen.add(digest)
+            kept.append(index)
+
+    window_size = EXTRACTION_WINDOW_CHUNKS
+    if math.ceil(len(kept) / window_size) > EXTRACTION_MAX_WINDOWS:
+        window_size = math.ceil(len(kept) / EXTRACTION_MAX_WINDOWS)
+    return [kept[start:start + window_size] for start in range(0, len(kept), window_size)]
+
+def _excerpt(text: str, max_chars: int) -> str:
+    # Opening of the chunk, cut at a word boundary
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    position = cut.rfind(" ")
+    return (cut[:position] if position > max_chars // 2 else cut).rstrip()
+
+def window_context(window: List[Document]) -> str:
+    """
+    Builds the extraction context of a window within the context budget.
+    A window that fits is packed whole. Otherwise every chunk is cut to its
+    opening text, with the budget shared so that short chunks stay whole and
+    leave the rest to longer ones.
+    """
+    texts = [chunk.page_content.strip() for chunk in window]
+    budget_chars = get_context_budget() * CHARS_PER_TOKEN - len(_SEPARATOR) * (len(texts) - 1)
+    if sum(len(text) for text in texts) <= budget_chars:
+        # Neighbouring chunks share the splitter overlap; send it once
+        return pack_context(window, "extraction")
+
+    shares = [0] * len(texts)
+    remaining = max(0, budget_chars)
+    by_length = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    for position, i in enumerate(by_length):
+        shares[i] = min(len(texts[i]), remaining // (len(texts) - position))
+        remaining -= shares[i]
+    excerpts = (_excerpt(text, share) for text, share in zip(texts, shares))
+    return _SEPARATOR.join(excerpt for excerpt in excerpts if excerpt)
+
+def _extract_window(chain, window) -> List[Dict]:
+    context = window_context(window)
+    response = chain.invoke({"context": context})
+    print(f"DEBUG: Feature extraction response: {response}")
+
+    if isinstance(response, dict) and 'features' in response:
+        features = response['features']
+    elif isinstance(response, list):
+        features = response
+    else:
+        features = []
+    return [f for f in features if isinstance(f, dict) and str(f.get("name", "")).strip()]
+
+def normalize_feature_name(name: str) -> str:
+    """
+    Normalizes a feature name for duplicate detection.
+    """
+    tokens = re.findall(r"[a-z0-9]+", name.lower())
+    return " ".join(token for token in tokens if token not in _GENERIC_WORDS) or " ".join(tokens)
+
+def merge_features(candidates: List[List[Dict]], max_features: int = MAX_FEATURES) -> List[Dict]:
+    """
+    Reduces per-window feature lists to one ranked, deduplicated list.
+    Features are grouped by normalized name, then by embedding similarity of
+    their names, and ranked by how many windows mentioned them.
+    """
+    groups = []
+    by_name = {}
+    for window_features in candidates:
+        seen_in_window = set()
+        for feature in window_features:
+            key = normalize_feature_name(str(feature["name"]))
+            group = by_name.get(key)
+            if group is None:
+                group = {"feature": dict(feature), "count": 0, "order": len(groups)}
+                by_name[key] = group
+                groups.append(group)
+            elif len(str(feature.get("description", ""))) > len(str(group["feature"].get("description", ""))):
+                group["feature"]["description"] = feature.get("description", "")
+            if key not in seen_in_window:
+                group["count"] += 1
+                seen_in_window.add(key)
+
+    if len(candidates) > 1 and len(groups) > 1:
+        groups = _merge_similar(groups)
+
+    groups.sort(key=lambda g: (-g["count"], g["order"]))
+    return [group["feature"] for group in groups[:max_features]]
+
+def _merge_similar(groups: List[Dict]) -> List[Dict]:
+    # Lexical mode runs without an embedding service
+    if RETRIEVAL_MODE == "lexical":
+        return groups
+    try:
+        vectors = np.asarray(get_embeddings().embed_queries([str(g["feature"]["name"]) for g in groups]), dtype=np.float32)
+    except Exception as e:
+        print(f"Skipping similarity merge of features: {e}")
+        return groups
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    similarity = (vectors / norms) @ (vectors / norms).T
+
+    # Greedy clustering: the most frequent feature absorbs its near-duplicates
+    order = sorted(range(len(groups)), key=lambda i: (-groups[i]["count"], groups[i]["order"]))
+    kept = []
+    for i in order:
+        for j in kept:
+            if similarity[i, j] >= FEATURE_SIMILARITY_THRESHOLD:
+                groups[j]["count"] += groups[i]["count"]
+                groups[j]["order"] = min(groups[j]["order"], groups[i]["order"])
+                break
+        else:
+            kept.append(i)
+    return [groups[i] for i in kept]
+
+def extract_features(state):
+    """
+    Extracts all features from the requirements document.
+    Only called when feature_name is "all features" or similar.
+    Windows covering all chunks are sent to the LLM in parallel (map) and the
+    candidate features are merged into at most MAX_FEATURES features (reduce).
+    """
+    print("---EXTRACTING FEATURES---")
+    provider = get_provider_name()
+    print(f"Using LLM Provider for feature extraction: {provider}")
     
-    prompt = PromptTemplate(
-        template=prompt_template,
-        input_variables=["context"]
-    )
+    chunks = state.get("chunks", [])
+    windows = plan_extraction_windows(chunks)
+    print(f"Extracting features from {len(chunks)} chunks in {len(windows)} windows")
     
-    chain = prompt | llm | JsonOutputParser()
+    chain = get_chain("extraction")
     
-    try:
-        response = chain.invoke({"context": context})
-        print(f"DEBUG: Feature extraction response: {response}")
-        
-        features = []
-        if isinstance(response, dict) and 'features' in response:
-            features = response['features']
-        elif isinstance(response, list):
-            features = response
-        
-        print(f"Extracted {len(features)} features")
-        
-        # Store features in state
-        return {"extracted_features": features}
-        
-    except Exception as e:
-        error_msg = str(e)
+    def run_window(window):
+        # Chunks are read per window, so spooled chunks never load at once
+        try:
+            return _extract_window(chain, [chunks[index] for index in window]), None
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            return None, e
+    
+    with ThreadPoolExecutor(max_workers=EXTRACTION_CONCURRENCY) as pool:
+        outcomes = list(pool.map(with_current_context(run_window), windows))
+    
+    candidates = [features for features, _ in outcomes if features is not None]
+    errors = [error for _, error in outcomes if error is not None]
+    for error in errors:
+        print(f"Feature extraction window failed: {error}")
+    
+    if errors and not candidates:
+        error_msg = str(errors[0])
         print(f"Error extracting features: {error_msg}")
         
         # Check if it's a rate limit error
@@ -89,6 +236,12 @@ def extract_features(state):
                 "error": f"Error extracting features: {error_msg}",
                 "error_type": "extraction_error"
             }
+    
+    features = merge_features(candidates)
+    print(f"Extracted {len(features)} features from {sum(len(c) for c in candidates)} candidates")
+    
+    # Store features in state
+    return {"extracted_features": features}
 
 def should_extract_features(state):
     """
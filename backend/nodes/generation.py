@@ -1,80 +1,159 @@
-from backend.nodes.llm_provider import get_llm, get_provider_name
-from langchain_core.prompts import PromptTemplate
+from backend.nodes.llm_provider import get_provider_name
+from backend.nodes.json_stream import ITEM_ARRAY_KEYS, IncrementalJsonArrayParser, normalize_key
+from backend.nodes.chain_registry import register_prompt, get_chain
+from backend.nodes.context_packer import pack_context
+from backend.nodes.cancellation import GenerationCancelled
 from langchain_core.output_parsers import JsonOutputParser
 from typing import List, Dict
 import json
 
-def generate_test_cases(state):
+GENERATION_PROMPT = """
+    Generate detailed test cases for the feature: {feature_name}.
+    {limit_instruction}
+    Include Test Case ID, Description, Preconditions, Steps, Expected Result.
+    Only use information present in the provided requirements:
+    {retrieved_chunks}
+    
+    Output the result as a JSON list of objects.
     """
-    Generates test cases using configured LLM (Ollama or Groq) based on retrieved chunks.
+
+# Keys that mark a lone object as one test case, in normalize_key form
+TEST_CASE_KEYS = ("testcaseid", "id", "steps", "teststeps", "expectedresult", "expectedresults")
+
+register_prompt(
+    "generation",
+    "generation",
+    GENERATION_PROMPT,
+    ["feature_name", "retrieved_chunks", "limit_instruction"]
+)
+
+def _generation_inputs(state):
+    """
+    Builds the prompt variables for a feature from the state.
     """
-    print("---GENERATING TEST CASES---")
-    provider = get_provider_name()
-    print(f"Using LLM Provider: {provider}")
-    feature_name = state["feature_name"]
-    retrieved_chunks = state["retrieved_chunks"]
     test_case_limit = state.get("test_case_limit")
     
-    # Format context
-    context = "\n\n".join([doc.page_content for doc in retrieved_chunks])
-    
-    # Initialize LLM using provider utility
-    llm = get_llm(temperature=0, format_json=True)
-    
     limit_instruction = ""
     if test_case_limit:
         limit_instruction = f"Generate exactly {test_case_limit} test cases."
     
-    prompt_template = """
-    Generate detailed test cases for the feature: {feature_name}.
-    {limit_instruction}
-    Include Test Case ID, Description, Preconditions, Steps, Expected Result.
-    Only use information present in the provided requirements:
-    {retrieved_chunks}
+    # Merge overlapping chunks, drop duplicates and fit the model's budget
+    context = pack_context(state["retrieved_chunks"], "generation")
     
-    Output the result as a JSON list of objects.
+    return {
+        "feature_name": state["feature_name"],
+        "retrieved_chunks": context,
+        "limit_instruction": limit_instruction
+    }
+
+def _extract_test_cases(response):
+    """
+    Pulls the test case list out of a parsed LLM reply.
+    JSON modes force an object reply, so besides a direct list this accepts
+    the list under a test case key (matched ignoring case and separators), a
+    lone test case, and the only list of objects under some other key.
+    Anything else, such as an error object, yields no test cases.
     """
+    if isinstance(response, list):
+        return response
+    if not isinstance(response, dict):
+        return []
     
-    prompt = PromptTemplate(
-        template=prompt_template,
-        input_variables=["feature_name", "retrieved_chunks", "limit_instruction"]
-    )
+    for key, value in response.items():
+        if normalize_key(key) in ITEM_ARRAY_KEYS and isinstance(value, list):
+            return value
     
-    chain = prompt | llm | JsonOutputParser()
+    # A single object is one test case; its own lists (e.g. steps) are not test cases
+    if any(normalize_key(key) in TEST_CASE_KEYS for key in response):
+        return [response]
+    
+    # Some models wrap the list under a key of their own
+    object_lists = [
+        value for value in response.values()
+        if isinstance(value, list) and value and all(isinstance(item, dict) for item in value)
+    ]
+    if len(object_lists) == 1:
+        return object_lists[0]
+    return []
+
+def describe_generation_error(error_msg):
+    """
+    Maps a generation exception message to the error fields used in the state.
+    """
+    # Check if it's a rate limit error
+    if "rate_limit" in error_msg.lower() or "429" in error_msg:
+        return {
+            "generated_test_cases": [], 
+            "error": "Rate limit exceeded. Please wait a few minutes or switch to Ollama provider.",
+            "error_type": "rate_limit"
+        }
+    else:
+        return {
+            "generated_test_cases": [], 
+            "error": error_msg,
+            "error_type": "generation_error"
+        }
+
+def generate_test_cases(state):
+    """
+    Generates test cases using configured LLM (Ollama or Groq) based on retrieved chunks.
+    """
+    print("---GENERATING TEST CASES---")
+    provider = get_provider_name()
+    print(f"Using LLM Provider: {provider}")
+    
+    # Shared client and compiled chain from the registry
+    chain = get_chain("generation")
     
     try:
-        response = chain.invoke({
-            "feature_name": feature_name, 
-            "retrieved_chunks": context,
-            "limit_instruction": limit_instruction
-        })
+        response = chain.invoke(_generation_inputs(state))
         print(f"DEBUG: Generated response type: {type(response)}")
         print(f"DEBUG: Generated response content: {response}")
         
-        # Handle both dict with 'testCases' key and direct list
-        if isinstance(response, dict) and 'testCases' in response:
-            test_cases = response['testCases']
-        elif isinstance(response, list):
-            test_cases = response
-        else:
-            test_cases = []
+        test_cases = _extract_test_cases(response)
             
         print("Test cases generated.")
         return {"generated_test_cases": test_cases}
+    except GenerationCancelled:
+        raise
     except Exception as e:
         error_msg = str(e)
         print(f"Error generating test cases: {error_msg}")
-        
-        # Check if it's a rate limit error
-        if "rate_limit" in error_msg.lower() or "429" in error_msg:
-            return {
-                "generated_test_cases": [], 
-                "error": "Rate limit exceeded. Please wait a few minutes or switch to Ollama provider.",
-                "error_type": "rate_limit"
-            }
-        else:
-            return {
-                "generated_test_cases": [], 
-                "error": error_msg,
-                "error_type": "generation_error"
-            }
+        return describe_generation_error(error_msg)
+
+def stream_test_cases(state):
+    """
+    Generates test cases from the LLM token stream, yielding each test case as
+    soon as its JSON object closes instead of waiting for the whole array.
+    
+    Yields:
+        Test case dicts in generation order
+    
+    Raises:
+        Exception: If the LLM call fails; use describe_generation_error to map it
+    """
+    print("---STREAMING TEST CASES---")
+    provider = get_provider_name()
+    print(f"Using LLM Provider: {provider}")
+    
+    chain = get_chain("generation")
+    
+    parser = IncrementalJsonArrayParser()
+    fragments = []
+    emitted = 0
+    
+    for content in chain.stream(_generation_inputs(state)):
+        fragments.append(content)
+        for test_case in parser.feed(content):
+            if isinstance(test_case, dict):
+                emitted += 1
+                yield test_case
+    
+    if emitted == 0:
+        # No array of objects was recognised while streaming; parse the full reply
+        response = JsonOutputParser().parse("".join(fragments))
+        for test_case in _extract_test_cases(response):
+            emitted += 1
+            yield test_case
+    
+    print(f"Streamed {emitted} test cases.")
@@ -0,0 +1,174 @@
+"""
+Ingestion Cache
+Content-addressed cache of ingested documents. Documents are keyed by a hash of
+the raw file (or fetched URL body) so repeat requests for the same requirements
+skip loading, splitting and embedding and go straight to retrieval.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+from langchain_core.documents import Document
+from typing import Optional, Sequence
+
+from backend.nodes.chunk_spool import INGEST_SPOOL_CHUNKS, ChunkFile, chunk_to_line, line_to_chunk
+from backend.nodes.url_fetcher import fetch_url_content
+from backend.nodes.feature_extractor import should_extract_features
+from backend.nodes.vector_store import has_vectors
+from backend.nodes.lexical_index import RETRIEVAL_MODE
+
+CACHE_DIR = os.getenv("INGESTION_CACHE_DIR", "./ingestion_cache")
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def hash_bytes(data: bytes) -> str:
+    """
+    Returns the SHA-256 hex digest of raw document bytes.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+def hash_file(file_path: str) -> str:
+    """
+    Returns the SHA-256 hex digest of a file, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def uploaded_hash(file_path: str, content_hash: Optional[str]) -> Optional[str]:
+    """
+    Returns the content hash the upload endpoint reported for a file, without
+    reading it, when that hash is the file's name (uploads/<sha256><ext>).
+    """
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    if content_hash and content_hash == stem and re.fullmatch(r"[0-9a-f]{64}", stem):
+        return stem
+    return None
+
+def _manifest_path(doc_hash: str) -> str:
+    return os.path.join(CACHE_DIR, f"{doc_hash}.jsonl")
+
+def _legacy_manifest_path(doc_hash: str) -> str:
+    return os.path.join(CACHE_DIR, f"{doc_hash}.json")
+
+def load_cached_chunks(doc_hash: str) -> Optional[Sequence[Document]]:
+    """
+    Returns the cached chunks for a document hash, or None on a miss.
+    Manifests with more than INGEST_SPOOL_CHUNKS chunks are returned as a
+    lazily read sequence instead of being loaded into memory.
+    """
+    path = _manifest_path(doc_hash)
+    legacy_path = _legacy_manifest_path(doc_hash)
+    try:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                header = json.loads(f.readline())
+                if header.get("chunk_count", 0) > INGEST_SPOOL_CHUNKS:
+                    return ChunkFile.open(path, skip_lines=1)
+                return [line_to_chunk(line) for line in f if line.strip()]
+
+        if os.path.exists(legacy_path):
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            return [
+                Document(page_content=c["page_content"], metadata=c.get("metadata", {}))
+                for c in manifest.get("chunks", [])
+            ]
+    except Exception as e:
+        print(f"Ignoring unreadable ingestion manifest for {doc_hash[:12]}: {e}")
+    return None
+
+def save_cached_chunks(doc_hash: str, chunks: Sequence[Document], source: str = "") -> None:
+    """
+    Persists the chunks for a document hash as JSON lines (a header line, then
+    one line per chunk), streaming them so spooled chunks are not loaded.
+    The file is written to a temporary path first so readers never see a
+    partial manifest.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    header = {
+        "doc_hash": doc_hash,
+        "source": source,
+        "created_at": time.time(),
+        "chunk_count": len(chunks),
+    }
+    path = _manifest_path(doc_hash)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write((json.dumps(header) + "\n").encode("utf-8"))
+        for chunk in chunks:
+            f.write(chunk_to_line(chunk))
+    os.replace(tmp_path, path)
+
+def invalidate(doc_hash: str) -> None:
+    """
+    Removes the cached manifest for a document hash, if any.
+    """
+    for path in (_manifest_path(doc_hash), _legacy_manifest_path(doc_hash)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def lookup_ingestion(state):
+    """
+    Hashes the input document and restores its chunks from the cache when the
+    same content has already been ingested.
+    For URLs the fetched body is kept in the state so the loader does not
+    download it a second time on a miss.
+    """
+    print("---CHECKING INGESTION CACHE---")
+    new_state = dict(state)
+    new_state["ingestion_cached"] = False
+
+    try:
+        if state.get("url"):
+            content = fetch_url_content(state["url"])
+            new_state["url_content"] = content
+            doc_hash = hash_bytes(content)
+        elif state.get("file_path") and os.path.exists(state["file_path"]):
+            doc_hash = uploaded_hash(state["file_path"], state.get("content_hash")) or hash_file(state["file_path"])
+        else:
+            # Let the loader report the missing input
+            return new_state
+    except Exception as e:
+        print(f"Could not hash input document: {e}")
+        return new_state
+
+    new_state["doc_hash"] = doc_hash
+
+    chunks = load_cached_chunks(doc_hash)
+    if chunks is not None and (RETRIEVAL_MODE == "lexical" or has_vectors(doc_hash, len(chunks))):
+        print(f"Ingestion cache hit for {doc_hash[:12]} ({len(chunks)} chunks).")
+        new_state["chunks"] = chunks
+        new_state["ingestion_cached"] = True
+    else:
+        print(f"Ingestion cache miss for {doc_hash[:12]}.")
+
+    return new_state
+
+def record_ingestion(state):
+    """
+    Persists the freshly split and embedded chunks under the document hash.
+    """
+    doc_hash = state.get("doc_hash")
+    chunks = state.get("chunks", [])
+    if doc_hash and chunks:
+        try:
+            save_cached_chunks(doc_hash, chunks, source=state.get("url") or state.get("file_path", ""))
+            print(f"Recorded ingestion for {doc_hash[:12]}.")
+        except Exception as e:
+            # A failed cache write must not fail the request
+            print(f"Error recording ingestion cache: {e}")
+    return {}
+
+def route_after_ingestion_lookup(state):
+    """
+    Routes cached documents straight to retrieval or feature extraction.
+    Returns "ingest", "extract" or "single"
+    """
+    if state.get("ingestion_cached"):
+        return should_extract_features(state)
+    return "ingest"
@@ -0,0 +1,229 @@
+"""
+Streaming Ingestion Pipeline
+Overlaps document parsing, splitting and embedding: pages are split and sent
+to the embedder as they are parsed, connected by bounded queues so a fast
+parser cannot run far ahead of a slow embedding service.
+Memory stays bounded for very large documents: text files are read in
+windows, chunks spill to a spool file and vectors are written to the index
+as they are computed.
+"""
+import os
+import queue
+import threading
+import time
+from typing import Dict, Iterator, List
+
+from backend.nodes.loader import iter_documents
+from backend.nodes.splitter import get_text_splitter, index_chunks_lexically
+from backend.nodes.vector_store import VectorSink
+from backend.nodes.chunk_spool import ChunkStore
+from backend.nodes.embedding_cache import get_embeddings
+from backend.nodes.embedding_pipeline import AdaptiveBatchSizer, embed_in_batches
+from backend.nodes.lexical_index import RETRIEVAL_MODE
+from backend.nodes.cancellation import with_current_context
+
+# Items buffered between two stages before the upstream stage waits
+INGEST_QUEUE_SIZE = max(1, int(os.getenv("INGEST_QUEUE_SIZE", "8")))
+# Chunks collected before an embedding call, unless the embedder would idle
+INGEST_EMBED_GROUP = max(1, int(os.getenv("INGEST_EMBED_GROUP", "64")))
+# Minimum seconds between two progress reports
+INGEST_PROGRESS_INTERVAL = float(os.getenv("INGEST_PROGRESS_INTERVAL", "0.5"))
+
+_DONE = object()
+_POLL_SECONDS = 0.1
+
+class _Pipeline:
+    """
+    Shared state of one ingestion run: queues, counters and the stop flag.
+    """
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        self.pages = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+        self.chunk_batches = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        self.errors: List[Exception] = []
+        self.progress = {"pages": 0, "chunks": 0, "embedded": 0}
+        self.chunks = ChunkStore()
+
+    def put(self, target: queue.Queue, item) -> bool:
+        # Blocks while the queue is full, giving up if the run was stopped
+        while not self.stop.is_set():
+            try:
+                target.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(self, source: queue.Queue):
+        while not self.stop.is_set():
+            try:
+                return source.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def count(self, stage: str, amount: int) -> None:
+        with self.lock:
+            self.progress[stage] += amount
+
+    def fail(self, error: Exception) -> None:
+        with self.lock:
+            self.errors.append(error)
+        self.stop.set()
+
+def _load_stage(pipeline: _Pipeline, state) -> None:
+    try:
+        for page in iter_documents(state):
+            if not pipeline.put(pipeline.pages, page):
+                return
+            pipeline.count("pages", 1)
+    except Exception as e:
+        pipeline.fail(e)
+    finally:
+        pipeline.put(pipeline.pages, _DONE)
+
+def _split_stage(pipeline: _Pipeline, embed: bool, doc_hash: str) -> None:
+    splitter = get_text_splitter()
+    try:
+        while True:
+            page = pipeline.get(pipeline.pages)
+            if page is _DONE:
+                break
+            chunks = splitter.split_documents([page])
+            if doc_hash:
+                for chunk in chunks:
+                    chunk.metadata["doc_hash"] = doc_hash
+            pipeline.chunks.extend(chunks)
+            pipeline.count("chunks", len(chunks))
+            if embed and chunks and not pipeline.put(pipeline.chunk_batches, chunks):
+                return
+    except Exception as e:
+        pipeline.fail(e)
+    finally:
+        if embed:
+            pipeline.put(pipeline.chunk_batches, _DONE)
+
+def _embed_stage(pipeline: _Pipeline) -> None:
+    embeddings = get_embeddings()
+    # One sizer for the whole run so batch sizes adapt across calls
+    sizer = AdaptiveBatchSizer()
+    pending = []
+
+    def flush():
+        texts = [chunk.page_content for chunk in pending]
+        pipeline.sink.add(list(pending), embed_in_batches(texts, embeddings, sizer=sizer))
+        pipeline.count("embedded", len(pending))
+        pending.clear()
+
+    try:
+        while True:
+            batch = pipeline.get(pipeline.chunk_batches)
+            if batch is _DONE:
+                break
+            pending.extend(batch)
+            # Embed when enough chunks are collected or nothing else is waiting
+            if len(pending) >= INGEST_EMBED_GROUP or pipeline.chunk_batches.empty():
+                flush()
+        if pending and not pipeline.stop.is_set():
+            flush()
+    except Exception as e:
+        pipeline.fail(e)
+
+def _progress_event(progress: Dict, embed: bool) -> Dict:
+    message = f"Ingesting: {progress['pages']} pages parsed, {progress['chunks']} chunks split"
+    if embed:
+        message += f", {progress['embedded']} chunks embedded"
+    return {"type": "status", "stage": "ingestion", "message": message, "progress": dict(progress)}
+
+def run_ingestion_pipeline(state) -> Iterator[Dict]:
+    """
+    Loads, splits and embeds the input document with the stages overlapped.
+
+    Yields:
+        Status events with per-stage progress, then a final
+        {"type": "done", "state": ...} item carrying the state with chunks
+        and vector store
+
+    Raises:
+        Exception: The first error raised by any stage
+    """
+    print("---INGESTING DOCUMENT (PIPELINED)---")
+    # Lexical retrieval does not need vectors
+    embed = RETRIEVAL_MODE != "lexical"
+    try:
+        sink = VectorSink(state) if embed else None
+    except Exception as e:
+        raise Exception(f"Error creating vector store: {str(e)}")
+    pipeline = _Pipeline(sink)
+
+    stages = [
+        threading.Thread(target=with_current_context(_load_stage), args=(pipeline, state), daemon=True),
+        threading.Thread(target=with_current_context(_split_stage), args=(pipeline, embed, state.get("doc_hash")), daemon=True),
+    ]
+    if embed:
+        stages.append(threading.Thread(target=with_current_context(_embed_stage), args=(pipeline,), daemon=True))
+
+    for stage in stages:
+        stage.start()
+
+    try:
+        reported = None
+        last_report = 0.0
+        while any(stage.is_alive() for stage in stages):
+            stages[-1].join(timeout=_POLL_SECONDS)
+            with pipeline.lock:
+                progress = dict(pipeline.progress)
+            now = time.monotonic()
+            if progress["pages"] and progress != reported and now - last_report >= INGEST_PROGRESS_INTERVAL:
+                yield _progress_event(progress, embed)
+                reported, last_report = progress, now
+    except BaseException:
+        # The consumer went away; do not leave a half-written collection
+        if sink is not None:
+            sink.discard()
+        raise
+    finally:
+        # Stops the stages if the consumer went away
+        pipeline.stop.set()
+
+    if pipeline.errors:
+        if sink is not None:
+            sink.discard()
+        raise pipeline.errors[0]
+
+    chunks = pipeline.chunks.seal()
+    print(f"Loaded {pipeline.progress['pages']} pages/documents, split into {len(chunks)} chunks.")
+    # Report the final counts unless the last event already showed them
+    if pipeline.progress != reported:
+        yield _progress_event(pipeline.progress, embed)
+
+    # State copies are shallow, so a spooled chunk sequence is shared, not copied
+    new_state = dict(state)
+    new_state["chunks"] = chunks
+    index_chunks_lexically(new_state, chunks)
+
+    new_state["vectorstore"] = None
+    if embed and len(chunks):
+        try:
+            new_state["vectorstore"] = sink.close()
+        except Exception as e:
+            sink.discard()
+            raise Exception(f"Error creating vector store: {str(e)}")
+
+    yield {"type": "done", "state": new_state}
+
+def ingest_document(state):
+    """
+    Graph node running the ingestion pipeline to completion.
+    Progress events have no listener here and are dropped.
+
+    Returns:
+        The state with chunks and vector store
+    """
+    for event in run_ingestion_pipeline(state):
+        if event["type"] == "done":
+            return event["state"]
+    raise Exception("Ingestion pipeline ended without a result")
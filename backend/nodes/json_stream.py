@@ -0,0 +1,108 @@
+"""
+Incremental JSON Parsing
+Extracts objects from a JSON array while the LLM is still producing it, so each
+test case can be used the moment its closing brace arrives.
+"""
+import json
+import re
+from typing import Any, List
+
+# Keys of the top-level object whose array holds the test cases, in normalize_key form
+ITEM_ARRAY_KEYS = ("testcases",)
+
+def normalize_key(key: str) -> str:
+    """
+    Lowercases a JSON key and drops spaces, underscores and other separators,
+    so "testCases", "test_cases" and "Test Cases" compare equal.
+    """
+    return re.sub(r"[^a-z0-9]", "", key.lower())
+
+class IncrementalJsonArrayParser:
+    """
+    Feeds text fragments and returns the objects of the item array: the
+    top-level array ([{...}, ...]) or the array under an ITEM_ARRAY_KEYS key of
+    the top-level object ({"testCases": [{...}, ...]}), matched with
+    normalize_key. Arrays nested in an item, such as a list of steps, are never
+    taken for it. Text outside the array is ignored; replies of other shapes
+    are left to a full parse.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._array_depth = None  # Stack depth inside the item array
+        self._array_closed = False
+        self._item_start = None
+        self._string_start = None
+        self._last_key = None  # Last string closed directly inside the top-level object
+
+    def feed(self, text: str) -> List[Any]:
+        """
+        Consumes a fragment and returns the objects completed by it.
+        """
+        self._buffer += text
+        items = []
+
+        while self._pos < len(self._buffer):
+            ch = self._buffer[self._pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._string_start is not None:
+                        self._last_key = self._buffer[self._string_start:self._pos]
+                        self._string_start = None
+            elif ch == '"':
+                self._in_string = True
+                if self._stack == ["{"] and self._array_depth is None:
+                    self._string_start = self._pos + 1
+            elif ch in "{[":
+                if (ch == "{" and not self._array_closed and self._item_start is None
+                        and self._array_depth is not None and len(self._stack) == self._array_depth):
+                    self._item_start = self._pos
+                self._stack.append(ch)
+                if ch == "[" and self._array_depth is None and self._is_item_array():
+                    self._array_depth = len(self._stack)
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if self._array_depth is not None and not self._array_closed:
+                    if ch == "}" and self._item_start is not None and len(self._stack) == self._array_depth:
+                        raw = self._buffer[self._item_start:self._pos + 1]
+                        try:
+                            items.append(json.loads(raw))
+                        except ValueError:
+                            print(f"Skipping unparsable streamed object: {raw[:80]}")
+                        self._item_start = None
+                    elif ch == "]" and len(self._stack) == self._array_depth - 1:
+                        self._array_closed = True
+
+            self._pos += 1
+
+        # Drop consumed text; keep only the object or key currently being captured
+        keep = self._item_start if self._item_start is not None else self._string_start
+        if keep is None:
+            self._buffer = ""
+            self._pos = 0
+        else:
+            self._buffer = self._buffer[keep:]
+            self._pos -= keep
+            if self._item_start is not None:
+                self._item_start -= keep
+            if self._string_start is not None:
+                self._string_start -= keep
+
+        return items
+
+    def _is_item_array(self) -> bool:
+        # Top-level array, or the array under a test case key of the top-level object
+        if len(self._stack) == 1:
+            return True
+        return self._stack == ["{", "["] and self._last_key is not None and normalize_key(self._last_key) in ITEM_ARRAY_KEYS
@@ -0,0 +1,129 @@
+"""
+Lexical Index
+BM25 inverted index over the document chunks. Feature names are often literal
+headings in the spec, so a keyword lookup finds their sections without an
+embedding call.
+"""
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Sequence
+from langchain_core.documents import Document
+
+# "dense" (embeddings only), "lexical" (BM25 only, no embedding service) or
+# "hybrid" (both, fused with reciprocal rank fusion)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense").lower()
+
+# BM25 parameters
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Lexical indexes kept per process, least recently used dropped first
+LEXICAL_MAX_INDEXES = int(os.getenv("LEXICAL_MAX_INDEXES", "32"))
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the "
+    "this to was were will with shall should must can may".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercases text and splits it into alphanumeric terms without stopwords.
+    """
+    return [token for token in _TOKEN_PATTERN.findall(text.lower()) if token not in _STOPWORDS]
+
+class BM25Index:
+    """
+    Inverted index scoring chunks with Okapi BM25.
+    """
+
+    def __init__(self, documents: Sequence[Document]):
+        # Kept by reference: spooled chunk sequences stay on disk
+        self.documents = documents
+        self.postings: Dict[str, List[tuple]] = {}
+        self.lengths: List[int] = []
+
+        for doc_id, document in enumerate(self.documents):
+            terms = Counter(tokenize(document.page_content))
+            self.lengths.append(sum(terms.values()))
+            for term, frequency in terms.items():
+                self.postings.setdefault(term, []).append((doc_id, frequency))
+
+        count = len(self.documents)
+        self.average_length = (sum(self.lengths) / count) if count else 0.0
+        self.idf = {
+            term: math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query: str, k: int) -> List[Document]:
+        """
+        Returns up to k chunks sharing terms with the query, best first.
+        """
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf[term]
+            for doc_id, frequency in postings:
+                length_norm = 1 - BM25_B + BM25_B * self.lengths[doc_id] / (self.average_length or 1)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+        return [self.documents[doc_id] for doc_id, _ in ranked]
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int, rrf_k: int = 60) -> List[Document]:
+    """
+    Merges several rankings of chunks into one, scoring each chunk with the sum
+    of 1 / (rrf_k + rank) over the rankings it appears in.
+    """
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, 1):
+            key = document.page_content
+            documents.setdefault(key, document)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+
+    ranked = sorted(scores, key=lambda key: -scores[key])[:k]
+    return [documents[key] for key in ranked]
+
+_indexes: "OrderedDict[str, BM25Index]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def build_lexical_index(name: str, chunks: Sequence[Document]) -> BM25Index:
+    """
+    Builds the BM25 index for a document and keeps it in memory.
+    """
+    index = BM25Index(chunks)
+    with _indexes_lock:
+        _indexes[name] = index
+        _indexes.move_to_end(name)
+        while len(_indexes) > LEXICAL_MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+def get_lexical_index(name: str, chunks: Optional[Sequence[Document]] = None) -> Optional[BM25Index]:
+    """
+    Returns the BM25 index for a document, rebuilding it from the chunks when
+    it is not in memory (e.g. after an ingestion cache hit).
+    """
+    with _indexes_lock:
+        index = _indexes.get(name)
+        if index is not None:
+            _indexes.move_to_end(name)
+            return index
+    if chunks:
+        return build_lexical_index(name, chunks)
+    return None
+
+def drop_lexical_index(name: str) -> None:
+    """
+    Forgets the BM25 index for a document.
+    """
+    with _indexes_lock:
+        _indexes.pop(name, None)
@@ -0,0 +1,231 @@
+"""
+LLM Response Cache
+Caches raw LLM replies for deterministic (temperature 0) calls, keyed by
+provider, model, format flags and a hash of the rendered prompt. An in-memory
+LRU tier is always used; an on-disk SQLite tier can be enabled so results
+survive restarts.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional
+from backend.nodes.cancellation import call_abortable, check_cancelled, stream_abortable
+
+# Comma-separated stages to cache: generation, validation, extraction
+ENABLED_STAGES = {
+    stage.strip() for stage in os.getenv("LLM_CACHE_STAGES", "generation,validation,extraction").split(",")
+    if stage.strip()
+}
+MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "512"))
+DISK_ENABLED = os.getenv("LLM_CACHE_DISK", "false").lower() in ("1", "true", "yes")
+DISK_PATH = os.getenv("LLM_CACHE_PATH", "./llm_cache.sqlite")
+DISK_MAX_ENTRIES = int(os.getenv("LLM_CACHE_DISK_MAX_ENTRIES", "20000"))
+
+class _MemoryTier:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: str, text: str) -> None:
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+class _DiskTier:
+    def __init__(self, path: str, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, text TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key: str, text: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, text, last_access) VALUES (?, ?, ?)",
+                (key, text, time.time())
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+_memory = _MemoryTier(MEMORY_ENTRIES)
+_disk: Optional[_DiskTier] = _DiskTier(DISK_PATH, DISK_MAX_ENTRIES) if DISK_ENABLED else None
+_stats: Dict[str, Dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+def _count(stage: str, outcome: str) -> None:
+    with _stats_lock:
+        counters = _stats.setdefault(stage, {"memory_hits": 0, "disk_hits": 0, "misses": 0})
+        counters[outcome] += 1
+
+def _describe_llm(llm) -> Dict:
+    """
+    Returns the identity of an LLM client that determines its replies.
+    """
+    return {
+        "provider": type(llm).__name__,
+        "model": getattr(llm, "model", None) or getattr(llm, "model_name", None),
+        "temperature": getattr(llm, "temperature", None),
+        "format": getattr(llm, "format", None),
+        "num_ctx": getattr(llm, "num_ctx", None),
+        "model_kwargs": getattr(llm, "model_kwargs", None),
+    }
+
+def make_key(llm, prompt_text: str) -> str:
+    """
+    Returns the cache key for a rendered prompt sent to an LLM client.
+    """
+    prompt_hash = hashlib.sha256(prompt_text.encode("utf-8")).hexdigest()
+    identity = json.dumps({**_describe_llm(llm), "prompt": prompt_hash}, sort_keys=True, default=str)
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+def is_cacheable(stage: str, llm) -> bool:
+    """
+    Only deterministic calls of enabled stages are cached.
+    """
+    return stage in ENABLED_STAGES and getattr(llm, "temperature", 0) in (0, None)
+
+def lookup(stage: str, key: str) -> Optional[str]:
+    text = _memory.get(key)
+    if text is not None:
+        _count(stage, "memory_hits")
+        return text
+    if _disk is not None:
+        text = _disk.get(key)
+        if text is not None:
+            _memory.put(key, text)
+            _count(stage, "disk_hits")
+            return text
+    _count(stage, "misses")
+    return None
+
+def store(key: str, text: str) -> None:
+    _memory.put(key, text)
+    if _disk is not None:
+        try:
+            _disk.put(key, text)
+        except Exception as e:
+            print(f"Error writing LLM cache: {e}")
+
+def get_cache_stats() -> Dict:
+    """
+    Returns per-stage hit/miss counters and hit rates.
+    """
+    with _stats_lock:
+        stages = {}
+        for stage, counters in _stats.items():
+            hits = counters["memory_hits"] + counters["disk_hits"]
+            lookups = hits + counters["misses"]
+            stages[stage] = {**counters, "hit_rate": round(hits / lookups, 4) if lookups else 0.0}
+    return {
+        "enabled_stages": sorted(ENABLED_STAGES),
+        "memory_entries": len(_memory),
+        "disk_enabled": _disk is not None,
+        "stages": stages,
+    }
+
+class CachedChain:
+    """
+    Equivalent of prompt | llm | parser whose raw LLM reply is served from the
+    response cache when the same prompt was answered before.
+    """
+
+    def __init__(self, stage: str, prompt, llm, parser=None):
+        self.stage = stage
+        self.prompt = prompt
+        self.llm = llm
+        self.parser = parser
+
+    def _parse(self, text: str):
+        return self.parser.parse(text) if self.parser else text
+
+    def _call(self, prompt_text: str) -> str:
+        # Aborted mid-request if the run is cancelled
+        check_cancelled(f"llm_calls_skipped.{self.stage}")
+        message = call_abortable(f"llm_calls_aborted.{self.stage}", lambda: self.llm.ainvoke(prompt_text))
+        return message.content
+
+    def invoke(self, variables: Dict):
+        prompt_text = self.prompt.format(**variables)
+        if not is_cacheable(self.stage, self.llm):
+            return self._parse(self._call(prompt_text))
+
+        key = make_key(self.llm, prompt_text)
+        text = lookup(self.stage, key)
+        if text is not None:
+            return self._parse(text)
+
+        text = self._call(prompt_text)
+        # Parse before storing so malformed replies are never cached
+        result = self._parse(text)
+        store(key, text)
+        return result
+
+    def stream(self, variables: Dict) -> Iterator[str]:
+        """
+        Yields raw reply fragments. A cached reply is yielded in one piece; a
+        fresh reply is stored once it has been streamed completely.
+        """
+        prompt_text = self.prompt.format(**variables)
+        cacheable = is_cacheable(self.stage, self.llm)
+        key = make_key(self.llm, prompt_text) if cacheable else None
+
+        if cacheable:
+            text = lookup(self.stage, key)
+            if text is not None:
+                yield text
+                return
+
+        check_cancelled(f"llm_calls_skipped.{self.stage}")
+        fragments = []
+        # Cancelling the run closes the model's HTTP stream, even before the first token
+        chunks = stream_abortable(f"llm_streams_aborted.{self.stage}", lambda: self.llm.astream(prompt_text))
+        for chunk in chunks:
+            content = chunk.content if isinstance(chunk.content, str) else ""
+            fragments.append(content)
+            yield content
+
+        if cacheable:
+            text = "".join(fragments)
+            try:
+                self._parse(text)
+            except Exception:
+                return
+            store(key, text)
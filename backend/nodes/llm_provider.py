@@ -3,6 +3,8 @@ LLM Provider Utility
 Provides a unified interface to get LLM instances from different providers (Ollama, Groq).
 """
 import os
+import threading
+import httpx
 from dotenv import load_dotenv
 from langchain_ollama import ChatOllama
 from langchain_groq import ChatGroq
@@ -10,9 +12,27 @@ from langchain_groq import ChatGroq
 # Load environment variables
 load_dotenv()
 
+# Connection pool shared by the requests of one client instance
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "120"))
+# Context window requested from Ollama; prompts beyond it are truncated by the server
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _pool_limits():
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_SECONDS
+    )
+
 def get_llm(temperature=0, format_json=False):
     """
     Returns an LLM instance based on the LLM_PROVIDER environment variable.
+    Instances are created once per (provider, model, temperature, format) and
+    shared process-wide, so their HTTP connection pools stay alive across calls.
     
     Args:
         temperature: Temperature setting for the LLM (default: 0)
@@ -27,11 +47,28 @@ def get_llm(temperature=0, format_json=False):
     provider = os.getenv("LLM_PROVIDER", "ollama").lower()
     
     if provider == "ollama":
-        return get_ollama_llm(temperature, format_json)
+        factory = get_ollama_llm
     elif provider == "groq":
-        return get_groq_llm(temperature, format_json)
+        factory = get_groq_llm
     else:
         raise ValueError(f"Invalid LLM_PROVIDER: {provider}. Must be 'ollama' or 'groq'")
+    
+    key = (provider, get_model_name(provider), temperature, format_json)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = factory(temperature, format_json)
+        return _clients[key]
+
+def get_model_name(provider=None):
+    """
+    Returns the model name configured for a provider (default: current provider).
+    """
+    provider = provider or get_provider_name()
+    if provider == "groq":
+        return "llama-3.3-70b-versatile"  # Using Groq's Llama 3.3 70B model (updated from decommissioned 3.1)
+    # Using llama3.2:3b - much lighter and faster than llama3.1 (2GB vs 4.9GB)
+    # Alternative options: "phi3:mini", "gemma2:2b", "qwen2.5:3b"
+    return os.getenv("OLLAMA_MODEL", "llama3.2:3b")
 
 def get_ollama_llm(temperature=0, format_json=False):
     """
@@ -44,13 +81,11 @@ def get_ollama_llm(temperature=0, format_json=False):
     Returns:
         ChatOllama instance
     """
-    # Using llama3.2:3b - much lighter and faster than llama3.1 (2GB vs 4.9GB)
-    # Alternative options: "phi3:mini", "gemma2:2b", "qwen2.5:3b"
-    model = os.getenv("OLLAMA_MODEL", "llama3.2:3b")
-    
     kwargs = {
-        "model": model,
-        "temperature": temperature
+        "model": get_model_name("ollama"),
+        "temperature": temperature,
+        "num_ctx": OLLAMA_NUM_CTX,
+        "client_kwargs": {"limits": _pool_limits()}
     }
     
     if format_json:
@@ -74,9 +109,12 @@ def get_groq_llm(temperature=0, format_json=False):
         raise ValueError("GROQ_API_KEY environment variable is not set")
     
     kwargs = {
-        "model": "llama-3.3-70b-versatile",  # Using Groq's Llama 3.3 70B model (updated from decommissioned 3.1)
+        "model": get_model_name("groq"),
         "temperature": temperature,
-        "api_key": api_key
+        "api_key": api_key,
+        "http_client": httpx.Client(limits=_pool_limits()),
+        # Calls run through the async client so cancellation can abort them
+        "http_async_client": httpx.AsyncClient(limits=_pool_limits())
     }
     
     if format_json:
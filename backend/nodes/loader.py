@@ -1,15 +1,64 @@
 import os
-import requests
 from bs4 import BeautifulSoup
 import docx
 from langchain_community.document_loaders import PyPDFLoader, TextLoader, Docx2txtLoader
 from langchain_core.documents import Document
-from typing import List
+from typing import Iterator, List
+from backend.nodes.url_fetcher import fetch_url_content
+from backend.nodes.text_stream import iter_text_windows, should_stream_text
+from backend.nodes.parse_pool import (
+    parse_docx_text,
+    parse_pdf_pages,
+    should_parse_docx_in_pool,
+    should_parse_pdf_in_pool,
+)
+
+def parse_html(content: bytes, url: str) -> List[Document]:
+    """
+    Extracts clean text from an HTML body.
+    """
+    soup = BeautifulSoup(content, 'html.parser')
+    
+    # Remove script and style elements
+    for script in soup(["script", "style"]):
+        script.decompose()
+        
+    text = soup.get_text()
+    
+    # Clean text
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    text = '\n'.join(chunk for chunk in chunks if chunk)
+    
+    return [Document(page_content=text, metadata={"source": url})]
+
+def iter_documents(state) -> Iterator[Document]:
+    """
+    Yields the pages of the input document as they are parsed.
+    PDFs are read lazily page by page (large ones in page ranges on the
+    process pool) and very large text files in memory-mapped windows; other
+    formats yield their single document once loaded.
+    """
+    file_path = state.get("file_path")
+    if not state.get("url") and file_path and file_path.endswith(".pdf"):
+        print(f"Loading document lazily: {file_path}")
+        if should_parse_pdf_in_pool(file_path):
+            for text, metadata in parse_pdf_pages(file_path):
+                yield Document(page_content=text, metadata=metadata)
+        else:
+            yield from PyPDFLoader(file_path).lazy_load()
+        return
+    if not state.get("url") and file_path and file_path.endswith(".txt") and should_stream_text(file_path):
+        # Very large text files are read in bounded windows
+        yield from iter_text_windows(file_path)
+        return
+    yield from load_document(state)["documents"]
 
 def load_document(state):
     """
     Loads a document from the file path specified in the state.
-    Supports PDF, TXT, and DOCX.
+    Supports PDF, TXT, and DOCX. Everything is read into memory; ingestion
+    goes through iter_documents, which streams very large text files.
     """
     print("---LOADING DOCUMENT---")
     
@@ -21,24 +70,11 @@ def load_document(state):
             url = state["url"]
             print(f"Loading content from URL: {url}")
             try:
-                
-                response = requests.get(url)
-                response.raise_for_status()
-                
-                soup = BeautifulSoup(response.content, 'html.parser')
-                
-                # Remove script and style elements
-                for script in soup(["script", "style"]):
-                    script.decompose()
-                    
-                text = soup.get_text()
-                
-                # Clean text
-                lines = (line.strip() for line in text.splitlines())
-                chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-                text = '\n'.join(chunk for chunk in chunks if chunk)
-                
-                documents = [Document(page_content=text, metadata={"source": url})]
+                # Reuse the body already fetched by the ingestion cache lookup
+                content = state.get("url_content")
+                if content is None:
+                    content = fetch_url_content(url)
+                documents = parse_html(content, url)
                 
             except Exception as e:
                 print(f"Error loading URL: {e}")
@@ -49,12 +85,22 @@ def load_document(state):
             print(f"Loading document: {file_path}")
             
             if file_path.endswith(".pdf"):
-                loader = PyPDFLoader(file_path)
-                documents = loader.load()
+                if should_parse_pdf_in_pool(file_path):
+                    # Large PDFs are parsed in page ranges across processes
+                    documents = [
+                        Document(page_content=text, metadata=metadata)
+                        for text, metadata in parse_pdf_pages(file_path)
+                    ]
+                else:
+                    loader = PyPDFLoader(file_path)
+                    documents = loader.load()
             elif file_path.endswith(".docx"):
-                # Custom docx loader
-                doc = docx.Document(file_path)
-                text = "\n".join([para.text for para in doc.paragraphs])
+                # Custom docx loader, in a worker process for large files
+                if should_parse_docx_in_pool(file_path):
+                    text = parse_docx_text(file_path)
+                else:
+                    doc = docx.Document(file_path)
+                    text = "\n".join([para.text for para in doc.paragraphs])
                 documents = [Document(page_content=text, metadata={"source": file_path})]
             elif file_path.endswith(".txt"):
                 loader = TextLoader(file_path)
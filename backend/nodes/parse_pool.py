@@ -0,0 +1,115 @@
+"""
+Parallel Document Parsing
+Parses large PDFs in page ranges and large DOCX files on a process pool, so
+text extraction uses several cores and does not hold the server's GIL.
+This module only imports the parsers, keeping worker start-up cheap.
+"""
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+
+# Worker processes for parsing (defaults to the number of cores)
+PARSE_PROCESSES = max(1, int(os.getenv("PARSE_PROCESSES", str(os.cpu_count() or 1))))
+# PDFs with fewer pages are parsed in-process
+PARALLEL_PDF_MIN_PAGES = int(os.getenv("PARALLEL_PDF_MIN_PAGES", "50"))
+# Pages parsed per worker task
+PDF_PAGES_PER_TASK = max(1, int(os.getenv("PDF_PAGES_PER_TASK", "25")))
+# DOCX files smaller than this are parsed in-process
+PARALLEL_DOCX_MIN_MB = float(os.getenv("PARALLEL_DOCX_MIN_MB", "5"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned workers do not inherit the server's threads and locks
+            _pool = ProcessPoolExecutor(
+                max_workers=PARSE_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+def pdf_page_count(file_path: str) -> int:
+    """
+    Returns the number of pages of a PDF without extracting any text.
+    """
+    from pypdf import PdfReader
+    return len(PdfReader(file_path).pages)
+
+def should_parse_pdf_in_pool(file_path: str) -> bool:
+    """
+    Checks whether a PDF is large enough to be parsed on the process pool.
+    """
+    if PARSE_PROCESSES < 2:
+        return False
+    try:
+        return pdf_page_count(file_path) >= PARALLEL_PDF_MIN_PAGES
+    except Exception:
+        # Let the regular loader report unreadable files
+        return False
+
+def should_parse_docx_in_pool(file_path: str) -> bool:
+    """
+    Checks whether a DOCX is large enough to be parsed in a worker process.
+    """
+    try:
+        return os.path.getsize(file_path) >= PARALLEL_DOCX_MIN_MB * 1024 * 1024
+    except OSError:
+        return False
+
+def _parse_pdf_range(file_path: str, start: int, end: int) -> List[Tuple[str, Dict]]:
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    total = len(reader.pages)
+    labels = reader.page_labels
+    pages = []
+    for number in range(start, min(end, total)):
+        text = reader.pages[number].extract_text(extraction_mode="plain").strip()
+        pages.append((text, {
+            "source": file_path,
+            "total_pages": total,
+            "page": number,
+            "page_label": labels[number],
+        }))
+    return pages
+
+def parse_pdf_pages(file_path: str) -> Iterator[Tuple[str, Dict]]:
+    """
+    Parses a PDF in page ranges on the process pool.
+
+    Yields:
+        (text, metadata) per page, in page order, as soon as the range holding
+        the page has been parsed
+    """
+    total = pdf_page_count(file_path)
+    pages_per_task = max(PDF_PAGES_PER_TASK, math.ceil(total / (PARSE_PROCESSES * 4)))
+    print(f"Parsing {total} PDF pages on {PARSE_PROCESSES} processes ({pages_per_task} pages per task)")
+
+    pool = _get_pool()
+    futures = [
+        pool.submit(_parse_pdf_range, file_path, start, start + pages_per_task)
+        for start in range(0, total, pages_per_task)
+    ]
+    try:
+        for future in futures:
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+def _parse_docx(file_path: str) -> str:
+    import docx
+    document = docx.Document(file_path)
+    return "\n".join([para.text for para in document.paragraphs])
+
+def parse_docx_text(file_path: str) -> str:
+    """
+    Extracts the paragraph text of a DOCX file in a worker process.
+    A DOCX body is a single XML part, so it is not split further.
+    """
+    return _get_pool().submit(_parse_docx, file_path).result()
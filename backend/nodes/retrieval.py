@@ -1,28 +1,83 @@
-from langchain_chroma import Chroma
-from langchain_ollama import OllamaEmbeddings
+import os
+from typing import List
+from langchain_core.documents import Document
+from backend.nodes.embedding_cache import get_embeddings
+from backend.nodes.vector_store import collection_for_state, get_index
+from backend.nodes.collection_manager import touch_collection
+from backend.nodes.lexical_index import RETRIEVAL_MODE, get_lexical_index, reciprocal_rank_fusion
+
+# Number of chunks retrieved per feature
+RETRIEVAL_K = 5
+# Candidates taken from each ranking before hybrid fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", str(RETRIEVAL_K * 2)))
+
+def _dense_index(state):
+    index = get_index(state)
+    if index.backend == "chroma":
+        touch_collection(collection_for_state(state))
+    return index
+
+def _lexical_search(state, queries: List[str], k: int) -> List[List[Document]]:
+    index = get_lexical_index(collection_for_state(state), state.get("chunks"))
+    if index is None:
+        print("Warning: No chunks available for lexical retrieval.")
+        return [[] for _ in queries]
+    return [index.search(query, k) for query in queries]
 
 def retrieve_chunks(state):
     """
     Retrieves relevant chunks from the vector store based on the feature name.
+    RETRIEVAL_MODE selects dense, lexical (BM25) or hybrid retrieval.
     """
     print("---RETRIEVING CHUNKS---")
     feature_name = state["feature_name"]
-    
-    embeddings = OllamaEmbeddings(model="nomic-embed-text")
-    persist_dir = "./chroma_db"
-    
-    vectorstore = Chroma(
-        persist_directory=persist_dir,
-        embedding_function=embeddings,
-        collection_name="requirements_vectors"
-    )
-    
+
     # Retrieve top k chunks
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
-    retrieved_docs = retriever.invoke(feature_name)
-    
+    if RETRIEVAL_MODE == "lexical":
+        retrieved_docs = _lexical_search(state, [feature_name], RETRIEVAL_K)[0]
+    elif RETRIEVAL_MODE == "hybrid":
+        dense = _dense_index(state).search(feature_name, HYBRID_CANDIDATES)
+        lexical = _lexical_search(state, [feature_name], HYBRID_CANDIDATES)[0]
+        retrieved_docs = reciprocal_rank_fusion([dense, lexical], RETRIEVAL_K)
+    else:
+        retrieved_docs = _dense_index(state).search(feature_name, RETRIEVAL_K)
+
     print(f"Retrieved {len(retrieved_docs)} chunks.")
     # Merge chunks into existing state
     new_state = dict(state)
     new_state["retrieved_chunks"] = retrieved_docs
     return new_state
+
+def retrieve_chunks_bulk(state, feature_names: List[str], k: int = RETRIEVAL_K) -> List[List[Document]]:
+    """
+    Retrieves chunks for several features at once: all feature names are
+    embedded in one request and matched in a single collection query.
+
+    Args:
+        state: Graph state identifying the document collection
+        feature_names: Names to retrieve chunks for
+        k: Number of chunks per feature
+
+    Returns:
+        One list of documents per feature name, in the same order
+    """
+    print(f"---RETRIEVING CHUNKS FOR {len(feature_names)} FEATURES---")
+    if not feature_names:
+        return []
+
+    if RETRIEVAL_MODE == "lexical":
+        retrieved = _lexical_search(state, feature_names, k)
+    else:
+        candidates = HYBRID_CANDIDATES if RETRIEVAL_MODE == "hybrid" else k
+        query_vectors = get_embeddings().embed_queries(feature_names)
+        retrieved = _dense_index(state).query(query_vectors, candidates)
+
+        if RETRIEVAL_MODE == "hybrid":
+            lexical = _lexical_search(state, feature_names, candidates)
+            retrieved = [
+                reciprocal_rank_fusion([dense, keyword], k)
+                for dense, keyword in zip(retrieved, lexical)
+            ]
+
+    print(f"Retrieved {sum(len(docs) for docs in retrieved)} chunks.")
+    return retrieved
@@ -0,0 +1,107 @@
+"""
+Shared Store
+Coordination between uvicorn worker processes: SQLite connections set up for
+concurrent writers, advisory file locks and worker identities.
+"""
+import os
+import socket
+import sqlite3
+import threading
+from typing import Dict
+
+try:
+    import fcntl
+except ImportError:  # Windows: locks only cover the threads of one process
+    fcntl = None
+
+# Directory for the databases and lock files shared by all workers
+SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR", "./shared_state")
+LOCK_DIR = os.path.join(SHARED_STATE_DIR, "locks")
+
+def worker_id() -> str:
+    """
+    Identifies the current worker process as "<host>:<pid>".
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def worker_alive(owner: str) -> bool:
+    """
+    Checks whether the worker that wrote a record still runs. Workers on other
+    hosts cannot be checked and count as alive.
+    """
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+
+def connect(path: str) -> sqlite3.Connection:
+    """
+    Opens a SQLite database for use by several threads and processes: WAL
+    journal, waits on locks instead of failing, autocommit unless a
+    transaction is started explicitly.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+_local_locks: Dict[str, threading.Lock] = {}
+_local_locks_guard = threading.Lock()
+
+class FileLock:
+    """
+    Exclusive lock shared by all workers on this host, backed by flock on
+    LOCK_DIR/<name>.lock. Also usable as a context manager.
+    """
+
+    def __init__(self, name: str):
+        self.path = os.path.join(LOCK_DIR, f"{name}.lock")
+        self._file = None
+        self._local = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """
+        Takes the lock. Without blocking, returns False at once if it is held.
+        """
+        if fcntl is None:
+            with _local_locks_guard:
+                lock = _local_locks.setdefault(self.path, threading.Lock())
+            if not lock.acquire(blocking):
+                return False
+            self._local = lock
+            return True
+        os.makedirs(LOCK_DIR, exist_ok=True)
+        # flock is held per open file, so threads of one process exclude each other too
+        self._file = open(self.path, "a")
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._file.close()
+            self._file = None
+            return False
+        return True
+
+    def release(self) -> None:
+        if self._local is not None:
+            self._local.release()
+            self._local = None
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -1,20 +1,42 @@
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from backend.nodes.lexical_index import RETRIEVAL_MODE, build_lexical_index
+from backend.nodes.vector_store import collection_for_state
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+
+def get_text_splitter():
+    """
+    Returns the splitter used for all ingested documents.
+    """
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=["\n\n", "\n", " ", ""]
+    )
+
+def index_chunks_lexically(state, chunks):
+    """
+    Builds the BM25 index for the chunks in lexical and hybrid retrieval mode.
+    """
+    if RETRIEVAL_MODE in ("lexical", "hybrid"):
+        build_lexical_index(collection_for_state(state), chunks)
 
 def split_text(state):
     """
     Splits the loaded documents into chunks.
+    In lexical and hybrid retrieval mode the BM25 index is built here as well.
     """
     print("---SPLITTING TEXT---")
     documents = state["documents"]
-    
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=100,
-        separators=["\n\n", "\n", " ", ""]
-    )
-    
+
+    text_splitter = get_text_splitter()
+
     chunks = text_splitter.split_documents(documents)
     print(f"Split into {len(chunks)} chunks.")
+
+    index_chunks_lexically(state, chunks)
+
     # Merge chunks into existing state
     new_state = dict(state)
     new_state["chunks"] = chunks
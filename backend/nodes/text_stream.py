@@ -0,0 +1,63 @@
+"""
+Streaming Text Loader
+Reads very large text files through a memory map in bounded windows, so a
+multi-hundred-MB dump is never decoded or held in memory as one string.
+"""
+import mmap
+import os
+from typing import Iterator
+
+from langchain_core.documents import Document
+
+# Text files at least this large are read in windows
+TXT_STREAM_MIN_MB = float(os.getenv("TXT_STREAM_MIN_MB", "16"))
+# Bytes decoded at a time; bounds the text held per window
+TXT_WINDOW_MB = float(os.getenv("TXT_WINDOW_MB", "4"))
+
+def should_stream_text(file_path: str) -> bool:
+    """
+    Checks whether a text file is large enough to be read in windows.
+    """
+    try:
+        return os.path.getsize(file_path) >= TXT_STREAM_MIN_MB * 1024 * 1024
+    except OSError:
+        return False
+
+def _window_end(data: mmap.mmap, start: int, limit: int) -> int:
+    # Prefer a paragraph or line break in the second half of the window, so
+    # windows end where the splitter would cut anyway
+    if limit >= len(data):
+        return len(data)
+    middle = start + (limit - start) // 2
+    for separator in (b"\n\n", b"\n"):
+        cut = data.rfind(separator, middle, limit)
+        if cut != -1:
+            return cut + len(separator)
+    # Otherwise do not cut through a UTF-8 sequence
+    end = limit
+    while end > start and (data[end] & 0xC0) == 0x80:
+        end -= 1
+    return end
+
+def iter_text_windows(file_path: str, window_bytes: int = None) -> Iterator[Document]:
+    """
+    Yields the text file as consecutive documents of about window_bytes each,
+    cut at line breaks where possible.
+    """
+    window_bytes = max(1024, int(window_bytes or TXT_WINDOW_MB * 1024 * 1024))
+    if os.path.getsize(file_path) == 0:
+        return
+
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        start = 0
+        window = 0
+        while start < len(data):
+            end = _window_end(data, start, start + window_bytes)
+            text = data[start:end].decode("utf-8", errors="replace")
+            yield Document(page_content=text, metadata={"source": file_path, "window": window})
+            # Read pages can be dropped from the page cache mapping right away
+            if hasattr(data, "madvise") and hasattr(mmap, "MADV_DONTNEED"):
+                aligned = start - start % mmap.PAGESIZE
+                data.madvise(mmap.MADV_DONTNEED, aligned, end - aligned)
+            start = end
+            window += 1
@@ -0,0 +1,156 @@
+"""
+URL Fetcher
+Downloads requirement pages with a pooled async HTTP client running on a
+background event loop, with timeouts and a size cap. Bodies are cached on disk
+and revalidated with ETag/Last-Modified, so an unchanged page answers 304 and
+its cached body (and thus its cached chunks and embeddings) is reused.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import httpx
+
+URL_CACHE_DIR = os.getenv("URL_CACHE_DIR", "./url_cache")
+URL_FETCH_TIMEOUT = float(os.getenv("URL_FETCH_TIMEOUT", "20"))
+URL_CONNECT_TIMEOUT = float(os.getenv("URL_CONNECT_TIMEOUT", "5"))
+URL_MAX_MB = float(os.getenv("URL_MAX_MB", "20"))
+URL_MAX_CONNECTIONS = int(os.getenv("URL_MAX_CONNECTIONS", "20"))
+
+class URLTooLargeError(Exception):
+    """
+    Raised when a page exceeds URL_MAX_MB.
+    """
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_client: Optional[httpx.AsyncClient] = None
+_loop_lock = threading.Lock()
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the background event loop that owns the shared HTTP client.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="url-fetcher", daemon=True).start()
+            _loop = loop
+        return _loop
+
+def _get_client() -> httpx.AsyncClient:
+    # Only called on the background loop
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(URL_FETCH_TIMEOUT, connect=URL_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=URL_MAX_CONNECTIONS, max_keepalive_connections=URL_MAX_CONNECTIONS),
+            follow_redirects=True
+        )
+    return _client
+
+def _cache_paths(url: str):
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return os.path.join(URL_CACHE_DIR, f"{key}.json"), os.path.join(URL_CACHE_DIR, f"{key}.body")
+
+def _read_cache(url: str) -> Optional[Dict]:
+    meta_path, body_path = _cache_paths(url)
+    if not (os.path.exists(meta_path) and os.path.exists(body_path)):
+        return None
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Ignoring unreadable URL cache entry for {url}: {e}")
+        return None
+
+def _read_cached_body(url: str) -> bytes:
+    with open(_cache_paths(url)[1], "rb") as f:
+        return f.read()
+
+def _atomic_write(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def _write_cache(url: str, response: httpx.Response, content: bytes) -> None:
+    etag = response.headers.get("etag")
+    last_modified = response.headers.get("last-modified")
+    if not (etag or last_modified):
+        # Nothing to revalidate with
+        return
+    os.makedirs(URL_CACHE_DIR, exist_ok=True)
+    meta_path, body_path = _cache_paths(url)
+    meta = {
+        "url": url,
+        "etag": etag,
+        "last_modified": last_modified,
+        "size": len(content),
+        "fetched_at": time.time(),
+    }
+    # Body first, so metadata never points at a missing or older body
+    _atomic_write(body_path, content)
+    _atomic_write(meta_path, json.dumps(meta).encode("utf-8"))
+
+async def fetch_url_async(url: str) -> Dict:
+    """
+    Fetches a page, revalidating a cached copy when there is one.
+
+    Returns:
+        Dict with "content" (bytes), "status" and "from_cache" (True when the
+        server answered 304 and the cached body was reused)
+
+    Raises:
+        URLTooLargeError: If the body exceeds URL_MAX_MB
+        httpx.HTTPError: On timeouts, connection and HTTP status errors
+    """
+    max_bytes = int(URL_MAX_MB * 1024 * 1024)
+    # Cache files are read and written off the loop, which other fetches share
+    cached = await asyncio.to_thread(_read_cache, url)
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    async with _get_client().stream("GET", url, headers=headers) as response:
+        if response.status_code == 304 and cached:
+            print(f"URL not modified, reusing cached body: {url}")
+            content = await asyncio.to_thread(_read_cached_body, url)
+            return {"content": content, "status": 304, "from_cache": True}
+
+        response.raise_for_status()
+        declared = response.headers.get("content-length")
+        if declared and declared.isdigit() and int(declared) > max_bytes:
+            raise URLTooLargeError(f"Page is larger than {URL_MAX_MB:g} MB: {url}")
+
+        body = bytearray()
+        async for block in response.aiter_bytes():
+            body.extend(block)
+            if len(body) > max_bytes:
+                raise URLTooLargeError(f"Page is larger than {URL_MAX_MB:g} MB: {url}")
+
+    content = bytes(body)
+    try:
+        await asyncio.to_thread(_write_cache, url, response, content)
+    except Exception as e:
+        # A failed cache write must not fail the request
+        print(f"Error caching URL body: {e}")
+    return {"content": content, "status": response.status_code, "from_cache": False}
+
+def fetch_url_content(url: str) -> bytes:
+    """
+    Downloads the raw body of a requirements page from a worker thread.
+    The request runs on the fetcher's event loop and shared connection pool.
+    """
+    future = asyncio.run_coroutine_threadsafe(fetch_url_async(url), _get_loop())
+    try:
+        return future.result()["content"]
+    except httpx.TimeoutException:
+        raise TimeoutError(f"Timed out after {URL_FETCH_TIMEOUT:g}s fetching {url}")
@@ -1,57 +1,90 @@
-from backend.nodes.llm_provider import get_llm, get_provider_name
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
+import os
+from concurrent.futures import ThreadPoolExecutor
+from backend.nodes.llm_provider import get_provider_name
+from backend.nodes.chain_registry import register_prompt, get_chain
+from backend.nodes.context_packer import pack_context
+from backend.nodes.cancellation import GenerationCancelled, with_current_context
 
-def check_hallucinations(state):
+# Number of test cases verified per LLM call; 1 keeps one call per test case
+VALIDATION_BATCH_SIZE = max(1, int(os.getenv("VALIDATION_BATCH_SIZE", "1")))
+
+# Number of validation calls (single cases or batches) in flight per feature
+VALIDATION_CONCURRENCY = max(1, int(os.getenv("VALIDATION_CONCURRENCY", "4")))
+
+VALIDATION_INSTRUCTIONS = """
+Instructions:
+1. Check if the test case steps and expected results are derived from the requirements.
+2. Be lenient with exact wording; look for semantic meaning.
+3. If the test case is a standard app behavior (like "Open app") implied by the feature, consider it supported.
+4. Only flag as unsupported if it explicitly contradicts the requirements or mentions features completely absent from the text.
+"""
+
+VALIDATION_PROMPT = """
+You are a QA auditor. Verify that the following test case is supported by the provided requirement text.
+
+Requirement Text:
+{context}
+
+Test Case:
+{test_case}
+""" + VALIDATION_INSTRUCTIONS + """
+Return a JSON object with:
+"supported": boolean,
+"reason": string (explanation if not supported, otherwise "Supported")
+"""
+
+BATCH_VALIDATION_PROMPT = """
+You are a QA auditor. Verify that each of the following test cases is supported by the provided requirement text.
+
+Requirement Text:
+{context}
+
+Test Cases (each prefixed with its index):
+{test_cases}
+""" + VALIDATION_INSTRUCTIONS + """
+Return a JSON object with a "results" key containing exactly one verdict per test case, in the same order:
+{{
+    "results": [
+        {{"index": 0, "supported": true, "reason": "Supported"}},
+        {{"index": 1, "supported": false, "reason": "explanation"}}
+    ]
+}}
+"""
+
+register_prompt("validation", "validation", VALIDATION_PROMPT, ["context", "test_case"])
+register_prompt("batch_validation", "validation", BATCH_VALIDATION_PROMPT, ["context", "test_cases"])
+
+def build_validation_chain():
     """
-    Verifies that each generated test case is supported by the retrieved requirement chunks.
+    Returns the chain that verifies a single test case.
     """
-    print("---CHECKING HALLUCINATIONS---")
-    provider = get_provider_name()
-    print(f"Using LLM Provider for validation: {provider}")
-    retrieved_chunks = state["retrieved_chunks"]
-    generated_test_cases = state["generated_test_cases"]
-    print(f"DEBUG: Validation received type: {type(generated_test_cases)}")
-    print(f"DEBUG: Validation received content: {generated_test_cases}")
-    
-    context = "\n\n".join([doc.page_content for doc in retrieved_chunks])
-    
-    llm = get_llm(temperature=0, format_json=True)
-    
-    prompt_template = """
-    You are a QA auditor. Verify that the following test case is supported by the provided requirement text.
-    
-    Requirement Text:
-    {context}
-    
-    Test Case:
-    {test_case}
-    
-    Instructions:
-    1. Check if the test case steps and expected results are derived from the requirements.
-    2. Be lenient with exact wording; look for semantic meaning.
-    3. If the test case is a standard app behavior (like "Open app") implied by the feature, consider it supported.
-    4. Only flag as unsupported if it explicitly contradicts the requirements or mentions features completely absent from the text.
-    
-    Return a JSON object with:
-    "supported": boolean,
-    "reason": string (explanation if not supported, otherwise "Supported")
+    return get_chain("validation")
+
+def build_batch_validation_chain():
     """
-    
-    prompt = PromptTemplate(
-        template=prompt_template,
-        input_variables=["context", "test_case"]
-    )
-    
-    chain = prompt | llm | JsonOutputParser()
-    
-    hallucination_errors = []
-    checked_test_cases = []
-    
-    # We can check each test case individually or in batch. 
-    # Checking individually is more precise but slower. 
-    # Given the likely small number, individual checks are safer for accuracy.
-    
+    Returns the chain that verifies several test cases in one call.
+    """
+    return get_chain("batch_validation")
+
+def split_into_batches(test_cases, batch_size=VALIDATION_BATCH_SIZE):
+    """
+    Splits test cases into consecutive groups of at most batch_size.
+    """
+    return [test_cases[i:i + batch_size] for i in range(0, len(test_cases), batch_size)]
+
+def _apply_verdict(test_case, result):
+    """
+    Sets hallucination flags on a test case from a {"supported", "reason"} verdict.
+    Returns the test case and an error message if it is not supported.
+    """
+    if not result.get("supported", True):
+        test_case["hallucination_flag"] = True
+        test_case["hallucination_reason"] = result.get("reason")
+        return test_case, f"Test Case {test_case.get('Test Case ID', 'Unknown')} not supported: {result.get('reason')}"
+    else:
+        test_case["hallucination_flag"] = False
+        return test_case, None
+
 def validate_single_test_case(test_case, context, chain):
     """
     Validates a single test case against the context using the provided chain.
@@ -61,22 +94,75 @@ def validate_single_test_case(test_case, context, chain):
         # Convert test case to string for the prompt
         test_case_str = str(test_case)
         result = chain.invoke({"context": context, "test_case": test_case_str})
-        
-        if not result.get("supported", True):
-            test_case["hallucination_flag"] = True
-            test_case["hallucination_reason"] = result.get("reason")
-            return test_case, f"Test Case {test_case.get('Test Case ID', 'Unknown')} not supported: {result.get('reason')}"
-        else:
-            test_case["hallucination_flag"] = False
-            return test_case, None
-            
+        return _apply_verdict(test_case, result)
+    
+    except GenerationCancelled:
+        # A cancelled run stops; it is not a verdict on the test case
+        raise
     except Exception as e:
         print(f"Error checking test case: {e}")
         return test_case, f"Error checking test case: {str(e)}"
 
+def _parse_batch_verdicts(response, count):
+    """
+    Extracts per-case verdicts from a batch reply.
+    Returns a dict of index -> verdict; indices that are missing or malformed
+    are left out so the caller can re-check them individually.
+    """
+    if isinstance(response, dict):
+        response = response.get("results")
+    if not isinstance(response, list):
+        return {}
+    
+    verdicts = {}
+    for position, item in enumerate(response):
+        if not isinstance(item, dict) or not isinstance(item.get("supported"), bool):
+            continue
+        index = item.get("index", position)
+        if isinstance(index, int) and 0 <= index < count and index not in verdicts:
+            verdicts[index] = item
+    return verdicts
+
+def validate_test_case_batch(test_cases, context, chain, batch_chain=None):
+    """
+    Validates a group of test cases with one LLM call, sending the context once.
+    Falls back to per-case checks for any case the batch reply does not cover.
+    
+    Args:
+        test_cases: Test cases to validate
+        context: Retrieved requirement text
+        chain: Single test case validation chain (used for fallbacks)
+        batch_chain: Batch validation chain; None validates case by case
+    
+    Returns:
+        List of (validated_test_case, error) tuples in input order
+    """
+    if batch_chain is None or len(test_cases) == 1:
+        return [validate_single_test_case(tc, context, chain) for tc in test_cases]
+    
+    formatted = "\n\n".join(f"[{i}] {tc}" for i, tc in enumerate(test_cases))
+    try:
+        response = batch_chain.invoke({"context": context, "test_cases": formatted})
+        verdicts = _parse_batch_verdicts(response, len(test_cases))
+    except GenerationCancelled:
+        raise
+    except Exception as e:
+        print(f"Error checking test case batch: {e}")
+        verdicts = {}
+    
+    if len(verdicts) < len(test_cases):
+        print(f"Batch validation covered {len(verdicts)}/{len(test_cases)} test cases, checking the rest individually.")
+    
+    return [
+        _apply_verdict(tc, verdicts[i]) if i in verdicts else validate_single_test_case(tc, context, chain)
+        for i, tc in enumerate(test_cases)
+    ]
+
 def check_hallucinations(state):
     """
     Verifies that each generated test case is supported by the retrieved requirement chunks.
+    Test cases are checked in groups of VALIDATION_BATCH_SIZE per LLM call, with
+    up to VALIDATION_CONCURRENCY calls running at once; results keep input order.
     """
     print("---CHECKING HALLUCINATIONS---")
     provider = get_provider_name()
@@ -84,40 +170,25 @@ def check_hallucinations(state):
     retrieved_chunks = state["retrieved_chunks"]
     generated_test_cases = state["generated_test_cases"]
     
-    context = "\n\n".join([doc.page_content for doc in retrieved_chunks])
-    
-    llm = get_llm(temperature=0, format_json=True)
-    
-    prompt_template = """
-    You are a QA auditor. Verify that the following test case is supported by the provided requirement text.
-    
-    Requirement Text:
-    {context}
-    
-    Test Case:
-    {test_case}
-    
-    Return a JSON object with:
-    "supported": boolean,
-    "reason": string (explanation if not supported)
-    """
-    
-    prompt = PromptTemplate(
-        template=prompt_template,
-        input_variables=["context", "test_case"]
-    )
+    context = pack_context(retrieved_chunks, "validation")
     
-    chain = prompt | llm | JsonOutputParser()
+    chain = build_validation_chain()
+    batch_chain = build_batch_validation_chain() if VALIDATION_BATCH_SIZE > 1 else None
     
     hallucination_errors = []
     checked_test_cases = []
     
     if isinstance(generated_test_cases, list):
-        for test_case in generated_test_cases:
-            validated_tc, error = validate_single_test_case(test_case, context, chain)
-            checked_test_cases.append(validated_tc)
-            if error:
-                hallucination_errors.append(error)
+        batches = split_into_batches(generated_test_cases)
+        with ThreadPoolExecutor(max_workers=VALIDATION_CONCURRENCY) as pool:
+            # map() yields in submission order, so the report keeps test case order
+            validate = with_current_context(lambda batch: validate_test_case_batch(batch, context, chain, batch_chain))
+            outcomes = pool.map(validate, batches)
+            for batch_outcomes in outcomes:
+                for validated_tc, error in batch_outcomes:
+                    checked_test_cases.append(validated_tc)
+                    if error:
+                        hallucination_errors.append(error)
     else:
         print("Generated test cases format is not a list.")
         
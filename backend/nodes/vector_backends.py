@@ -0,0 +1,156 @@
+"""
+Vector Index Backends
+Common interface over the vector stores used for retrieval: Chroma for large
+corpora and an in-memory NumPy index for small documents, where brute-force
+cosine similarity is cheaper than a persisted index.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+
+# "auto" picks NumPy up to NUMPY_BACKEND_MAX_CHUNKS chunks and Chroma above
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "auto").lower()
+NUMPY_BACKEND_MAX_CHUNKS = int(os.getenv("NUMPY_BACKEND_MAX_CHUNKS", "500"))
+# In-memory indexes kept per process, least recently used dropped first
+NUMPY_MAX_INDEXES = int(os.getenv("NUMPY_MAX_INDEXES", "32"))
+
+def choose_backend(chunk_count: int) -> str:
+    """
+    Returns "numpy" or "chroma" for a document with the given number of chunks.
+    """
+    if VECTOR_BACKEND in ("numpy", "chroma"):
+        return VECTOR_BACKEND
+    return "numpy" if chunk_count <= NUMPY_BACKEND_MAX_CHUNKS else "chroma"
+
+class VectorIndex:
+    """
+    Interface shared by the vector index backends.
+    """
+
+    backend = ""
+
+    def search(self, query: str, k: int) -> List[Document]:
+        """
+        Returns the k chunks most similar to a query text.
+        """
+        raise NotImplementedError
+
+    def query(self, query_vectors: List[List[float]], k: int) -> List[List[Document]]:
+        """
+        Returns the k most similar chunks for each query vector.
+        """
+        raise NotImplementedError
+
+class ChromaIndex(VectorIndex):
+    """
+    Index backed by a persisted Chroma collection.
+    """
+
+    backend = "chroma"
+
+    def __init__(self, client, collection_name: str, embeddings):
+        self.collection_name = collection_name
+        self.vectorstore = Chroma(
+            client=client,
+            embedding_function=embeddings,
+            collection_name=collection_name
+        )
+        self.collection = client.get_or_create_collection(collection_name)
+
+    def search(self, query: str, k: int) -> List[Document]:
+        retriever = self.vectorstore.as_retriever(search_kwargs={"k": k})
+        return retriever.invoke(query)
+
+    def query(self, query_vectors: List[List[float]], k: int) -> List[List[Document]]:
+        result = self.collection.query(
+            query_embeddings=query_vectors,
+            n_results=k,
+            include=["documents", "metadatas"]
+        )
+        return [
+            [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(documents, metadatas)]
+            for documents, metadatas in zip(result["documents"], result["metadatas"])
+        ]
+
+class NumpyIndex(VectorIndex):
+    """
+    In-memory index doing vectorized cosine top-k over a float32 matrix.
+    """
+
+    backend = "numpy"
+
+    def __init__(self, documents: List[Document], vectors: List[List[float]], embeddings):
+        self.documents = list(documents)
+        self.embeddings = embeddings
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2:
+            matrix = matrix.reshape(len(self.documents), -1)
+        self.matrix = _normalize(matrix)
+
+    def search(self, query: str, k: int) -> List[Document]:
+        return self.query([self.embeddings.embed_query(query)], k)[0]
+
+    def query(self, query_vectors: List[List[float]], k: int) -> List[List[Document]]:
+        if not self.documents or not query_vectors:
+            return [[] for _ in query_vectors]
+
+        k = min(k, len(self.documents))
+        queries = _normalize(np.asarray(query_vectors, dtype=np.float32))
+        scores = queries @ self.matrix.T
+
+        # Partial selection of the top k per row, then sort only those
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        rows = np.arange(scores.shape[0])[:, None]
+        order = np.argsort(-scores[rows, top], axis=1)
+        ranked = top[rows, order]
+
+        return [[self.documents[i] for i in row] for row in ranked.tolist()]
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+_numpy_indexes: "OrderedDict[str, NumpyIndex]" = OrderedDict()
+_numpy_lock = threading.Lock()
+
+def get_numpy_index(name: str) -> Optional[NumpyIndex]:
+    """
+    Returns the in-memory index for a collection name, if one is loaded.
+    """
+    with _numpy_lock:
+        index = _numpy_indexes.get(name)
+        if index is not None:
+            _numpy_indexes.move_to_end(name)
+        return index
+
+def put_numpy_index(name: str, index: NumpyIndex) -> None:
+    """
+    Keeps an in-memory index, dropping the least recently used beyond the cap.
+    """
+    with _numpy_lock:
+        _numpy_indexes[name] = index
+        _numpy_indexes.move_to_end(name)
+        while len(_numpy_indexes) > NUMPY_MAX_INDEXES:
+            _numpy_indexes.popitem(last=False)
+
+def drop_numpy_index(name: str) -> None:
+    """
+    Forgets the in-memory index for a collection name.
+    """
+    with _numpy_lock:
+        _numpy_indexes.pop(name, None)
+
+def numpy_index_stats() -> Dict:
+    """
+    Returns the number of in-memory indexes and the chunks they hold.
+    """
+    with _numpy_lock:
+        return {
+            "indexes": len(_numpy_indexes),
+            "chunks": sum(len(index.documents) for index in _numpy_indexes.values())
+        }
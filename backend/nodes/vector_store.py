@@ -1,70 +1,276 @@
-from langchain_chroma import Chroma
-from langchain_ollama import OllamaEmbeddings
+from backend.nodes.embedding_cache import get_embeddings
+from backend.nodes.embedding_pipeline import embed_in_batches
+from backend.nodes.vector_backends import (
+    ChromaIndex,
+    NumpyIndex,
+    choose_backend,
+    drop_numpy_index,
+    get_numpy_index,
+    put_numpy_index,
+)
+from backend.nodes.lexical_index import RETRIEVAL_MODE, drop_lexical_index
+from backend.nodes.collection_manager import (
+    PERSIST_DIR,
+    close_client,
+    collection_lock,
+    collection_name_for,
+    enforce_retention,
+    get_client,
+    get_collection_entry,
+    has_collection,
+    new_collection_path,
+    register_collection,
+    remove_collection_files,
+)
 import os
+import threading
+import uuid
 
-def store_vectors(state):
+# Legacy shared collection, used only when the document hash is unknown
+COLLECTION_NAME = "requirements_vectors"
+
+def has_vectors(doc_hash, chunk_count=None):
+    """
+    Checks whether chunks for the given document hash are already stored.
+    Documents small enough for the NumPy backend count as stored, since their
+    index is rebuilt in memory from the embedding cache.
+    """
+    if has_collection(doc_hash) or get_numpy_index(collection_name_for(doc_hash)):
+        return True
+    return chunk_count is not None and choose_backend(chunk_count) == "numpy"
+
+def collection_for_state(state):
+    """
+    Returns the collection name for the document in the state.
+    """
+    doc_hash = state.get("doc_hash")
+    return collection_name_for(doc_hash) if doc_hash else COLLECTION_NAME
+
+# Open Chroma handles, one per collection with its persist directory,
+# reused across retrievals
+_handles = {}
+_handles_lock = threading.Lock()
+
+def _chroma_index(collection_name):
+    # Another worker may have rewritten the collection into a new directory
+    entry = get_collection_entry(collection_name)
+    path = (entry or {}).get("path") or PERSIST_DIR
+    with _handles_lock:
+        cached = _handles.get(collection_name)
+        if cached is not None and cached[0] == path:
+            return cached[1]
+        if cached is not None and cached[0] != PERSIST_DIR:
+            close_client(cached[0])
+        index = ChromaIndex(get_client(path), collection_name, get_embeddings())
+        _handles[collection_name] = (path, index)
+        return index
+
+def get_index(state):
+    """
+    Returns the vector index for the document in the state.
+    NumPy indexes missing from memory (after a restart or eviction) are rebuilt
+    from the chunks in the state, which hits the embedding cache.
+    """
+    collection_name = collection_for_state(state)
+    index = get_numpy_index(collection_name)
+    if index is not None:
+        return index
+
+    doc_hash = state.get("doc_hash")
+    chunks = state.get("chunks") or []
+    if doc_hash and chunks and not has_collection(doc_hash) and choose_backend(len(chunks)) == "numpy":
+        print(f"Rebuilding in-memory index for {collection_name}...")
+        return _build_numpy_index(collection_name, chunks, get_embeddings())
+
+    return _chroma_index(collection_name)
+
+def release_index(collection_name):
     """
-    Embeds the chunks and stores them in ChromaDB.
+    Forgets the open index for a collection that was deleted or rebuilt.
+    """
+    with _handles_lock:
+        _handles.pop(collection_name, None)
+    drop_numpy_index(collection_name)
+    drop_lexical_index(collection_name)
+
+def _build_numpy_index(collection_name, chunks, embeddings):
+    vectors = embed_in_batches([chunk.page_content for chunk in chunks], embeddings)
+    index = NumpyIndex(chunks, vectors, embeddings)
+    put_numpy_index(collection_name, index)
+    return index
+
+class VectorSink:
+    """
+    Receives chunks with their vectors in document order and builds the
+    document's index. Vectors are buffered while the document still fits the
+    NumPy backend; once it outgrows it, the buffer and every later batch are
+    written straight to Chroma, so large documents never hold all their
+    vectors in memory. Chroma writes go to a new directory for the document
+    while holding its collection lock, so workers never write the same files.
+    """
+
+    def __init__(self, state):
+        self.collection_name = collection_for_state(state)
+        self.doc_hash = state.get("doc_hash")
+        self.source = state.get("url") or state.get("file_path", "")
+        self.embeddings = get_embeddings()
+        self.count = 0
+        self.approx_bytes = 0
+        self._chunks = []
+        self._vectors = []
+        self._collection = None
+        self._path = None
+        self._lock = None
+        self._mutex = threading.Lock()
+        self._discarded = False
+        release_index(self.collection_name)
+
+    def add(self, chunks, vectors):
+        """
+        Adds the next chunks of the document with one vector per chunk.
+        """
+        with self._mutex:
+            if self._discarded:
+                return
+            self.count += len(chunks)
+            self.approx_bytes += _approx_collection_bytes(vectors, chunks)
+
+            if self._collection is None and choose_backend(self.count) == "numpy":
+                self._chunks.extend(chunks)
+                self._vectors.extend(vectors)
+                return
+
+            if self._collection is None:
+                self._promote()
+                buffered_chunks, buffered_vectors = self._chunks, self._vectors
+                self._chunks, self._vectors = [], []
+                self._write(buffered_chunks, buffered_vectors)
+            self._write(chunks, vectors)
+
+    def _promote(self):
+        # Switch to Chroma; documents without a hash go to the shared legacy collection
+        if self.doc_hash:
+            self._lock = collection_lock(self.collection_name)
+            self._lock.acquire()
+            self._path = new_collection_path(self.collection_name)
+        else:
+            self._path = PERSIST_DIR
+        self._collection = get_client(self._path).get_or_create_collection(self.collection_name)
+
+    def _write(self, chunks, vectors):
+        write_size = get_client(self._path).get_max_batch_size()
+        for i in range(0, len(chunks), write_size):
+            batch = chunks[i:i + write_size]
+            self._collection.add(
+                ids=[str(uuid.uuid4()) for _ in batch],
+                embeddings=vectors[i:i + write_size],
+                documents=[chunk.page_content for chunk in batch],
+                metadatas=[chunk.metadata or None for chunk in batch]
+            )
+
+    def close(self):
+        """
+        Finishes the document and returns its vector index.
+        """
+        if self._collection is None:
+            # Nothing is written to disk; the ingestion cache keeps the chunks
+            index = NumpyIndex(self._chunks, self._vectors, self.embeddings)
+            put_numpy_index(self.collection_name, index)
+            print(f"{self.count} vectors indexed in memory.")
+            return index
+
+        if self.doc_hash:
+            try:
+                previous = get_collection_entry(self.collection_name)
+                register_collection(
+                    self.collection_name,
+                    doc_hash=self.doc_hash,
+                    source=self.source,
+                    chunk_count=self.count,
+                    approx_bytes=self.approx_bytes,
+                    path=self._path
+                )
+                if previous is not None:
+                    remove_collection_files(previous.get("path"), self.collection_name)
+            finally:
+                self._release_lock()
+            # Outside the lock: eviction takes the locks of other collections
+            enforce_retention(protect=self.collection_name)
+        print(f"{self.count} vectors stored successfully.")
+        return _chroma_index(self.collection_name)
+
+    def discard(self):
+        """
+        Abandons a failed or cancelled write, removing its directory.
+        """
+        with self._mutex:
+            if self._discarded:
+                return
+            self._discarded = True
+            self._chunks, self._vectors = [], []
+            if self._lock is not None:
+                remove_collection_files(self._path, self.collection_name)
+                self._release_lock()
+
+    def _release_lock(self):
+        if self._lock is not None:
+            self._lock.release()
+            self._lock = None
+
+def store_vectors(state, vectors=None):
+    """
+    Embeds the chunks and stores them in the vector index. Small documents go
+    to an in-memory NumPy index, larger ones to ChromaDB.
+    
+    Args:
+        state: Graph state with the chunks to store
+        vectors: Optional precomputed vectors, one per chunk; the chunks are
+            embedded otherwise
     """
     print("---STORING VECTORS---")
     chunks = state["chunks"]
     
     try:
-        # Initialize Ollama Embeddings
-        embeddings = OllamaEmbeddings(model="nomic-embed-text")
-        
-        # Initialize Chroma
-        persist_dir = "./chroma_db"
-        
         # Check if chunks is empty
         if not chunks:
             print("Warning: No chunks to store.")
             return {"vectorstore": None}
-            
-        print(f"Storing {len(chunks)} chunks in vector store...")
         
-        # Process in batches to avoid overwhelming Ollama
-        batch_size = 1  # Process one by one for maximum stability
-        vectorstore = None
-        import time
+        if RETRIEVAL_MODE == "lexical":
+            print("Lexical retrieval mode, skipping embeddings.")
+            return {"vectorstore": None}
         
-        total_batches = (len(chunks) + batch_size - 1) // batch_size
+        print(f"Storing {len(chunks)} chunks in vector store ({choose_backend(len(chunks))})...")
         
-        for i in range(0, len(chunks), batch_size):
-            batch = chunks[i:i + batch_size]
-            current_batch = i // batch_size + 1
-            print(f"Processing batch {current_batch}/{total_batches} ({len(batch)} chunks)")
-            
-            # Retry logic
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    if vectorstore is None:
-                        vectorstore = Chroma.from_documents(
-                            documents=batch,
-                            embedding=embeddings,
-                            persist_directory=persist_dir,
-                            collection_name="requirements_vectors"
-                        )
-                    else:
-                        vectorstore.add_documents(documents=batch)
-                    break  # Success, exit retry loop
-                except Exception as e:
-                    print(f"Error processing batch {current_batch} (Attempt {attempt+1}/{max_retries}): {e}")
-                    if attempt < max_retries - 1:
-                        wait_time = 2 * (attempt + 1)
-                        print(f"Waiting {wait_time}s before retrying...")
-                        time.sleep(wait_time)
-                    else:
-                        raise Exception(f"Failed to process batch {current_batch} after {max_retries} attempts: {e}")
-            
-            # Delay between successful batches
-            time.sleep(0.5)
+        # Tag chunks with their document
+        doc_hash = state.get("doc_hash")
+        if doc_hash:
+            for chunk in chunks:
+                chunk.metadata["doc_hash"] = doc_hash
         
-        print("Vectors stored successfully.")
-        return {"vectorstore": vectorstore}
+        sink = VectorSink(state)
+        
+        try:
+            # Embed in adaptive, concurrent batches, then write precomputed vectors
+            if vectors is None:
+                texts = [chunk.page_content for chunk in chunks]
+                vectors = embed_in_batches(texts, sink.embeddings)
+            
+            sink.add(chunks, vectors)
+            return {"vectorstore": sink.close()}
+        except Exception:
+            sink.discard()
+            raise
         
     except Exception as e:
         print(f"Error storing vectors: {e}")
         # Propagate error to be handled by streaming.py
         raise Exception(f"Failed to create vector store: {str(e)}")
+
+def _approx_collection_bytes(vectors, chunks):
+    """
+    Estimates the on-disk size of a collection from its text and vectors.
+    """
+    text_bytes = sum(len(chunk.page_content.encode("utf-8")) for chunk in chunks)
+    dimensions = len(vectors[0]) if len(vectors) else 0
+    return text_bytes + len(chunks) * dimensions * 4
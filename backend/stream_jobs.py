@@ -0,0 +1,483 @@
+"""
+Resumable Streams
+Runs each streaming generation as a job that is independent of the HTTP
+connection. Its SSE events are numbered and appended to a per-job event log,
+so a client that reconnects with Last-Event-ID gets the events it missed and
+then follows the live run, instead of starting the pipeline over. Identical
+requests arriving while a run is in flight join it rather than starting their
+own. A run is cancelled once every requester has stopped it, or once no
+client has followed it for a grace period.
+
+Subscribers, followers and cancel requests are kept in a SQLite table shared
+by the worker processes. A client served by another worker than the one
+running its job follows the job by tailing its event log.
+"""
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+from backend.nodes.cancellation import CancelToken, record_skipped, set_current_token
+from backend.nodes.shared_store import SHARED_STATE_DIR, connect, worker_alive, worker_id
+
+JOB_LOG_DIR = os.getenv("JOB_LOG_DIR", "./job_logs")
+# Event logs older than this are deleted
+JOB_LOG_TTL_HOURS = float(os.getenv("JOB_LOG_TTL_HOURS", "24"))
+# Seconds a finished run stays in memory; afterwards it is replayed from its log
+STREAM_JOB_MEMORY_TTL = float(os.getenv("STREAM_JOB_MEMORY_TTL", "600"))
+# Seconds of silence after which a comment frame keeps proxies from dropping the stream
+STREAM_KEEPALIVE_SECONDS = float(os.getenv("STREAM_KEEPALIVE_SECONDS", "15"))
+# Seconds a run may go without any connected client before it is cancelled
+STREAM_ORPHAN_GRACE_SECONDS = float(os.getenv("STREAM_ORPHAN_GRACE_SECONDS", "60"))
+STREAM_JOB_DB_PATH = os.getenv("STREAM_JOB_DB_PATH", os.path.join(SHARED_STATE_DIR, "stream_jobs.sqlite"))
+# Seconds between heartbeats of a worker's running jobs; cancel requests from
+# other workers and orphaned runs are noticed at this pace
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "2"))
+# A running job whose worker has sent no heartbeat for this long is treated as lost
+STREAM_OWNER_TIMEOUT = float(os.getenv("STREAM_OWNER_TIMEOUT", "30"))
+# Seconds between reads of another worker's event log
+STREAM_TAIL_INTERVAL = float(os.getenv("STREAM_TAIL_INTERVAL", "0.5"))
+
+_JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+_INTERRUPTED = json.dumps({"type": "error", "message": "Generation was interrupted, please start it again."})
+
+class _StreamJobTable:
+    """
+    Shared state of the streaming jobs of all workers.
+    """
+
+    def __init__(self, path: str):
+        self._conn = connect(path)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS stream_jobs (id TEXT PRIMARY KEY, key TEXT, owner TEXT, "
+            "status TEXT, subscribers INTEGER, followers INTEGER, cancel_requested INTEGER, "
+            "heartbeat REAL, created_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS stream_jobs_key ON stream_jobs (key, status)")
+
+    def _transaction(self, fn: Callable):
+        # Read-modify-write under a write lock, so workers cannot interleave
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn()
+                self._conn.execute("COMMIT")
+                return result
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def insert(self, job_id: str, key: Optional[str]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO stream_jobs VALUES (?, ?, ?, 'running', 1, 0, 0, ?, ?)",
+                (job_id, key, worker_id(), now, now)
+            )
+
+    def finish(self, job_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE stream_jobs SET status = 'finished', heartbeat = ? WHERE id = ?", (time.time(), job_id)
+            )
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT owner, status, subscribers, followers, heartbeat FROM stream_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("owner", "status", "subscribers", "followers", "heartbeat"), row))
+
+    def join(self, key: str) -> Optional[Tuple[str, str]]:
+        """
+        Adds a subscriber to the live run with the key.
+        Returns its (job_id, owner), or None if there is none.
+        """
+        def join():
+            rows = self._conn.execute(
+                "SELECT id, owner FROM stream_jobs WHERE key = ? AND status = 'running' "
+                "AND cancel_requested = 0 AND heartbeat > ? ORDER BY created_at DESC",
+                (key, time.time() - STREAM_OWNER_TIMEOUT)
+            ).fetchall()
+            for job_id, owner in rows:
+                if worker_alive(owner):
+                    self._conn.execute("UPDATE stream_jobs SET subscribers = subscribers + 1 WHERE id = ?", (job_id,))
+                    return job_id, owner
+            return None
+        return self._transaction(join)
+
+    def release(self, job_id: str) -> int:
+        """
+        Removes a subscriber, requesting cancellation when none is left.
+        Returns the remaining subscribers.
+        """
+        def release():
+            self._conn.execute("UPDATE stream_jobs SET subscribers = MAX(subscribers - 1, 0) WHERE id = ?", (job_id,))
+            row = self._conn.execute("SELECT subscribers FROM stream_jobs WHERE id = ?", (job_id,)).fetchone()
+            remaining = row[0] if row else 0
+            if remaining == 0:
+                self._conn.execute("UPDATE stream_jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+            return remaining
+        return self._transaction(release)
+
+    def add_followers(self, job_id: str, delta: int) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE stream_jobs SET followers = MAX(followers + ?, 0) WHERE id = ?", (delta, job_id))
+
+    def heartbeat(self, job_ids: List[str]) -> Dict[str, Tuple[int, int]]:
+        """
+        Marks the jobs as alive and returns their (followers, cancel_requested).
+        """
+        placeholders = ", ".join("?" for _ in job_ids)
+        with self._lock:
+            self._conn.execute(f"UPDATE stream_jobs SET heartbeat = ? WHERE id IN ({placeholders})", (time.time(), *job_ids))
+            rows = self._conn.execute(
+                f"SELECT id, followers, cancel_requested FROM stream_jobs WHERE id IN ({placeholders})", job_ids
+            ).fetchall()
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    def prune(self, before: float) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM stream_jobs WHERE status = 'finished' AND heartbeat < ?", (before,))
+
+_table: Optional[_StreamJobTable] = None
+
+def _get_table() -> _StreamJobTable:
+    global _table
+    if _table is None:
+        _table = _StreamJobTable(STREAM_JOB_DB_PATH)
+    return _table
+
+class StreamJob:
+    """
+    A streaming generation and the events it has produced so far. A job run
+    by another worker (remote) is filled by tailing that worker's event log.
+    """
+
+    def __init__(self, job_id: str, events: Optional[List[str]] = None, finished: bool = False, remote: bool = False):
+        self.id = job_id
+        self.events: List[str] = events if events is not None else []
+        self.finished = finished
+        self.finished_at: Optional[float] = time.time() if finished else None
+        self.remote = remote
+        self.task: Optional[asyncio.Task] = None
+        self.token = CancelToken()
+        self.key: Optional[str] = None
+        # Since when no client of any worker has followed the run
+        self.orphaned_since: Optional[float] = None
+        self._log = None
+        self._changed = asyncio.Event()
+
+    def _append(self, data: str) -> None:
+        self.events.append(data)
+        if self._log is not None:
+            try:
+                self._log.write(data + "\n")
+                self._log.flush()
+            except Exception as e:
+                print(f"Error writing job event log {self.id}: {e}")
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _finish(self) -> None:
+        self.finished = True
+        self.finished_at = time.time()
+        self._notify()
+
+    def cancel(self, reason: str) -> bool:
+        """
+        Cancels a job run by this worker: the generator is interrupted,
+        pending features and validations are dropped and workers skip further
+        model calls. Returns False if the job had already finished or been
+        cancelled.
+        """
+        if self.remote or self.finished or not self.token.cancel(reason):
+            return False
+        print(f"---CANCELLING JOB {self.id} ({reason})---")
+        record_skipped(f"runs_cancelled.{reason}")
+        if self.task is not None:
+            self.task.cancel()
+        return True
+
+    async def release(self, reason: str) -> Tuple[bool, int]:
+        """
+        Drops one requester's interest in the run. When nobody else shares it
+        the run is cancelled, right away if this worker runs it, otherwise by
+        its worker at the next heartbeat.
+
+        Returns:
+            Whether the run is being cancelled, and the remaining subscribers
+        """
+        if self.finished:
+            return False, 0
+        remaining = await asyncio.to_thread(_get_table().release, self.id)
+        if remaining > 0:
+            print(f"---JOB {self.id} STILL HAS {remaining} SUBSCRIBERS---")
+            return False, remaining
+        if self.remote:
+            return True, 0
+        return self.cancel(reason), 0
+
+    async def _run(self, frames: AsyncIterator[str]) -> None:
+        # Tasks and threads started by the generator inherit this token
+        set_current_token(self.token)
+        try:
+            async for frame in frames:
+                self._append(_frame_data(frame))
+        except asyncio.CancelledError:
+            self._append(json.dumps({"type": "error", "message": "Generation was cancelled."}))
+        except Exception as e:
+            print(f"Stream job {self.id} failed: {e}")
+            self._append(json.dumps({"type": "error", "message": str(e)}))
+        finally:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            self._finish()
+            try:
+                await asyncio.to_thread(_get_table().finish, self.id)
+            except Exception as e:
+                print(f"Error recording end of job {self.id}: {e}")
+
+    async def _tail(self, owner: str) -> None:
+        # Follows a job run by another worker through its event log
+        offset = 0
+        try:
+            while True:
+                lines, offset = await asyncio.to_thread(_read_log, self.id, offset)
+                for line in lines:
+                    self._append(line)
+                if self.events and _is_final(self.events[-1]):
+                    return
+                row = await asyncio.to_thread(_get_table().get, self.id)
+                if row is None or row["status"] != "running":
+                    # The run ended after the read above; pick up its last events
+                    lines, offset = await asyncio.to_thread(_read_log, self.id, offset)
+                    for line in lines:
+                        self._append(line)
+                    if not (self.events and _is_final(self.events[-1])):
+                        self._append(_INTERRUPTED)
+                    return
+                if time.time() - row["heartbeat"] > STREAM_OWNER_TIMEOUT or not worker_alive(owner):
+                    self._append(_INTERRUPTED)
+                    return
+                await asyncio.sleep(STREAM_TAIL_INTERVAL)
+        except Exception as e:
+            print(f"Error following job {self.id}: {e}")
+            self._append(_INTERRUPTED)
+        finally:
+            self._finish()
+
+    async def follow(self, after: int = 0) -> AsyncIterator[str]:
+        """
+        Yields SSE frames for the events after sequence number `after`, then
+        for new events as they arrive, until the run has finished. Each frame
+        carries an id of "<job_id>:<seq>" for Last-Event-ID.
+        """
+        seq = max(0, after)
+        loop = asyncio.get_running_loop()
+        counted = not self.finished
+        if counted:
+            await asyncio.to_thread(_get_table().add_followers, self.id, 1)
+        try:
+            while True:
+                while seq < len(self.events):
+                    seq += 1
+                    # The id line follows the data line; clients parse frames by their data prefix
+                    yield f"data: {self.events[seq - 1]}\nid: {self.id}:{seq}\n\n"
+                if self.finished:
+                    return
+                changed = self._changed
+                try:
+                    await asyncio.wait_for(changed.wait(), STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            if counted:
+                # Not awaited: this also runs while the connection is being torn down
+                loop.run_in_executor(None, _get_table().add_followers, self.id, -1)
+
+def _frame_data(frame: str) -> str:
+    # Generators yield "data: {json}\n\n" frames; the log keeps the JSON only
+    return frame.strip()[len("data: "):]
+
+def _is_final(data: str) -> bool:
+    # A run ends with "complete" or with an error that is not tied to one feature
+    try:
+        event = json.loads(data)
+    except ValueError:
+        return False
+    return event.get("type") == "complete" or (event.get("type") == "error" and "feature" not in event)
+
+def _log_path(job_id: str) -> str:
+    return os.path.join(JOB_LOG_DIR, f"{job_id}.jsonl")
+
+def _read_log(job_id: str, offset: int) -> Tuple[List[str], int]:
+    # Returns the complete lines after offset; a line still being written is left for the next read
+    try:
+        with open(_log_path(job_id), "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], offset
+    end = data.rfind(b"\n") + 1
+    lines = [line.decode("utf-8") for line in data[:end].split(b"\n") if line.strip()]
+    return lines, offset + end
+
+_jobs: Dict[str, StreamJob] = {}
+_coalesced = 0
+_heartbeat_task: Optional[asyncio.Task] = None
+
+async def _heartbeat() -> None:
+    """
+    Keeps this worker's running jobs marked alive, applies cancel requests
+    made through other workers and cancels runs that no client has followed
+    for STREAM_ORPHAN_GRACE_SECONDS.
+    """
+    while True:
+        await asyncio.sleep(STREAM_HEARTBEAT_SECONDS)
+        running = [job for job in _jobs.values() if not job.remote and not job.finished]
+        if not running:
+            continue
+        try:
+            states = await asyncio.to_thread(_get_table().heartbeat, [job.id for job in running])
+        except Exception as e:
+            print(f"Error sending job heartbeat: {e}")
+            continue
+        now = time.time()
+        for job in running:
+            followers, cancel_requested = states.get(job.id, (0, 0))
+            if cancel_requested:
+                job.cancel("client_stop")
+            elif followers > 0:
+                job.orphaned_since = None
+            elif job.orphaned_since is None:
+                # Give the client time to reconnect before dropping the work
+                job.orphaned_since = now
+            elif now - job.orphaned_since >= STREAM_ORPHAN_GRACE_SECONDS:
+                job.cancel("client_disconnected")
+
+def _prune() -> None:
+    now = time.time()
+    for job_id, job in list(_jobs.items()):
+        if job.finished and now - job.finished_at > STREAM_JOB_MEMORY_TTL:
+            del _jobs[job_id]
+    try:
+        for name in os.listdir(JOB_LOG_DIR):
+            path = os.path.join(JOB_LOG_DIR, name)
+            if name[:-len(".jsonl")] not in _jobs and now - os.path.getmtime(path) > JOB_LOG_TTL_HOURS * 3600:
+                os.remove(path)
+    except OSError:
+        pass
+    _get_table().prune(now - JOB_LOG_TTL_HOURS * 3600)
+
+async def start_stream_job(frames: AsyncIterator[str], key: Optional[str] = None) -> StreamJob:
+    """
+    Starts consuming an SSE generator in the background and returns its job.
+    With a key, identical requests to any worker can join the job while it
+    runs.
+    """
+    global _heartbeat_task
+    await asyncio.to_thread(_prune)
+    job = StreamJob(uuid.uuid4().hex)
+    job.key = key
+    try:
+        os.makedirs(JOB_LOG_DIR, exist_ok=True)
+        job._log = open(_log_path(job.id), "a", encoding="utf-8")
+    except OSError as e:
+        # The run still streams; it just cannot be replayed after a restart
+        print(f"Error opening job event log: {e}")
+    await asyncio.to_thread(_get_table().insert, job.id, key)
+    _jobs[job.id] = job
+    job.task = asyncio.create_task(job._run(frames))
+    if _heartbeat_task is None or _heartbeat_task.done():
+        _heartbeat_task = asyncio.create_task(_heartbeat())
+    return job
+
+def _follow_remote(job_id: str, owner: str) -> StreamJob:
+    job = StreamJob(job_id, remote=True)
+    _jobs[job_id] = job
+    job.task = asyncio.create_task(job._tail(owner))
+    return job
+
+async def join_stream_job(key: Optional[str]) -> Optional[StreamJob]:
+    """
+    Returns the running job started for the same request key by any worker,
+    adding the caller as a subscriber, or None if there is none to join.
+    """
+    global _coalesced
+    if key is None:
+        return None
+    joined = await asyncio.to_thread(_get_table().join, key)
+    if joined is None:
+        return None
+    job_id, owner = joined
+    job = _jobs.get(job_id)
+    if job is None or (job.remote and job.finished):
+        job = _follow_remote(job_id, owner)
+    _coalesced += 1
+    return job
+
+async def get_stream_job(job_id: str) -> Optional[StreamJob]:
+    """
+    Returns a running or recently finished job. A job still running on
+    another worker is followed through its event log; a finished one is
+    reloaded from its log. A log without a final event belongs to a run that
+    was interrupted by a restart; it is replayed and closed with an error
+    event.
+    """
+    job = _jobs.get(job_id)
+    if job is not None:
+        return job
+    if not _JOB_ID_PATTERN.fullmatch(job_id or ""):
+        return None
+    row = await asyncio.to_thread(_get_table().get, job_id)
+    if (
+        row is not None
+        and row["status"] == "running"
+        and row["owner"] != worker_id()
+        and time.time() - row["heartbeat"] <= STREAM_OWNER_TIMEOUT
+    ):
+        return _follow_remote(job_id, row["owner"])
+    if not os.path.exists(_log_path(job_id)):
+        return None
+    try:
+        events, _ = await asyncio.to_thread(_read_log, job_id, 0)
+    except OSError as e:
+        print(f"Error reading job event log {job_id}: {e}")
+        return None
+    if not (events and _is_final(events[-1])):
+        events.append(_INTERRUPTED)
+    job = StreamJob(job_id, events, finished=True)
+    _jobs[job_id] = job
+    return job
+
+def stream_job_stats() -> Dict:
+    """
+    Returns the number of streams running on this worker and of requests
+    that joined a running stream.
+    """
+    return {
+        "running": sum(1 for job in _jobs.values() if not job.finished and not job.remote),
+        "coalesced": _coalesced,
+    }
+
+def parse_last_event_id(value: Optional[str]) -> Optional[Tuple[str, int]]:
+    """
+    Splits a Last-Event-ID of "<job_id>:<seq>" into its parts.
+    """
+    if not value or ":" not in value:
+        return None
+    job_id, _, seq = value.strip().partition(":")
+    if not _JOB_ID_PATTERN.fullmatch(job_id) or not seq.isdigit():
+        return None
+    return job_id, int(seq)
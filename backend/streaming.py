@@ -4,16 +4,224 @@ Enables progressive display of test cases as they're generated
 """
 import json
 import asyncio
-from typing import AsyncGenerator
-from backend.nodes.loader import load_document
-from backend.nodes.splitter import split_text
-from backend.nodes.vector_store import store_vectors
+import hashlib
+import os
+import threading
+from typing import AsyncGenerator, Optional
+from backend.nodes.ingestion_pipeline import run_ingestion_pipeline
 from backend.nodes.feature_extractor import extract_features, should_extract_features
 from backend.nodes.retrieval import retrieve_chunks
-from backend.nodes.generation import generate_test_cases
-from backend.nodes.validation import check_hallucinations
+from backend.nodes.generation import stream_test_cases, describe_generation_error
+from backend.nodes.validation import (
+    VALIDATION_BATCH_SIZE,
+    VALIDATION_CONCURRENCY,
+    build_batch_validation_chain,
+    build_validation_chain,
+    validate_test_case_batch,
+)
+from backend.nodes.batch_processor import FEATURE_CONCURRENCY, prefetch_retrievals
+from backend.nodes.ingestion_cache import hash_file, lookup_ingestion, record_ingestion, uploaded_hash
+from backend.nodes.llm_provider import get_model_name, get_provider_name
+from backend.nodes.cancellation import is_cancelled, record_skipped, with_current_context
+from backend.nodes.context_packer import pack_context
 
-async def stream_test_case_generation(file_path: str, feature_name: str, test_case_limit: int = None, url: str = None) -> AsyncGenerator[str, None]:
+def _sse(payload) -> str:
+    """
+    Formats a payload as a Server-Sent Events data frame.
+    """
+    return f"data: {json.dumps(payload)}\n\n"
+
+def _build_validation_chains():
+    batch_chain = build_batch_validation_chain() if VALIDATION_BATCH_SIZE > 1 else None
+    return build_validation_chain(), batch_chain
+
+async def _iterate_in_thread(make_iterator):
+    """
+    Runs a blocking iterator in a worker thread and yields its items on the
+    event loop as they are produced. Closing this generator stops the worker
+    at its next item, which also closes the underlying LLM stream. The worker
+    runs with the caller's context, so it sees the run's cancel token.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
+    
+    def run():
+        try:
+            iterator = make_iterator()
+            try:
+                for item in iterator:
+                    if stop.is_set() or is_cancelled():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+            finally:
+                close = getattr(iterator, "close", None)
+                if close:
+                    close()
+            loop.call_soon_threadsafe(queue.put_nowait, (done, None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (done, e))
+    
+    worker = loop.run_in_executor(None, with_current_context(run))
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is done:
+                if error:
+                    raise error
+                break
+            yield item
+    finally:
+        stop.set()
+        # Let the worker finish in the background; it exits at its next item
+        worker.add_done_callback(lambda f: f.exception())
+
+async def _iterate_list(items):
+    for item in items:
+        yield item
+
+async def _validate_stream(test_case_source, context, chain, batch_chain):
+    """
+    Validates test cases from an async source while the source is still
+    producing them, with up to VALIDATION_CONCURRENCY calls in flight.
+    Test cases are grouped into batches of VALIDATION_BATCH_SIZE in arrival order.
+    
+    Yields:
+        (index, validated_test_case, error) as soon as each verdict arrives;
+        index is the arrival position so callers can restore the order
+    
+    Raises:
+        Exception: Re-raises errors from the source (e.g. a failed generation)
+    """
+    semaphore = asyncio.Semaphore(VALIDATION_CONCURRENCY)
+    results = asyncio.Queue()
+    tasks = []
+    
+    async def run_batch(start, batch):
+        async with semaphore:
+            outcomes = await asyncio.to_thread(validate_test_case_batch, batch, context, chain, batch_chain)
+        await results.put(("batch", start, outcomes))
+    
+    async def produce():
+        pending = []
+        start = 0
+        try:
+            async for test_case in test_case_source:
+                pending.append(test_case)
+                if len(pending) >= VALIDATION_BATCH_SIZE:
+                    tasks.append(asyncio.create_task(run_batch(start, pending)))
+                    start += len(pending)
+                    pending = []
+            if pending:
+                tasks.append(asyncio.create_task(run_batch(start, pending)))
+            await results.put(("done", len(tasks), None))
+        except Exception as e:
+            await results.put(("error", e, None))
+    
+    producer = asyncio.create_task(produce())
+    expected = None
+    finished = 0
+    try:
+        while expected is None or finished < expected:
+            kind, value, outcomes = await results.get()
+            if kind == "error":
+                raise value
+            if kind == "done":
+                expected = value
+                continue
+            finished += 1
+            for offset, (validated_tc, error) in enumerate(outcomes):
+                yield value + offset, validated_tc, error
+    finally:
+        producer.cancel()
+        skipped = sum(1 for task in tasks if not task.done())
+        if skipped:
+            record_skipped("validation_batches_skipped", skipped)
+        for task in tasks:
+            task.cancel()
+
+async def _process_feature(state, idx, feature, queue, semaphore, results, retrieved_chunks=None):
+    """
+    Runs retrieve -> generate -> validate for one feature, pushing SSE payloads
+    onto the queue as test cases are validated. The per-feature summary is
+    stored in results[idx - 1] so the final aggregate keeps extraction order.
+    Retrieval is skipped when the chunks were already fetched in bulk.
+    """
+    feature_name = feature.get("name", f"Feature {idx}")
+    feature_desc = feature.get("description", "")
+    summary = {"name": feature_name, "description": feature_desc, "test_case_count": 0, "issues": []}
+    results[idx - 1] = summary
+
+    try:
+        async with semaphore:
+            feature_state = {
+                **state,
+                "feature_name": feature_name,
+                "retrieved_chunks": [],
+                "generated_test_cases": [],
+            }
+            
+            # Retrieve chunks unless they were prefetched
+            if retrieved_chunks is not None:
+                feature_state["retrieved_chunks"] = retrieved_chunks
+            else:
+                feature_state = await asyncio.to_thread(retrieve_chunks, feature_state)
+            
+            retrieved_chunks = feature_state["retrieved_chunks"]
+            context = pack_context(retrieved_chunks, "validation")
+            chain, batch_chain = _build_validation_chains()
+            
+            # Generate from the token stream and validate each test case as soon as it closes
+            issues = []
+            generated = _iterate_in_thread(lambda: stream_test_cases(feature_state))
+            try:
+                async for index, validated_tc, error in _validate_stream(generated, context, chain, batch_chain):
+                    if error:
+                        issues.append((index, error))
+                    
+                    # Add feature info
+                    validated_tc["feature"] = feature_name
+                    validated_tc["feature_description"] = feature_desc
+                    summary["test_case_count"] += 1
+                    
+                    await queue.put({'type': 'test_case', 'test_case': validated_tc, 'feature': feature_name, 'feature_index': idx, 'index': index})
+            except Exception as e:
+                error_message = describe_generation_error(str(e))["error"]
+                print(f"ERROR in generation for {feature_name}: {error_message}")
+                summary["error"] = f"Error for {feature_name}: {error_message}"
+                await queue.put({'type': 'error', 'message': summary["error"], 'feature': feature_name, 'feature_index': idx})
+            
+            # Report issues in the original test case order
+            summary["issues"] = [error for _, error in sorted(issues, key=lambda item: item[0])]
+    except Exception as e:
+        print(f"Error processing feature '{feature_name}': {e}")
+        summary["error"] = f"Error processing feature '{feature_name}': {str(e)}"
+        await queue.put({'type': 'error', 'message': summary["error"], 'feature': feature_name, 'feature_index': idx})
+    finally:
+        # Signal completion of this feature; the consumer fills in the count
+        await queue.put({'type': 'progress', 'feature': feature_name, 'feature_index': idx})
+
+def generation_key(file_path: str, feature_name: str, test_case_limit: int = None, url: str = None, content_hash: str = None) -> Optional[str]:
+    """
+    Identifies requests that produce the same stream: same document content
+    (or URL), feature, test case limit and model. Hashes the file unless its
+    upload hash is given, so call it off the event loop.
+    
+    Returns:
+        Hex key, or None if the input document does not exist
+    """
+    if url:
+        document = f"url:{url.strip()}"
+    elif file_path and os.path.exists(file_path):
+        document = uploaded_hash(file_path, content_hash) or hash_file(file_path)
+    else:
+        return None
+    provider = get_provider_name()
+    parts = [document, " ".join(feature_name.lower().split()), str(test_case_limit), provider, get_model_name(provider)]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+async def stream_test_case_generation(file_path: str, feature_name: str, test_case_limit: int = None, url: str = None, content_hash: str = None) -> AsyncGenerator[str, None]:
     """
     Stream test case generation using Server-Sent Events.
     Yields events as test cases are generated in real-time.
@@ -23,13 +231,14 @@ async def stream_test_case_generation(file_path: str, feature_name: str, test_ca
         feature_name: Feature name to generate test cases for
         test_case_limit: Optional limit on number of test cases
         url: Optional URL to fetch requirements from
+        content_hash: Optional content hash returned by the upload endpoint
         
     Yields:
         SSE formatted strings with event data
     """
     try:
         # Send initial status
-        yield f"data: {json.dumps({'type': 'status', 'message': 'Loading document...'})}\n\n"
+        yield _sse({'type': 'status', 'message': 'Loading document...'})
         
         # Step 1: Load and process document
         # Initialize state with inputs and placeholders
@@ -38,195 +247,129 @@ async def stream_test_case_generation(file_path: str, feature_name: str, test_ca
             "feature_name": feature_name,
             "test_case_limit": test_case_limit,
             "url": url,
+            "content_hash": content_hash,
             "documents": [],
             "chunks": [],
         }
         
-        # Load document
-        state = await asyncio.to_thread(load_document, state)
-        yield f"data: {json.dumps({'type': 'status', 'message': 'Splitting text...'})}\n\n"
-        
-        # Split text
-        state = await asyncio.to_thread(split_text, state)
-        yield f"data: {json.dumps({'type': 'status', 'message': 'Creating vector store...'})}\n\n"
+        # Reuse a previous ingestion of the same content if there is one
+        state = await asyncio.to_thread(lookup_ingestion, state)
         
-        # Store vectors (merge result)
-        try:
-            vector_result = await asyncio.to_thread(store_vectors, state)
-            state = {**state, **vector_result}
-        except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'message': f'Error creating vector store: {str(e)}'})}\n\n"
-            return
+        if state.get("ingestion_cached"):
+            yield _sse({'type': 'status', 'message': 'Using cached document index...'})
+        else:
+            # Load, split and embed with the stages overlapped, reporting progress
+            pipeline_state = state
+            async for event in _iterate_in_thread(lambda: run_ingestion_pipeline(pipeline_state)):
+                if event['type'] == 'done':
+                    state = event['state']
+                else:
+                    yield _sse(event)
+            
+            await asyncio.to_thread(record_ingestion, state)
         
         # Step 2: Determine if batch mode
         mode = should_extract_features(state)
         
         if mode == "extract":
             # Batch mode - extract features and process each
-            yield f"data: {json.dumps({'type': 'status', 'message': 'Extracting features...'})}\n\n"
+            yield _sse({'type': 'status', 'message': 'Extracting features...'})
             
-            state = await asyncio.to_thread(extract_features, state)
+            extract_result = await asyncio.to_thread(extract_features, state)
+            state = {**state, **extract_result}
             if state.get("error"):
-                yield f"data: {json.dumps({'type': 'error', 'message': state['error']})}\n\n"
+                yield _sse({'type': 'error', 'message': state['error']})
                 return
             
             features = state.get("extracted_features", [])
             total_features = len(features)
             
-            yield f"data: {json.dumps({'type': 'batch_start', 'total_features': total_features})}\n\n"
-            
-            # Process each feature and stream results
-            for idx, feature in enumerate(features, 1):
-                feature_name = feature.get("name", f"Feature {idx}")
-                feature_desc = feature.get("description", "")
-                
-                # Send progress
-                yield f"data: {json.dumps({'type': 'progress', 'current': idx, 'total': total_features, 'feature': feature_name})}\n\n"
-                
-                # Process this feature
-                feature_state = {
-                    **state,
-                    "feature_name": feature_name,
-                    "retrieved_chunks": [],
-                    "generated_test_cases": [],
-                }
-                
-                # Retrieve chunks
-                feature_state = await asyncio.to_thread(retrieve_chunks, feature_state)
-                
-                # Generate test cases
-                try:
-                    gen_result = await asyncio.to_thread(generate_test_cases, feature_state)
-                    feature_state = {**feature_state, **gen_result}
-                except Exception as e:
-                    print(f"ERROR in generation for {feature_name}: {e}")
-                    yield f"data: {json.dumps({'type': 'error', 'message': f'Error generating for {feature_name}: {str(e)}'})}\n\n"
-                    continue
-
-                if feature_state.get("error"):
-                    print(f"ERROR returned for {feature_name}: {feature_state['error']}")
-                    yield f"data: {json.dumps({'type': 'error', 'message': f"Error for {feature_name}: {feature_state['error']}"})}\n\n"
-                    continue
-                
-                # Initialize validation components for this feature
-                from backend.nodes.validation import validate_single_test_case
-                from backend.nodes.llm_provider import get_llm
-                from langchain_core.prompts import PromptTemplate
-                from langchain_core.output_parsers import JsonOutputParser
-                
-                retrieved_chunks = feature_state["retrieved_chunks"]
-                context = "\n\n".join([doc.page_content for doc in retrieved_chunks])
-                
-                llm = get_llm(temperature=0, format_json=True)
-                prompt_template = """
-                You are a QA auditor. Verify that the following test case is supported by the provided requirement text.
-                
-                Requirement Text:
-                {context}
-                
-                Test Case:
-                {test_case}
-                
-                Instructions:
-                1. Check if the test case steps and expected results are derived from the requirements.
-                2. Be lenient with exact wording; look for semantic meaning.
-                3. If the test case is a standard app behavior (like "Open app") implied by the feature, consider it supported.
-                4. Only flag as unsupported if it explicitly contradicts the requirements or mentions features completely absent from the text.
-                
-                Return a JSON object with:
-                "supported": boolean,
-                "reason": string (explanation if not supported, otherwise "Supported")
-                """
-                prompt = PromptTemplate(template=prompt_template, input_variables=["context", "test_case"])
-                chain = prompt | llm | JsonOutputParser()
-                
-                # Stream each test case after validation
-                test_cases = feature_state.get("generated_test_cases", [])
-                
-                for tc in test_cases:
-                    # Validate individually
-                    validated_tc, error = await asyncio.to_thread(validate_single_test_case, tc, context, chain)
-                    
-                    # Add feature info
-                    validated_tc["feature"] = feature_name
-                    validated_tc["feature_description"] = feature_desc
-                    
-                    # Stream immediately
-                    yield f"data: {json.dumps({'type': 'test_case', 'test_case': validated_tc, 'feature': feature_name})}\n\n"
+            yield _sse({'type': 'batch_start', 'total_features': total_features, 'concurrency': FEATURE_CONCURRENCY})
+            
+            # One embedding request and one query for all features
+            prefetched = await asyncio.to_thread(prefetch_retrievals, state, features)
+            
+            # Process features concurrently and stream results as they arrive
+            queue = asyncio.Queue()
+            semaphore = asyncio.Semaphore(FEATURE_CONCURRENCY)
+            results = [None] * total_features
+            tasks = [
+                asyncio.create_task(_process_feature(state, idx, feature, queue, semaphore, results, prefetched[idx - 1]))
+                for idx, feature in enumerate(features, 1)
+            ]
+            
+            try:
+                completed = 0
+                while completed < total_features:
+                    payload = await queue.get()
+                    if payload['type'] == 'progress':
+                        completed += 1
+                        payload = {**payload, 'current': completed, 'total': total_features}
+                    yield _sse(payload)
                     await asyncio.sleep(0.01)  # Small delay for smooth streaming
+            finally:
+                # Do not leave feature workers running if the client went away
+                skipped = sum(1 for task in tasks if not task.done())
+                if skipped:
+                    record_skipped("features_skipped", skipped)
+                for task in tasks:
+                    task.cancel()
             
-            # Send completion
-            yield f"data: {json.dumps({'type': 'complete', 'result': {'hallucination_report': {'found_issues': False, 'issues': []}}})}\n\n"
+            # Aggregate in extraction order so the final report is deterministic
+            issues = []
+            for summary in results:
+                issues.extend(summary["issues"])
+                if summary.get("error"):
+                    issues.append(summary["error"])
+            
+            result = {
+                'hallucination_report': {'found_issues': len(issues) > 0, 'issues': issues},
+                'features_processed': [
+                    {'name': s['name'], 'description': s['description'], 'test_case_count': s['test_case_count']}
+                    for s in results
+                ],
+                'total_features': total_features,
+                'total_test_cases': sum(s['test_case_count'] for s in results),
+            }
+            yield _sse({'type': 'complete', 'result': result})
             
         else:
             # Single feature mode
-            yield f"data: {json.dumps({'type': 'status', 'message': f'Generating test cases for {feature_name}...'})}\n\n"
+            yield _sse({'type': 'status', 'message': f'Generating test cases for {feature_name}...'})
             
             # Retrieve chunks (merge)
             retrieve_result = await asyncio.to_thread(retrieve_chunks, state)
             state = {**state, **retrieve_result}
             
-            # Generate test cases (merge)
-            gen_result = await asyncio.to_thread(generate_test_cases, state)
-            state = {**state, **gen_result}
+            retrieved_chunks = state["retrieved_chunks"]
+            context = pack_context(retrieved_chunks, "validation")
+            chain, batch_chain = _build_validation_chains()
             
-            if state.get("error"):
-                yield f"data: {json.dumps({'type': 'error', 'message': state['error']})}\n\n"
-                return
+            # Generate from the token stream; each test case goes to validation the moment it closes
+            errors_by_index = {}
+            validated_by_index = {}
+            generated = _iterate_in_thread(lambda: stream_test_cases(state))
             
-            # Initialize validation components
-            from backend.nodes.validation import validate_single_test_case
-            from backend.nodes.llm_provider import get_llm
-            from langchain_core.prompts import PromptTemplate
-            from langchain_core.output_parsers import JsonOutputParser
+            try:
+                async for index, validated_tc, error in _validate_stream(generated, context, chain, batch_chain):
+                    if error:
+                        errors_by_index[index] = error
+                    
+                    validated_by_index[index] = validated_tc
+                    
+                    # Stream immediately, with the original position for ordering
+                    yield _sse({'type': 'test_case', 'test_case': validated_tc, 'index': index})
+                    await asyncio.sleep(0.01)
+            except Exception as e:
+                error_message = describe_generation_error(str(e))["error"]
+                print(f"Error generating test cases: {error_message}")
+                yield _sse({'type': 'error', 'message': error_message})
+                return
             
-            retrieved_chunks = state["retrieved_chunks"]
-            context = "\n\n".join([doc.page_content for doc in retrieved_chunks])
-            
-            llm = get_llm(temperature=0, format_json=True)
-            prompt_template = """
-            You are a QA auditor. Verify that the following test case is supported by the provided requirement text.
-            
-            Requirement Text:
-            {context}
-            
-            Test Case:
-            {test_case}
-            
-            Instructions:
-            1. Check if the test case steps and expected results are derived from the requirements.
-            2. Be lenient with exact wording; look for semantic meaning.
-            3. If the test case is a standard app behavior (like "Open app") implied by the feature, consider it supported.
-            4. Only flag as unsupported if it explicitly contradicts the requirements or mentions features completely absent from the text.
-            
-            Return a JSON object with:
-            "supported": boolean,
-            "reason": string (explanation if not supported, otherwise "Supported")
-            """
-            prompt = PromptTemplate(template=prompt_template, input_variables=["context", "test_case"])
-            chain = prompt | llm | JsonOutputParser()
-            
-            # Stream each test case after validation
-            test_cases = state.get("generated_test_cases", [])
-            hallucination_errors = []
-            validated_test_cases = []
-            
-            for tc in test_cases:
-                # Validate individually
-                validated_tc, error = await asyncio.to_thread(validate_single_test_case, tc, context, chain)
-                
-                if error:
-                    hallucination_errors.append(error)
-                
-                validated_test_cases.append(validated_tc)
-                
-                # Stream immediately
-                yield f"data: {json.dumps({'type': 'test_case', 'test_case': validated_tc})}\n\n"
-                await asyncio.sleep(0.01)
-            
-            # Update state with validation results
+            # Update state with validation results in the original order
+            hallucination_errors = [errors_by_index[i] for i in sorted(errors_by_index)]
             state["hallucination_errors"] = hallucination_errors
-            state["generated_test_cases"] = validated_test_cases
+            state["generated_test_cases"] = [validated_by_index[i] for i in sorted(validated_by_index)]
             
             # Send completion
             result = {
@@ -235,9 +378,9 @@ async def stream_test_case_generation(file_path: str, feature_name: str, test_ca
                     "issues": hallucination_errors
                 }
             }
-            yield f"data: {json.dumps({'type': 'complete', 'result': result})}\n\n"
+            yield _sse({'type': 'complete', 'result': result})
         
     except Exception as e:
         # Send error event
         error_msg = str(e)
-        yield f"data: {json.dumps({'type': 'error', 'message': error_msg})}\n\n"
+        yield _sse({'type': 'error', 'message': error_msg})
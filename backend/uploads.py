@@ -0,0 +1,59 @@
+"""
+Upload Storage
+Streams uploaded files to disk in blocks off the event loop while hashing
+them, and stores them content-addressed, so re-uploading a file returns the
+existing copy and its hash matches the ingestion cache key.
+"""
+import asyncio
+import hashlib
+import os
+import uuid
+
+from fastapi import UploadFile
+
+UPLOAD_DIR = "uploads"
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+
+def _write_block(f, digest, block: bytes) -> None:
+    digest.update(block)
+    f.write(block)
+
+async def save_upload(file: UploadFile) -> dict:
+    """
+    Saves an upload as uploads/<sha256><ext>.
+
+    Returns:
+        Dict with file_path, filename, content_hash and deduplicated (True
+        when the same content was already stored)
+    """
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    file_extension = os.path.splitext(file.filename or "")[1]
+    tmp_path = os.path.join(UPLOAD_DIR, f".upload-{uuid.uuid4()}{file_extension}.tmp")
+    digest = hashlib.sha256()
+
+    try:
+        with open(tmp_path, "wb") as f:
+            while True:
+                block = await file.read(UPLOAD_BLOCK_SIZE)
+                if not block:
+                    break
+                await asyncio.to_thread(_write_block, f, digest, block)
+
+        content_hash = digest.hexdigest()
+        file_path = os.path.join(UPLOAD_DIR, f"{content_hash}{file_extension}")
+        deduplicated = os.path.exists(file_path)
+        if deduplicated:
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return {
+        "file_path": file_path,
+        "filename": file.filename,
+        "content_hash": content_hash,
+        "deduplicated": deduplicated,
+    }
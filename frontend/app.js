@@ -12,6 +12,7 @@ const exportBtn = document.getElementById('export-btn');
 const exportMenu = document.getElementById('export-menu');
 
 let uploadedFilePath = null;
+let uploadedContentHash = null;
 window.generatedTestCases = []; // Store test cases for export (globally accessible)
 
 // Drag & Drop Events
@@ -54,6 +55,7 @@ function handleFile(file) {
         .then(response => response.json())
         .then(data => {
             uploadedFilePath = data.file_path;
+            uploadedContentHash = data.content_hash || null;
             fileInfo.textContent = `Uploaded: ${data.filename}`;
             checkEnableGenerate();
         })
@@ -71,6 +73,7 @@ urlInput.addEventListener('input', () => {
         dropZone.classList.add('disabled');
         document.getElementById('file-input').disabled = true;
         uploadedFilePath = null;
+        uploadedContentHash = null;
         fileInfo.textContent = '';
         fileInfo.classList.add('hidden');
     } else {
@@ -96,6 +99,7 @@ function checkEnableGenerate() {
 }
 
 let abortController = null;
+let currentJobId = null;
 const stopBtn = document.getElementById('stop-btn');
 
 stopBtn.addEventListener('click', () => {
@@ -103,6 +107,13 @@ stopBtn.addEventListener('click', () => {
         abortController.abort();
         abortController = null;
 
+        // The run outlives the connection, so ask the server to stop it too
+        if (currentJobId) {
+            fetch(`http://127.0.0.1:8000/generate-stream/${currentJobId}/cancel`, { method: 'POST' })
+                .catch(error => console.error('Cancel error:', error));
+            currentJobId = null;
+        }
+
         // Update UI immediately
         stopBtn.classList.add('hidden');
         generateBtn.disabled = false;
@@ -144,21 +155,60 @@ generateBtn.addEventListener('click', () => {
 
     // Initialize AbortController
     abortController = new AbortController();
+    currentJobId = null;
+
+    const requestBody = JSON.stringify({
+        file_path: uploadedFilePath || "",
+        content_hash: uploadedContentHash,
+        feature_name: featureName,
+        test_case_limit: testCaseLimit ? parseInt(testCaseLimit) : null,
+        url: url || null
+    });
+    openGenerationStream(requestBody, abortController.signal, null, 0);
+});
+
+// Reconnect attempts after a dropped stream before giving up
+const MAX_STREAM_RETRIES = 5;
+
+function resetGenerateButton() {
+    generateBtn.disabled = false;
+    generateBtn.querySelector('.btn-text').textContent = 'Generate Test Cases';
+    generateBtn.querySelector('.loader').classList.add('hidden');
+    stopBtn.classList.add('hidden');
+}
+
+function isFinalEvent(data) {
+    // Per-feature errors carry the feature name; the run goes on after them
+    return data.type === 'complete' || (data.type === 'error' && !data.feature);
+}
+
+function openGenerationStream(requestBody, signal, lastEventId, retries) {
+    const headers = {
+        'Content-Type': 'application/json',
+        'Accept': 'text/event-stream'
+    };
+    // Reattach to the running job instead of starting it over
+    if (lastEventId) {
+        headers['Last-Event-ID'] = lastEventId;
+    }
+    let finished = false;
+
+    function reconnect() {
+        if (signal.aborted) return;
+        console.log(`Stream interrupted, reattaching after event ${lastEventId}`);
+        setTimeout(() => {
+            if (!signal.aborted) {
+                openGenerationStream(requestBody, signal, lastEventId, retries + 1);
+            }
+        }, 1000 * (retries + 1));
+    }
 
     // Use fetch with ReadableStream for streaming
     fetch('http://127.0.0.1:8000/generate-stream', {
         method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-            'Accept': 'text/event-stream'
-        },
-        body: JSON.stringify({
-            file_path: uploadedFilePath || "",
-            feature_name: featureName,
-            test_case_limit: testCaseLimit ? parseInt(testCaseLimit) : null,
-            url: url || null
-        }),
-        signal: abortController.signal
+        headers: headers,
+        body: requestBody,
+        signal: signal
     })
         .then(response => {
             const reader = response.body.getReader();
@@ -168,21 +218,32 @@ generateBtn.addEventListener('click', () => {
             function processStream() {
                 reader.read().then(({ done, value }) => {
                     if (done) {
+                        if (!finished && lastEventId && retries < MAX_STREAM_RETRIES) {
+                            reconnect();
+                            return;
+                        }
                         console.log('Stream complete');
-                        generateBtn.disabled = false;
-                        generateBtn.querySelector('.btn-text').textContent = 'Generate Test Cases';
-                        generateBtn.querySelector('.loader').classList.add('hidden');
-                        stopBtn.classList.add('hidden'); // Hide stop button
+                        resetGenerateButton();
                         return;
                     }
 
                     buffer += decoder.decode(value, { stream: true });
-                    const lines = buffer.split('\n\n');
-                    buffer = lines.pop(); // Keep incomplete line in buffer
-
-                    lines.forEach(line => {
-                        if (line.startsWith('data: ')) {
-                            const data = JSON.parse(line.substring(6));
+                    const frames = buffer.split('\n\n');
+                    buffer = frames.pop(); // Keep incomplete frame in buffer
+
+                    frames.forEach(frame => {
+                        let data = null;
+                        frame.split('\n').forEach(line => {
+                            if (line.startsWith('data: ')) {
+                                data = JSON.parse(line.substring(6));
+                            } else if (line.startsWith('id: ')) {
+                                lastEventId = line.substring(4);
+                                currentJobId = lastEventId.split(':')[0];
+                            }
+                        });
+                        if (data) {
+                            retries = 0;
+                            finished = finished || isFinalEvent(data);
                             handleStreamEvent(data);
                         }
                     });
@@ -191,13 +252,12 @@ generateBtn.addEventListener('click', () => {
                 }).catch(error => {
                     if (error.name === 'AbortError') {
                         console.log('Fetch aborted');
+                    } else if (lastEventId && retries < MAX_STREAM_RETRIES) {
+                        reconnect();
                     } else {
                         console.error('Stream error:', error);
                         displayError('An error occurred during generation.', 'stream_error');
-                        generateBtn.disabled = false;
-                        generateBtn.querySelector('.btn-text').textContent = 'Generate Test Cases';
-                        generateBtn.querySelector('.loader').classList.add('hidden');
-                        stopBtn.classList.add('hidden');
+                        resetGenerateButton();
                     }
                 });
             }
@@ -207,16 +267,15 @@ generateBtn.addEventListener('click', () => {
         .catch(error => {
             if (error.name === 'AbortError') {
                 console.log('Fetch aborted');
+            } else if (lastEventId && retries < MAX_STREAM_RETRIES) {
+                reconnect();
             } else {
                 console.error('Fetch error:', error);
                 displayError('Failed to connect to server.', 'connection_error');
-                generateBtn.disabled = false;
-                generateBtn.querySelector('.btn-text').textContent = 'Generate Test Cases';
-                generateBtn.querySelector('.loader').classList.add('hidden');
-                stopBtn.classList.add('hidden');
+                resetGenerateButton();
             }
         });
-});
+}
 
 function displayResults(data) {
     resultsSection.classList.remove('hidden');
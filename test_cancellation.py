@@ -0,0 +1,113 @@
+"""
+Test script for cancelling in-flight model calls: a slow stand-in model is
+cancelled mid-request and must stop at once, not run to completion.
+Runs without an LLM server.
+"""
+import asyncio
+import threading
+import time
+
+from langchain_core.messages import AIMessage
+from langchain_core.prompts import PromptTemplate
+
+from backend.nodes import validation
+from backend.nodes.cancellation import CancelToken, GenerationCancelled, get_cancellation_stats, set_current_token
+from backend.nodes.llm_cache import CachedChain
+
+class SlowModel:
+    """Answers after a long delay and records whether it was cut off"""
+    temperature = 1  # Not cached
+
+    def __init__(self, delay=5):
+        self.delay = delay
+        self.aborted = threading.Event()
+
+    async def ainvoke(self, prompt):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.aborted.set()
+            raise
+        return AIMessage(content='{"supported": true, "reason": "Supported"}')
+
+    async def astream(self, prompt):
+        try:
+            # Slow before the first token, like a long prompt being processed
+            await asyncio.sleep(self.delay)
+            yield AIMessage(content="[]")
+        except asyncio.CancelledError:
+            self.aborted.set()
+            raise
+
+def run_cancelled(call, cancel_after=0.2):
+    """Runs call under a fresh cancel token, cancels it, returns (error, seconds)"""
+    token = CancelToken()
+    outcome = {}
+
+    def worker():
+        set_current_token(token)
+        started = time.time()
+        try:
+            call()
+        except Exception as e:
+            outcome["error"] = e
+        outcome["seconds"] = time.time() - started
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    time.sleep(cancel_after)
+    token.cancel("client_stop")
+    thread.join(timeout=5)
+    return outcome.get("error"), outcome.get("seconds")
+
+def make_chain(model):
+    return CachedChain("validation", PromptTemplate.from_template("{question}"), model)
+
+def test_invoke_is_aborted():
+    """A cancelled invoke returns at once and its request is cancelled"""
+    print("Testing abort of an in-flight call...")
+    model = SlowModel()
+    error, seconds = run_cancelled(lambda: make_chain(model).invoke({"question": "?"}))
+    print(f"Returned after {seconds:.2f}s with {error!r}")
+    assert isinstance(error, GenerationCancelled)
+    assert seconds < 1
+    assert model.aborted.wait(1)
+
+def test_stream_is_aborted_before_first_token():
+    """A cancelled stream stops while the model has not answered yet"""
+    print("Testing abort of a stream before its first token...")
+    model = SlowModel()
+    error, seconds = run_cancelled(lambda: list(make_chain(model).stream({"question": "?"})))
+    print(f"Returned after {seconds:.2f}s with {error!r}")
+    assert isinstance(error, GenerationCancelled)
+    assert seconds < 1
+    assert model.aborted.wait(1)
+
+def test_validation_stops_on_cancel():
+    """Validation raises on cancel instead of reporting a hallucination issue"""
+    print("Testing validation of a cancelled run...")
+    chain = CachedChain("validation", PromptTemplate.from_template("{context} {test_case}"), SlowModel())
+    call = lambda: validation.validate_single_test_case({"Test Case ID": "TC1"}, "context", chain)
+    error, _ = run_cancelled(call)
+    assert isinstance(error, GenerationCancelled)
+
+def test_aborted_calls_are_counted():
+    """Aborted calls and streams show up in the cancellation metrics"""
+    stats = get_cancellation_stats()
+    print(f"Cancellation stats: {stats}")
+    assert stats.get("llm_calls_aborted.validation", 0) >= 1
+    assert stats.get("llm_streams_aborted.validation", 0) >= 1
+
+if __name__ == "__main__":
+    print("="*60)
+    print("Cancellation Test")
+    print("="*60)
+
+    test_invoke_is_aborted()
+    test_stream_is_aborted_before_first_token()
+    test_validation_stops_on_cancel()
+    test_aborted_calls_are_counted()
+
+    print("\n" + "="*60)
+    print("✅ ALL TESTS PASSED!")
+    print("="*60)
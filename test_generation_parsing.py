@@ -0,0 +1,89 @@
+"""
+Test script for reading test cases out of LLM replies: wrapper objects from
+JSON modes, lone test cases and error objects, parsed whole and streamed.
+Runs against a stand-in chain, so no LLM is needed.
+"""
+import json
+
+from backend.nodes import generation
+from backend.nodes.json_stream import IncrementalJsonArrayParser
+
+CASE_1 = {"Test Case ID": "TC1", "Description": "Valid login", "Steps": ["Open page", "Submit"], "Expected Result": "Logged in"}
+CASE_2 = {"Test Case ID": "TC2", "Description": "Wrong password", "Steps": ["Open page", "Submit"], "Expected Result": "Error shown"}
+CASE_WITH_STEP_OBJECTS = {
+    "id": "TC3",
+    "Description": "Reset password",
+    "Steps": [{"step": 1, "action": "Click reset"}, {"step": 2, "action": "Open link"}],
+    "Expected Result": "Password changed",
+}
+
+# (reply, expected test cases)
+REPLIES = [
+    ([CASE_1, CASE_2], [CASE_1, CASE_2]),
+    ({"testCases": [CASE_1, CASE_2]}, [CASE_1, CASE_2]),
+    ({"test_cases": [CASE_1]}, [CASE_1]),
+    ({"Test Cases": [CASE_1, CASE_2]}, [CASE_1, CASE_2]),
+    ({"feature": "Login", "results": [CASE_1, CASE_2]}, [CASE_1, CASE_2]),
+    (CASE_1, [CASE_1]),
+    (CASE_WITH_STEP_OBJECTS, [CASE_WITH_STEP_OBJECTS]),
+    ({"error": "nope"}, []),
+    ({"first": [CASE_1], "second": [CASE_2]}, []),
+    ({}, []),
+    ("not json", []),
+]
+
+class StandInChain:
+    """Streams a fixed reply in small fragments"""
+
+    def __init__(self, reply):
+        self.text = json.dumps(reply)
+
+    def stream(self, inputs):
+        for start in range(0, len(self.text), 7):
+            yield self.text[start:start + 7]
+
+def test_extract_reply_shapes():
+    """Whole replies give the expected test cases"""
+    print("Testing parsed reply shapes...")
+    for reply, expected in REPLIES:
+        result = generation._extract_test_cases(reply)
+        print(f"{json.dumps(reply)[:60]} -> {len(result)} test cases")
+        assert result == expected, f"{reply!r} gave {result!r}"
+
+def test_stream_reply_shapes():
+    """Streamed replies give the same test cases as whole ones"""
+    print("Testing streamed reply shapes...")
+    original = generation.get_chain
+    state = {"feature_name": "Login", "retrieved_chunks": [], "test_case_limit": None}
+    try:
+        for reply, expected in REPLIES:
+            if not isinstance(reply, (dict, list)):
+                continue
+            generation.get_chain = lambda stage, reply=reply: StandInChain(reply)
+            result = list(generation.stream_test_cases(state))
+            assert result == expected, f"{reply!r} streamed {result!r}"
+    finally:
+        generation.get_chain = original
+
+def test_parser_streams_wrapper_key():
+    """Test cases under "Test Cases" come out before the reply is complete"""
+    print("Testing incremental parsing under a spaced key...")
+    parser = IncrementalJsonArrayParser()
+    text = json.dumps({"Test Cases": [CASE_1, CASE_2]})
+    # Everything up to the end of the first test case
+    head = text[:text.index("}") + 1]
+    assert parser.feed(head) == [CASE_1]
+    assert parser.feed(text[len(head):]) == [CASE_2]
+
+if __name__ == "__main__":
+    print("="*60)
+    print("Generation Parsing Test")
+    print("="*60)
+
+    test_extract_reply_shapes()
+    test_stream_reply_shapes()
+    test_parser_streams_wrapper_key()
+
+    print("\n" + "="*60)
+    print("✅ ALL TESTS PASSED!")
+    print("="*60)